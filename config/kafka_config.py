@@ -1,10 +1,16 @@
 """
 Kafka Configuration for Uber Clone
 """
-from kafka import KafkaProducer, KafkaConsumer
+from kafka import KafkaProducer, KafkaConsumer, ConsumerRebalanceListener, TopicPartition
 from kafka.admin import KafkaAdminClient, NewTopic
-import json
+from kafka.structs import OffsetAndMetadata
+from prometheus_client import Counter, Gauge, Histogram
 import logging
+import time
+
+from config.serialization import MessageSerializer, MessageDeserializer, location_codec
+from config.worker_pool import KeyedWorkerPool, OffsetTracker
+from config.memory_broker import MemoryProducer, MemoryConsumer, broker as memory_broker
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -13,6 +19,89 @@ import os
 
 # Kafka Configuration
 KAFKA_BOOTSTRAP_SERVERS = [os.getenv('KAFKA_BOOTSTRAP_SERVERS', '127.0.0.1:9093')]
+# 'kafka' uses the brokers above; 'memory' keeps topics inside this process (load tests, profiling)
+KAFKA_TRANSPORT = os.getenv('KAFKA_TRANSPORT', 'kafka')
+
+# Producer batching: wait up to linger_ms to fill a batch, then compress it
+PRODUCER_LINGER_MS = int(os.getenv('KAFKA_PRODUCER_LINGER_MS', '5'))
+PRODUCER_BATCH_SIZE = int(os.getenv('KAFKA_PRODUCER_BATCH_SIZE', '65536'))
+PRODUCER_COMPRESSION = os.getenv('KAFKA_PRODUCER_COMPRESSION', 'gzip') or None
+
+# Batch consumers hand over up to this many records, or whatever arrived within the timeout
+CONSUMER_BATCH_SIZE = int(os.getenv('KAFKA_CONSUMER_BATCH_SIZE', '500'))
+CONSUMER_BATCH_TIMEOUT_MS = int(os.getenv('KAFKA_CONSUMER_BATCH_TIMEOUT_MS', '100'))
+# Pause before a failed batch is delivered again
+CONSUMER_RETRY_BACKOFF_SECONDS = float(os.getenv('KAFKA_CONSUMER_RETRY_BACKOFF_SECONDS', '1'))
+# Worker threads per parallel consumer (0 handles messages on the consumer thread)
+CONSUMER_WORKERS = int(os.getenv('KAFKA_CONSUMER_WORKERS', '0'))
+# Messages a parallel consumer may have queued or running before it stops polling
+CONSUMER_MAX_IN_FLIGHT = int(os.getenv('KAFKA_CONSUMER_MAX_IN_FLIGHT', '1000'))
+CONSUMER_COMMIT_INTERVAL_SECONDS = float(os.getenv('KAFKA_CONSUMER_COMMIT_INTERVAL_SECONDS', '1'))
+
+# How long the plain consumer loop waits in one poll; also bounds how soon it notices a stop
+CONSUMER_POLL_TIMEOUT_MS = int(os.getenv('KAFKA_CONSUMER_POLL_TIMEOUT_MS', '1000'))
+# Consumer lag gauges are refreshed at most this often
+CONSUMER_LAG_INTERVAL_SECONDS = float(os.getenv('KAFKA_CONSUMER_LAG_INTERVAL_SECONDS', '5'))
+
+DELIVERY_FAILURES = Counter(
+    'kafka_producer_delivery_failures_total',
+    'Messages the producer failed to deliver',
+    ['topic']
+)
+
+PRODUCER_MESSAGES = Counter(
+    'kafka_producer_messages_total',
+    'Messages acknowledged by the broker',
+    ['topic']
+)
+
+PRODUCER_BYTES = Counter(
+    'kafka_producer_bytes_total',
+    'Serialized message bytes acknowledged by the broker',
+    ['topic']
+)
+
+SEND_LATENCY = Histogram(
+    'kafka_producer_send_seconds',
+    'Time from send to broker acknowledgement',
+    ['topic']
+)
+
+CONSUMER_MESSAGES = Counter(
+    'kafka_consumer_messages_total',
+    'Messages received by a consumer',
+    ['topic', 'group']
+)
+
+CONSUMER_BYTES = Counter(
+    'kafka_consumer_bytes_total',
+    'Serialized message bytes received by a consumer',
+    ['topic', 'group']
+)
+
+CONSUMER_ERRORS = Counter(
+    'kafka_consumer_errors_total',
+    'Consumer callbacks that raised',
+    ['topic', 'group']
+)
+
+CONSUMER_LAG = Gauge(
+    'kafka_consumer_lag',
+    'Messages between the last one received and the end of the partition',
+    ['topic', 'group', 'partition']
+)
+
+CONSUMER_IN_FLIGHT = Gauge(
+    'kafka_consumer_in_flight_messages',
+    'Messages queued or running in a parallel consumer\'s worker pool',
+    ['topic', 'group']
+)
+
+HANDLER_LATENCY = Histogram(
+    'kafka_consumer_handler_seconds',
+    'Time spent in consumer callbacks (one call per batch in batch mode)',
+    ['topic', 'group']
+)
 
 # Topic Names
 TOPICS = {
@@ -24,8 +113,38 @@ TOPICS = {
 }
 
 
+
+def parse_topic_settings(spec):
+    """Parse 'driver-locations=12,ride-requests=6' into {topic: int}"""
+    settings = {}
+    for part in filter(None, spec.split(',')):
+        topic, value = part.split('=')
+        settings[topic.strip()] = int(value)
+    return settings
+
+
+# Partitions per topic; override with KAFKA_TOPIC_PARTITIONS='driver-locations=12,ride-requests=6'
+TOPIC_PARTITIONS = {topic: 3 for topic in TOPICS.values()}
+TOPIC_PARTITIONS.update(parse_topic_settings(os.getenv('KAFKA_TOPIC_PARTITIONS', '')))
+
+# retention.ms per topic (others keep the broker default); an hour of pings is plenty to replay after a restart
+TOPIC_RETENTION_MS = {TOPICS['DRIVER_LOCATIONS']: 3600000}
+TOPIC_RETENTION_MS.update(parse_topic_settings(os.getenv('KAFKA_TOPIC_RETENTION_MS', '')))
+
+# Topics with a compact binary layout (see config/serialization.py); the rest are JSON
+TOPIC_CODECS = {
+    TOPICS['DRIVER_LOCATIONS']: location_codec,
+}
+
+
 def create_kafka_topics():
     """Create Kafka topics if they don't exist"""
+    if KAFKA_TRANSPORT == 'memory':
+        for topic in TOPICS.values():
+            memory_broker.create_topic(topic, TOPIC_PARTITIONS[topic])
+        logger.info("Topics created in the in-process broker")
+        return
+    
     try:
         admin_client = KafkaAdminClient(
             bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
@@ -34,7 +153,12 @@ def create_kafka_topics():
         )
         
         topic_list = [
-            NewTopic(name=topic, num_partitions=3, replication_factor=1)
+            NewTopic(
+                name=topic,
+                num_partitions=TOPIC_PARTITIONS[topic],
+                replication_factor=1,
+                topic_configs={'retention.ms': str(TOPIC_RETENTION_MS[topic])} if topic in TOPIC_RETENTION_MS else {}
+            )
             for topic in TOPICS.values()
         ]
         
@@ -54,30 +178,37 @@ def create_kafka_topics():
 
 def get_kafka_producer():
     """Create and return a Kafka producer"""
-    return KafkaProducer(
+    producer_class = MemoryProducer if KAFKA_TRANSPORT == 'memory' else KafkaProducer
+    return producer_class(
         bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
         # api_version=(2, 5, 0),
-        value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+        value_serializer=MessageSerializer(TOPIC_CODECS),
         key_serializer=lambda k: k.encode('utf-8') if k else None,
         acks='all',
         retries=3,
-        max_in_flight_requests_per_connection=1
+        # One request in flight keeps retried batches in order (kafka-python has no idempotent producer)
+        max_in_flight_requests_per_connection=1,
+        linger_ms=PRODUCER_LINGER_MS,
+        batch_size=PRODUCER_BATCH_SIZE,
+        compression_type=PRODUCER_COMPRESSION
     )
 
 
-def get_kafka_consumer(topic, group_id):
-    """Create and return a Kafka consumer"""
-    return KafkaConsumer(
-        topic,
+def get_kafka_consumer(topic, group_id, listener=None, auto_commit=True):
+    """Create and return a Kafka consumer; the optional listener sees partition assignments"""
+    consumer_class = MemoryConsumer if KAFKA_TRANSPORT == 'memory' else KafkaConsumer
+    consumer = consumer_class(
         bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
         # api_version=(2, 5, 0),
         group_id=group_id,
-        value_deserializer=lambda v: json.loads(v.decode('utf-8')),
+        value_deserializer=MessageDeserializer(),
         auto_offset_reset='latest',
-        enable_auto_commit=True,
+        enable_auto_commit=auto_commit,
         session_timeout_ms=30000,
         max_poll_interval_ms=300000
     )
+    consumer.subscribe([topic], listener=listener)
+    return consumer
 
 
 class KafkaProducerWrapper:
@@ -104,15 +235,102 @@ class KafkaProducerWrapper:
         
         if self.producer:
             try:
+                started = time.time()
                 future = self.producer.send(topic, value=message, key=key)
-                future.get(timeout=10)
+                # Send now instead of waiting out linger_ms, which only pays off for async sends
+                self.producer.flush(timeout=10)
+                self.record_delivery(topic, started, future.get(timeout=10))
                 logger.info(f"Message sent to {topic}: {message}")
                 return True
             except Exception as e:
                 logger.error(f"Failed to send message to {topic}: {e}")
+                DELIVERY_FAILURES.labels(topic).inc()
                 return False
+        DELIVERY_FAILURES.labels(topic).inc()
         return False
     
+    def send_message_async(self, topic, message, key=None, on_delivery=None):
+        """
+        Queue a message without waiting for the broker. on_delivery(error)
+        is called from the producer's I/O thread, with None once the message
+        is acknowledged. Returns the send future (None if it could not be
+        queued).
+        """
+        if not self.producer:
+            logger.warning("Producer not connected, attempting to reconnect...")
+            self.connect()
+        
+        error = None
+        if self.producer:
+            try:
+                started = time.time()
+                future = self.producer.send(topic, value=message, key=key)
+                future.add_callback(self._delivered, topic, started, on_delivery)
+                future.add_errback(self._failed, topic, on_delivery)
+                return future
+            except Exception as e:
+                error = e
+        
+        logger.error(f"Failed to queue message for {topic}: {error}")
+        DELIVERY_FAILURES.labels(topic).inc()
+        if on_delivery:
+            on_delivery(error or ConnectionError("Producer not connected"))
+        return None
+    
+    @staticmethod
+    def record_delivery(topic, started, metadata):
+        """Count an acknowledged message and its send latency"""
+        SEND_LATENCY.labels(topic).observe(time.time() - started)
+        PRODUCER_MESSAGES.labels(topic).inc()
+        if metadata.serialized_value_size > 0:
+            PRODUCER_BYTES.labels(topic).inc(metadata.serialized_value_size)
+    
+    @classmethod
+    def _delivered(cls, topic, started, on_delivery, metadata):
+        cls.record_delivery(topic, started, metadata)
+        if on_delivery:
+            on_delivery(None)
+    
+    @staticmethod
+    def _failed(topic, on_delivery, error):
+        logger.error(f"Failed to deliver message to {topic}: {error}")
+        DELIVERY_FAILURES.labels(topic).inc()
+        if on_delivery:
+            on_delivery(error)
+    
+    def send_messages(self, topic, messages):
+        """Send a list of (message, key) pairs and wait for them together"""
+        if not self.producer:
+            logger.warning("Producer not connected, attempting to reconnect...")
+            self.connect()
+        
+        if not self.producer:
+            DELIVERY_FAILURES.labels(topic).inc(len(messages))
+            return 0
+        
+        started = time.time()
+        futures = []
+        for message, key in messages:
+            try:
+                futures.append(self.producer.send(topic, value=message, key=key))
+            except Exception as e:
+                logger.error(f"Failed to send message to {topic}: {e}")
+                DELIVERY_FAILURES.labels(topic).inc()
+        
+        self.producer.flush(timeout=10)
+        
+        delivered = 0
+        for future in futures:
+            try:
+                self.record_delivery(topic, started, future.get(timeout=10))
+                delivered += 1
+            except Exception as e:
+                logger.error(f"Failed to send message to {topic}: {e}")
+                DELIVERY_FAILURES.labels(topic).inc()
+        
+        logger.info(f"Sent {delivered}/{len(messages)} messages to {topic}")
+        return delivered
+    
     def close(self):
         """Close the producer"""
         if self.producer:
@@ -120,20 +338,70 @@ class KafkaProducerWrapper:
             logger.info("Kafka producer closed")
 
 
+class WrapperRebalanceListener(ConsumerRebalanceListener):
+    """
+    Moves newly assigned partitions to the wrapper's start offsets, and lets
+    a parallel consumer finish and commit its work before partitions move
+    """
+    
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+    
+    def on_partitions_revoked(self, revoked):
+        if self.wrapper.pool is not None:
+            self.wrapper.drain()
+            self.wrapper.offsets.reset(partition.partition for partition in revoked)
+    
+    def on_partitions_assigned(self, assigned):
+        for partition in assigned:
+            # Only the first assignment resumes from the start offsets
+            offset = self.wrapper.start_offsets.pop(partition.partition, None)
+            if offset is not None:
+                self.wrapper.consumer.seek(partition, offset)
+                logger.info(f"Resuming {partition.topic}[{partition.partition}] from offset {offset}")
+
+
 class KafkaConsumerWrapper:
-    """Wrapper class for Kafka Consumer with error handling"""
+    """
+    Wrapper class for Kafka Consumer with error handling. With batch_size
+    set, the callback receives a list of up to batch_size messages and
+    offsets are committed only once it returns; if it raises, the same
+    messages are delivered again.
+    """
     
-    def __init__(self, topic, group_id, callback):
+    def __init__(self, topic, group_id, callback, start_offsets=None, batch_size=None,
+                 batch_timeout_ms=CONSUMER_BATCH_TIMEOUT_MS, workers=0, max_in_flight=CONSUMER_MAX_IN_FLIGHT):
         self.topic = topic
         self.group_id = group_id
         self.callback = callback
+        self.batch_size = batch_size
+        self.batch_timeout_ms = batch_timeout_ms
+        # With workers, messages run on a pool in per-key order and offsets are committed as they complete
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.pool = None
+        self.offsets = OffsetTracker()
         self.consumer = None
         self.running = False
+        # partition -> offset to resume from when first assigned (warm restart)
+        self.start_offsets = dict(start_offsets or {})
+        # partition -> offset of the next message not yet handed to the callback
+        self.positions = dict(self.start_offsets)
+        # partition -> offset after the last message received, for lag
+        self.received = {}
+        self.lag_reported_at = 0
+        self.messages_received = CONSUMER_MESSAGES.labels(topic, group_id)
+        self.bytes_received = CONSUMER_BYTES.labels(topic, group_id)
+        self.errors = CONSUMER_ERRORS.labels(topic, group_id)
+        self.handler_latency = HANDLER_LATENCY.labels(topic, group_id)
+        self.in_flight = CONSUMER_IN_FLIGHT.labels(topic, group_id)
     
     def connect(self):
         """Connect to Kafka"""
         try:
-            self.consumer = get_kafka_consumer(self.topic, self.group_id)
+            listener = WrapperRebalanceListener(self) if self.start_offsets or self.workers else None
+            self.consumer = get_kafka_consumer(self.topic, self.group_id, listener,
+                                               auto_commit=not (self.batch_size or self.workers))
             logger.info(f"Kafka consumer connected to {self.topic}")
             return True
         except Exception as e:
@@ -148,20 +416,169 @@ class KafkaConsumerWrapper:
         self.running = True
         logger.info(f"Started consuming from {self.topic}")
         
+        if self.batch_size:
+            self.consume_batches()
+            return
+        if self.workers:
+            self.consume_parallel()
+            return
+        
         try:
-            for message in self.consumer:
-                if not self.running:
-                    break
+            while self.running:
+                # The whole poll is handled even after a stop, since auto-commit covers all of it
+                records = self.consumer.poll(timeout_ms=CONSUMER_POLL_TIMEOUT_MS)
+                for messages in records.values():
+                    for message in messages:
+                        self.observe(message)
+                        try:
+                            with self.handler_latency.time():
+                                self.callback(message.value)
+                        except Exception as e:
+                            logger.error(f"Error processing message: {e}")
+                            self.errors.inc()
+                        self.positions[message.partition] = message.offset + 1
+                # Also on empty polls, so an idle consumer reports that it caught up
+                self.report_lag()
+        except Exception as e:
+            logger.error(f"Consumer error: {e}")
+        finally:
+            self.close()
+    
+    def poll_batch(self):
+        """Records received within batch_timeout_ms, at most batch_size, in partition order"""
+        deadline = time.time() + self.batch_timeout_ms / 1000
+        batch = []
+        while self.running and len(batch) < self.batch_size:
+            remaining_ms = int((deadline - time.time()) * 1000)
+            if remaining_ms <= 0:
+                break
+            records = self.consumer.poll(timeout_ms=remaining_ms, max_records=self.batch_size - len(batch))
+            for messages in records.values():
+                for message in messages:
+                    self.observe(message)
+                batch.extend(messages)
+        self.report_lag()
+        return batch
+    
+    def consume_batches(self):
+        """Hand the callback one batch at a time, committing offsets after each success"""
+        try:
+            while self.running:
+                batch = self.poll_batch()
+                if not batch:
+                    continue
                 
                 try:
-                    self.callback(message.value)
+                    with self.handler_latency.time():
+                        self.callback([message.value for message in batch])
                 except Exception as e:
-                    logger.error(f"Error processing message: {e}")
+                    logger.error(f"Error processing batch of {len(batch)} messages, retrying: {e}")
+                    self.errors.inc()
+                    self.rewind(batch)
+                    time.sleep(CONSUMER_RETRY_BACKOFF_SECONDS)
+                    continue
+                
+                for message in batch:
+                    self.positions[message.partition] = message.offset + 1
+                try:
+                    self.consumer.commit()
+                except Exception as e:
+                    # A rebalance took the partitions away; their new owner re-reads the batch
+                    logger.warning(f"Failed to commit offsets for {self.topic}: {e}")
+        except Exception as e:
+            logger.error(f"Consumer error: {e}")
+        finally:
+            self.close()
+    
+    def handle(self, message):
+        """Run the callback for one message on a pool worker"""
+        try:
+            with self.handler_latency.time():
+                self.callback(message.value)
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+            self.errors.inc()
+        finally:
+            self.in_flight.dec()
+            self.offsets.completed(message.partition, message.offset)
+    
+    def consume_parallel(self):
+        """Dispatch messages to the worker pool, keyed so each ride or driver stays in order"""
+        self.pool = KeyedWorkerPool(self.handle, self.workers, self.max_in_flight, name=f"{self.topic}-worker")
+        last_commit = time.time()
+        try:
+            while self.running:
+                records = self.consumer.poll(timeout_ms=100)
+                for messages in records.values():
+                    for message in messages:
+                        self.observe(message)
+                        self.offsets.dispatched(message.partition, message.offset)
+                        self.in_flight.inc()
+                        # Unkeyed messages keep their partition's order
+                        self.pool.submit(message.key or message.partition, message)
+                
+                self.report_lag()
+                if time.time() - last_commit >= CONSUMER_COMMIT_INTERVAL_SECONDS:
+                    self.commit_completed()
+                    last_commit = time.time()
+            self.drain()
         except Exception as e:
             logger.error(f"Consumer error: {e}")
         finally:
+            self.pool.stop()
             self.close()
     
+    def drain(self):
+        """Wait for the pool to finish everything dispatched, then commit it"""
+        if not self.pool.wait_idle(timeout=30):
+            logger.warning(f"Timed out waiting for {self.topic} workers; committing what completed")
+        self.commit_completed()
+    
+    def commit_completed(self):
+        """Commit, per partition, up to the lowest offset that has not completed"""
+        advanced = self.offsets.take()
+        if not advanced:
+            return
+        self.positions.update(advanced)
+        try:
+            self.consumer.commit({
+                TopicPartition(self.topic, partition): OffsetAndMetadata(offset, None)
+                for partition, offset in advanced.items()
+            })
+        except Exception as e:
+            logger.warning(f"Failed to commit offsets for {self.topic}: {e}")
+    
+    def observe(self, message):
+        """Count a received message"""
+        self.messages_received.inc()
+        if message.serialized_value_size > 0:
+            self.bytes_received.inc(message.serialized_value_size)
+        self.received[message.partition] = message.offset + 1
+    
+    def report_lag(self):
+        """Refresh the lag gauges from the consumer's last known high watermarks"""
+        now = time.time()
+        if now - self.lag_reported_at < CONSUMER_LAG_INTERVAL_SECONDS:
+            return
+        self.lag_reported_at = now
+        for topic_partition in self.consumer.assignment():
+            offset = self.received.get(topic_partition.partition)
+            if offset is None:
+                # Nothing received on this partition yet; lag runs from where the consumer will start
+                offset = self.consumer.position(topic_partition)
+            # Known from fetch responses, so no extra broker round trip
+            highwater = self.consumer.highwater(topic_partition)
+            if offset is not None and highwater is not None:
+                CONSUMER_LAG.labels(self.topic, self.group_id, topic_partition.partition).set(max(0, highwater - offset))
+    
+    def rewind(self, batch):
+        """Seek each partition back to the first message of a batch"""
+        first = {}
+        for message in batch:
+            first.setdefault(message.partition, message.offset)
+        for partition, offset in first.items():
+            self.consumer.seek(TopicPartition(self.topic, partition), offset)
+    
     def stop_consuming(self):
         """Stop consuming messages"""
         self.running = False
@@ -0,0 +1,334 @@
+"""
+Memory Broker - In-process stand-in for Kafka
+Topics, partitions, consumer groups and committed offsets live in this
+process, so every service can run in one interpreter for load tests and
+profiling. Selected with KAFKA_TRANSPORT=memory (see kafka_config).
+"""
+from collections import namedtuple
+import itertools
+import logging
+import os
+import threading
+import time
+
+from kafka import TopicPartition
+from kafka.serializer import Serializer, Deserializer
+
+from config.partitioning import partition_for_key
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Partitions given to topics that are used before being created
+DEFAULT_PARTITIONS = int(os.getenv('MEMORY_BROKER_PARTITIONS', '3'))
+# Messages kept per partition; older ones are dropped like expired segments
+RETENTION_MESSAGES = int(os.getenv('MEMORY_BROKER_RETENTION_MESSAGES', '100000'))
+
+# The fields of kafka-python's ConsumerRecord that the services read
+MemoryRecord = namedtuple('MemoryRecord', 'topic partition offset timestamp key value serialized_value_size')
+RecordMetadata = namedtuple('RecordMetadata', 'topic partition offset timestamp serialized_value_size')
+
+
+def _apply(function, topic, data):
+    """Call a kafka-python style (de)serializer"""
+    if function is None or data is None:
+        return data
+    if isinstance(function, Serializer):
+        return function.serialize(topic, data)
+    if isinstance(function, Deserializer):
+        return function.deserialize(topic, data)
+    return function(data)
+
+
+class PartitionLog:
+    """Append-only message list whose oldest entries are trimmed past the retention limit"""
+    
+    def __init__(self):
+        # Offset of messages[0]
+        self.base = 0
+        self.messages = []
+    
+    @property
+    def end(self):
+        return self.base + len(self.messages)
+    
+    def append(self, key, value, timestamp):
+        self.messages.append((key, value, timestamp))
+        # Trim in chunks so appends stay O(1) amortized
+        excess = len(self.messages) - RETENTION_MESSAGES
+        if excess >= max(1, RETENTION_MESSAGES // 10):
+            del self.messages[:excess]
+            self.base += excess
+        return self.end - 1
+    
+    def read(self, offset, limit):
+        """Messages from offset (or the oldest retained one), at most limit; returns (first offset, messages)"""
+        offset = max(offset, self.base)
+        start = offset - self.base
+        return offset, self.messages[start:start + limit]
+
+
+class MemoryBroker:
+    """Topics and consumer-group state shared by every memory producer and consumer"""
+    
+    def __init__(self):
+        # Notified on every append so waiting consumers wake up
+        self.condition = threading.Condition()
+        # topic -> [PartitionLog]
+        self.topics = {}
+        # (group, topic) -> member consumers, in join order
+        self.members = {}
+        # (group, topic) -> generation, bumped whenever membership changes
+        self.generations = {}
+        # (group, topic, partition) -> committed offset
+        self.committed = {}
+        self.round_robin = itertools.count()
+    
+    def create_topic(self, topic, partitions=DEFAULT_PARTITIONS):
+        with self.condition:
+            if topic not in self.topics:
+                self.topics[topic] = [PartitionLog() for _ in range(partitions)]
+    
+    def partitions(self, topic):
+        with self.condition:
+            if topic not in self.topics:
+                self.create_topic(topic)
+            return self.topics[topic]
+    
+    def append(self, topic, key, value, partition=None):
+        """Store a message; returns (partition, offset, timestamp)"""
+        timestamp = time.time()
+        with self.condition:
+            logs = self.partitions(topic)
+            if partition is None:
+                if key is None:
+                    partition = next(self.round_robin) % len(logs)
+                else:
+                    # Same mapping as Kafka, so geo keys land where partition_for_location says
+                    partition = partition_for_key(key, len(logs))
+            offset = logs[partition].append(key, value, timestamp)
+            self.condition.notify_all()
+        return partition, offset, timestamp
+    
+    def join(self, group, topic, consumer):
+        with self.condition:
+            self.members.setdefault((group, topic), []).append(consumer)
+            self.generations[(group, topic)] = self.generations.get((group, topic), 0) + 1
+    
+    def leave(self, group, topic, consumer):
+        with self.condition:
+            members = self.members.get((group, topic), [])
+            if consumer in members:
+                members.remove(consumer)
+                self.generations[(group, topic)] += 1
+                self.condition.notify_all()
+    
+    def assignment(self, group, topic, consumer):
+        """(generation, partitions) for a group member; partitions are dealt round-robin by join order"""
+        with self.condition:
+            members = self.members.get((group, topic), [])
+            count = len(self.partitions(topic))
+            generation = self.generations.get((group, topic), 0)
+            if consumer not in members:
+                return generation, []
+            index = members.index(consumer)
+            return generation, [partition for partition in range(count) if partition % len(members) == index]
+    
+    def generation(self, group, topic):
+        with self.condition:
+            return self.generations.get((group, topic), 0)
+    
+    def commit(self, group, topic, partition, offset):
+        with self.condition:
+            self.committed[(group, topic, partition)] = offset
+    
+    def committed_offset(self, group, topic, partition):
+        with self.condition:
+            return self.committed.get((group, topic, partition))
+    
+    def end_offset(self, topic, partition):
+        with self.condition:
+            return self.partitions(topic)[partition].end
+
+
+broker = MemoryBroker()
+
+
+class MemoryFuture:
+    """Already-resolved stand-in for kafka-python's send future"""
+    
+    def __init__(self, metadata=None, error=None):
+        self.metadata = metadata
+        self.error = error
+    
+    def get(self, timeout=None):
+        if self.error:
+            raise self.error
+        return self.metadata
+    
+    def add_callback(self, function, *args):
+        if not self.error:
+            function(*args, self.metadata)
+        return self
+    
+    def add_errback(self, function, *args):
+        if self.error:
+            function(*args, self.error)
+        return self
+
+
+class MemoryProducer:
+    """KafkaProducer stand-in; accepts (and ignores) the network settings"""
+    
+    def __init__(self, value_serializer=None, key_serializer=None, memory_broker=None, **config):
+        self.value_serializer = value_serializer
+        self.key_serializer = key_serializer
+        self.broker = memory_broker or broker
+    
+    def send(self, topic, value=None, key=None, partition=None):
+        try:
+            key_bytes = _apply(self.key_serializer, topic, key)
+            value_bytes = _apply(self.value_serializer, topic, value)
+            partition, offset, timestamp = self.broker.append(topic, key_bytes, value_bytes, partition)
+            size = len(value_bytes) if value_bytes is not None else -1
+            return MemoryFuture(RecordMetadata(topic, partition, offset, timestamp, size))
+        except Exception as e:
+            return MemoryFuture(error=e)
+    
+    def flush(self, timeout=None):
+        pass
+    
+    def close(self, timeout=None):
+        pass
+
+
+class MemoryConsumer:
+    """
+    KafkaConsumer stand-in for one subscribed topic. Group members share
+    the topic's partitions and rebalance (with listener callbacks) when one
+    joins or leaves, on the member's own thread during poll.
+    """
+    
+    def __init__(self, group_id=None, value_deserializer=None, key_deserializer=None,
+                 auto_offset_reset='latest', enable_auto_commit=True, memory_broker=None, **config):
+        self.group_id = group_id
+        self.value_deserializer = value_deserializer
+        self.key_deserializer = key_deserializer
+        self.auto_offset_reset = auto_offset_reset
+        self.enable_auto_commit = enable_auto_commit
+        self.broker = memory_broker or broker
+        self.topic = None
+        self.listener = None
+        self.generation = None
+        # partition -> next offset to read
+        self.positions = {}
+        self.closed = False
+    
+    def subscribe(self, topics, listener=None):
+        if len(topics) != 1:
+            raise ValueError("MemoryConsumer subscribes to exactly one topic")
+        self.topic = topics[0]
+        self.listener = listener
+        self.broker.join(self.group_id, self.topic, self)
+    
+    def assignment(self):
+        return {TopicPartition(self.topic, partition) for partition in self.positions}
+    
+    def rebalance(self):
+        """Pick up a new assignment if group membership changed"""
+        generation, partitions = self.broker.assignment(self.group_id, self.topic, self)
+        if generation == self.generation:
+            return
+        if self.generation is not None:
+            if self.enable_auto_commit:
+                self.commit()
+            if self.listener:
+                self.listener.on_partitions_revoked(self.assignment())
+        
+        self.generation = generation
+        self.positions = {}
+        for partition in partitions:
+            offset = self.broker.committed_offset(self.group_id, self.topic, partition)
+            if offset is None:
+                offset = 0 if self.auto_offset_reset == 'earliest' else self.broker.end_offset(self.topic, partition)
+            self.positions[partition] = offset
+        if self.listener:
+            self.listener.on_partitions_assigned(self.assignment())
+    
+    def poll(self, timeout_ms=0, max_records=500):
+        """{TopicPartition: [MemoryRecord]} of messages after the current positions"""
+        if self.enable_auto_commit:
+            self.commit()
+        deadline = time.time() + timeout_ms / 1000
+        while not self.closed:
+            self.rebalance()
+            records = {}
+            remaining = max_records or 500
+            with self.broker.condition:
+                logs = self.broker.partitions(self.topic)
+                for partition, position in self.positions.items():
+                    offset, messages = logs[partition].read(position, remaining)
+                    if messages:
+                        records[TopicPartition(self.topic, partition)] = (offset, messages)
+                        remaining -= len(messages)
+                    if remaining <= 0:
+                        break
+                
+                wait = deadline - time.time()
+                if not records and wait > 0:
+                    self.broker.condition.wait(wait)
+                    continue
+            return self.decode(records)
+        return {}
+    
+    def decode(self, records):
+        decoded = {}
+        for topic_partition, (offset, messages) in records.items():
+            decoded[topic_partition] = [
+                MemoryRecord(
+                    self.topic, topic_partition.partition, offset + index, timestamp,
+                    _apply(self.key_deserializer, self.topic, key),
+                    _apply(self.value_deserializer, self.topic, value),
+                    len(value) if value is not None else -1
+                )
+                for index, (key, value, timestamp) in enumerate(messages)
+            ]
+            self.positions[topic_partition.partition] = offset + len(messages)
+        return decoded
+    
+    def __iter__(self):
+        while not self.closed:
+            for messages in self.poll(timeout_ms=1000).values():
+                yield from messages
+    
+    def seek(self, topic_partition, offset):
+        self.positions[topic_partition.partition] = offset
+    
+    def position(self, topic_partition):
+        return self.positions.get(topic_partition.partition)
+    
+    def highwater(self, topic_partition):
+        return self.broker.end_offset(topic_partition.topic, topic_partition.partition)
+    
+    def end_offsets(self, topic_partitions):
+        return {
+            topic_partition: self.broker.end_offset(topic_partition.topic, topic_partition.partition)
+            for topic_partition in topic_partitions
+        }
+    
+    def commit(self, offsets=None):
+        """Commit the given {TopicPartition: OffsetAndMetadata}, or every current position"""
+        if offsets is None:
+            offsets = {partition: position for partition, position in self.positions.items()}
+        else:
+            offsets = {topic_partition.partition: metadata.offset for topic_partition, metadata in offsets.items()}
+        for partition, offset in offsets.items():
+            self.broker.commit(self.group_id, self.topic, partition, offset)
+    
+    def close(self):
+        if self.closed:
+            return
+        if self.enable_auto_commit:
+            self.commit()
+        self.closed = True
+        self.broker.leave(self.group_id, self.topic, self)
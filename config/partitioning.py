@@ -0,0 +1,52 @@
+"""
+Partitioning for Uber Clone topics
+Optionally keys location pings and ride requests by geographic region, so
+every message about one area lands on the same partition and a consumer
+can own whole regions
+"""
+import math
+import os
+
+from kafka.partitioner.default import murmur2
+
+# Key location and ride-request messages by region instead of driver/ride id
+GEO_PARTITIONING = os.getenv('KAFKA_GEO_PARTITIONING', 'false').lower() == 'true'
+# Side of a region in degrees (0.1 is about 11 km north-south)
+GEO_REGION_DEGREES = float(os.getenv('KAFKA_GEO_REGION_DEGREES', '0.1'))
+
+
+def geo_region(lat, lon, size=GEO_REGION_DEGREES):
+    """(row, col) of the region containing a point"""
+    return math.floor(lat / size), math.floor(lon / size)
+
+
+def geo_key(lat, lon, size=GEO_REGION_DEGREES):
+    """Message key shared by every point in a region"""
+    row, col = geo_region(lat, lon, size)
+    return f"geo:{row}:{col}"
+
+
+def partition_for_key(key, partitions):
+    """The partition Kafka's default partitioner picks for a key (str or bytes)"""
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    return (murmur2(key) & 0x7fffffff) % partitions
+
+
+def partition_for_location(lat, lon, partitions, size=GEO_REGION_DEGREES):
+    """The partition that carries messages about a point when geo partitioning is on"""
+    return partition_for_key(geo_key(lat, lon, size), partitions)
+
+
+def location_key(driver_id, lat, lon):
+    """Key for a driver's location ping"""
+    if GEO_PARTITIONING and lat is not None and lon is not None:
+        return geo_key(lat, lon)
+    return str(driver_id)
+
+
+def ride_request_key(ride_id, pickup_lat, pickup_lon):
+    """Key for a ride request, by pickup region"""
+    if GEO_PARTITIONING:
+        return geo_key(pickup_lat, pickup_lon)
+    return str(ride_id)
@@ -0,0 +1,109 @@
+"""
+Worker Pool - Parallel message handling that keeps per-key order
+Messages with the same key always go to the same worker thread, and offsets
+are only committed once every earlier message in the partition has finished
+"""
+from collections import deque
+import logging
+import queue
+import threading
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class KeyedWorkerPool:
+    """Runs handler(item) on worker threads, in submission order for each key"""
+    
+    def __init__(self, handler, workers, max_in_flight, name='worker'):
+        self.handler = handler
+        # submit() blocks once this many items are queued or running
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.queues = [queue.Queue() for _ in range(workers)]
+        self.in_flight = 0
+        self.idle = threading.Condition()
+        self.threads = [
+            threading.Thread(target=self.work, args=(work_queue,), name=f"{name}-{index}", daemon=True)
+            for index, work_queue in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+    
+    def submit(self, key, item):
+        """Queue an item behind earlier items with the same key"""
+        self.slots.acquire()
+        with self.idle:
+            self.in_flight += 1
+        self.queues[hash(key) % len(self.queues)].put(item)
+    
+    def work(self, work_queue):
+        while True:
+            item = work_queue.get()
+            if item is None:
+                return
+            try:
+                self.handler(item)
+            except Exception as e:
+                logger.error(f"Worker error: {e}")
+            finally:
+                self.slots.release()
+                with self.idle:
+                    self.in_flight -= 1
+                    if self.in_flight == 0:
+                        self.idle.notify_all()
+    
+    def wait_idle(self, timeout=None):
+        """Block until every submitted item has been handled; False on timeout"""
+        with self.idle:
+            return self.idle.wait_for(lambda: self.in_flight == 0, timeout)
+    
+    def stop(self):
+        """Let the workers finish what is queued, then exit"""
+        for work_queue in self.queues:
+            work_queue.put(None)
+
+
+class OffsetTracker:
+    """
+    Tracks messages handed out for parallel handling. A partition's commit
+    offset only advances past a message once it and every earlier message
+    of that partition have completed.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        # partition -> dispatched offsets not yet committable, oldest first
+        self.pending = {}
+        # partition -> completed offsets still waiting on an earlier one
+        self.done = {}
+        # partition -> next offset to commit, for partitions that advanced since take()
+        self.advanced = {}
+    
+    def dispatched(self, partition, offset):
+        with self.lock:
+            self.pending.setdefault(partition, deque()).append(offset)
+    
+    def completed(self, partition, offset):
+        with self.lock:
+            pending = self.pending.get(partition)
+            if not pending:
+                return
+            done = self.done.setdefault(partition, set())
+            done.add(offset)
+            while pending and pending[0] in done:
+                done.discard(pending[0])
+                self.advanced[partition] = pending.popleft() + 1
+    
+    def take(self):
+        """{partition: next offset} for partitions whose commit offset moved since the last call"""
+        with self.lock:
+            advanced, self.advanced = self.advanced, {}
+            return advanced
+    
+    def reset(self, partitions):
+        """Forget partitions that were revoked"""
+        with self.lock:
+            for partition in partitions:
+                self.pending.pop(partition, None)
+                self.done.pop(partition, None)
+                self.advanced.pop(partition, None)
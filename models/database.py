@@ -86,6 +86,16 @@ class Ride(Base):
     driver = relationship("Driver", back_populates="rides")
 
 
+class DriverReservation(Base):
+    """Driver held for a ride offer; expires_at is NULL once the ride is accepted"""
+    __tablename__ = 'driver_reservations'
+    
+    driver_id = Column(Integer, ForeignKey('drivers.id'), primary_key=True)
+    ride_id = Column(Integer, ForeignKey('rides.id'), nullable=False)
+    expires_at = Column(DateTime, nullable=True)
+    reserved_at = Column(DateTime, default=datetime.utcnow)
+
+
 def get_db():
     """Get database session"""
     db = SessionLocal()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Matching Benchmark
+Drives MatchingService against a synthetic city without Kafka or Postgres
+and reports throughput and latency percentiles as JSON.
+    
+    python scripts/benchmark_matching.py --drivers 20000 --requests 5000 --output run.json
+    python scripts/benchmark_matching.py --compare run.json
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.synthetic_city import SyntheticCity, parse_vehicle_mix, DEFAULT_VEHICLE_MIX
+
+
+class InProcessProducer:
+    """Producer stand-in that keeps published messages in memory"""
+    
+    def __init__(self):
+        self.messages = {}
+    
+    def send_message(self, topic, message, key=None):
+        self.messages.setdefault(topic, []).append((key, message))
+        return True
+    
+    def send_messages(self, topic, messages):
+        for message, key in messages:
+            self.send_message(topic, message, key)
+        return len(messages)
+    
+    def close(self):
+        pass
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, completed=None):
+    """Throughput and latency percentiles (in milliseconds) for one benchmark"""
+    values = sorted(latencies)
+    completed = len(values) if completed is None else completed
+    return {
+        'count': len(values),
+        'completed': completed,
+        'elapsed_seconds': round(elapsed, 4),
+        'per_second': round(completed / elapsed, 1) if elapsed > 0 else None,
+        'latency_ms': {
+            'mean': round(sum(values) / len(values) * 1000, 4) if values else None,
+            'p50': round(percentile(values, 0.50) * 1000, 4) if values else None,
+            'p90': round(percentile(values, 0.90) * 1000, 4) if values else None,
+            'p99': round(percentile(values, 0.99) * 1000, 4) if values else None,
+            'max': round(values[-1] * 1000, 4) if values else None
+        }
+    }
+
+
+def build_service(city, driver_count):
+    """MatchingService with an in-process producer and a fleet loaded from the synthetic city"""
+    from services.matching_service import MatchingService
+    
+    service = MatchingService(batch_window_ms=0, producer=InProcessProducer())
+    for driver in city.drivers(driver_count):
+        service.supply.handle_availability_update(driver)
+    service.supply.loaded = True
+    return service
+
+
+def seed_rides(requests):
+    """Insert the ride rows that handle_ride_request updates with fares"""
+    from models.database import SessionLocal, Ride, init_db
+    
+    init_db()
+    db = SessionLocal()
+    try:
+        for _, message in requests:
+            db.add(Ride(
+                id=message['ride_id'],
+                rider_id=message['rider_id'],
+                pickup_lat=message['pickup_lat'],
+                pickup_lon=message['pickup_lon'],
+                pickup_address=message['pickup_address'],
+                destination_lat=message['destination_lat'],
+                destination_lon=message['destination_lon'],
+                destination_address=message['destination_address'],
+                vehicle_type=message['vehicle_type'],
+                status='requested'
+            ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def bench_find_nearest_driver(service, requests):
+    """Latency of nearest-driver lookups"""
+    latencies = []
+    started = time.perf_counter()
+    for _, message in requests:
+        call_started = time.perf_counter()
+        service.find_nearest_driver(message['pickup_lat'], message['pickup_lon'], message['vehicle_type'])
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def bench_calculate_fare(service, requests):
+    """Latency of fare calculation"""
+    latencies = []
+    started = time.perf_counter()
+    for _, message in requests:
+        call_started = time.perf_counter()
+        service.calculate_fare(
+            message['pickup_lat'], message['pickup_lon'],
+            message['destination_lat'], message['destination_lon'],
+            message['vehicle_type']
+        )
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def bench_handle_ride_request(service, requests, rate=0):
+    """
+    End-to-end request handling. With a request rate the arrivals are
+    paced in real time and latency includes any time a request waited
+    behind earlier ones; without one each call is timed on its own.
+    """
+    from config.kafka_config import TOPICS
+    
+    latencies = []
+    started = time.perf_counter()
+    for arrival, message in requests:
+        if rate > 0:
+            now = time.perf_counter() - started
+            if arrival > now:
+                time.sleep(arrival - now)
+            service.handle_ride_request(message)
+            latencies.append(time.perf_counter() - started - arrival)
+        else:
+            call_started = time.perf_counter()
+            service.handle_ride_request(message)
+            latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    
+    matched = len(service.producer.messages.get(TOPICS['RIDE_MATCHES'], []))
+    result = summarize(latencies, elapsed, completed=matched)
+    result['unmatched'] = len(requests) - matched
+    return result
+
+
+def compare(current, baseline, tolerance):
+    """Print p99 and throughput changes; return True if any benchmark regressed"""
+    regressed = False
+    for name, result in current['benchmarks'].items():
+        before = baseline.get('benchmarks', {}).get(name)
+        if not before:
+            continue
+        p99_now, p99_before = result['latency_ms']['p99'], before['latency_ms']['p99']
+        rate_now, rate_before = result['per_second'], before['per_second']
+        slower = p99_before and p99_now > p99_before * (1 + tolerance)
+        fewer = rate_before and rate_now < rate_before * (1 - tolerance)
+        flag = 'REGRESSION' if slower or fewer else 'ok'
+        print(f"{name:24s} p99 {p99_before} -> {p99_now} ms, {rate_before} -> {rate_now} /s  {flag}",
+              file=sys.stderr)
+        regressed = regressed or slower or fewer
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark MatchingService on a synthetic city')
+    parser.add_argument('--drivers', type=int, default=10000, help='online drivers in the city')
+    parser.add_argument('--requests', type=int, default=2000, help='ride requests per benchmark')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='ride request arrival rate per second for handle_ride_request (0 = as fast as possible)')
+    parser.add_argument('--radius-km', type=float, default=15, help='city radius')
+    parser.add_argument('--hotspots', type=int, default=5, help='number of demand hotspots')
+    parser.add_argument('--vehicle-mix', default=','.join(f"{k}={v}" for k, v in DEFAULT_VEHICLE_MIX.items()),
+                        help='vehicle type weights, e.g. sedan=0.6,suv=0.2,bike=0.2')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database-url', default=None,
+                        help='database for ride fare updates (default: a temporary SQLite file)')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', help='baseline JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative slowdown before --compare reports a regression')
+    args = parser.parse_args()
+    
+    # Must be set before the models module creates its engine
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    logging.disable(logging.WARNING)
+    
+    vehicle_mix = parse_vehicle_mix(args.vehicle_mix)
+    config = {
+        'drivers': args.drivers,
+        'requests': args.requests,
+        'rate': args.rate,
+        'radius_km': args.radius_km,
+        'hotspots': args.hotspots,
+        'vehicle_mix': vehicle_mix,
+        'seed': args.seed
+    }
+    
+    city = SyntheticCity(radius_km=args.radius_km, hotspots=args.hotspots,
+                         vehicle_mix=vehicle_mix, seed=args.seed)
+    service = build_service(city, args.drivers)
+    requests = city.ride_requests(args.requests, rate_per_second=args.rate)
+    seed_rides(requests)
+    
+    report = {
+        'config': config,
+        'benchmarks': {
+            'find_nearest_driver': bench_find_nearest_driver(service, requests),
+            'calculate_fare': bench_calculate_fare(service, requests),
+            'handle_ride_request': bench_handle_ride_request(service, requests, rate=args.rate)
+        }
+    }
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Run the whole pipeline in one process
+Ride, Matching and Location services plus the API gateway share an
+in-process broker instead of Kafka, for load tests and profiling.
+
+    DATABASE_URL=postgresql://... python scripts/run_in_process.py
+    python -m cProfile -o pipeline.prof scripts/run_in_process.py
+"""
+import os
+import sys
+import threading
+
+# Must be set before config.kafka_config is imported
+os.environ.setdefault('KAFKA_TRANSPORT', 'memory')
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+
+from config.kafka_config import create_kafka_topics
+from models.database import init_db
+from services.ride_service import RideService
+from services.matching_service import MatchingService
+from services.location_service import LocationService
+from services.api_gateway import app
+
+GATEWAY_PORT = int(os.getenv('GATEWAY_PORT', '8001'))
+
+
+def main():
+    init_db()
+    create_kafka_topics()
+
+    # Each service's start() blocks, so each gets a thread; ports are the usual ones
+    for service in (RideService(), MatchingService(), LocationService()):
+        threading.Thread(target=service.start, name=type(service).__name__, daemon=True).start()
+
+    # The gateway (with its driver endpoints) starts its consumers on startup
+    uvicorn.run(app, host="0.0.0.0", port=GATEWAY_PORT)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Synthetic City Generator
+Builds reproducible driver fleets and ride request streams for load tests and benchmarks
+"""
+import math
+import os
+import random
+import sys
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.geo import KM_PER_DEGREE_LAT
+
+# Default city centre (New York City)
+CENTER_LAT = 40.7580
+CENTER_LON = -73.9855
+
+DEFAULT_VEHICLE_MIX = {'sedan': 0.6, 'suv': 0.2, 'bike': 0.2}
+
+
+def parse_vehicle_mix(spec):
+    """Parse 'sedan=0.6,suv=0.2,bike=0.2' into a normalised dict"""
+    mix = {}
+    for part in spec.split(','):
+        name, weight = part.split('=')
+        mix[name.strip()] = float(weight)
+    total = sum(mix.values())
+    return {name: weight / total for name, weight in mix.items()}
+
+
+class SyntheticCity:
+    """
+    A circular city with a few demand hotspots. Drivers and pickups are
+    drawn partly around the hotspots and partly uniformly over the city,
+    so density varies the way it does in a real downtown.
+    """
+    
+    def __init__(self, center_lat=CENTER_LAT, center_lon=CENTER_LON, radius_km=15,
+                 hotspots=5, hotspot_share=0.6, vehicle_mix=None, seed=42):
+        self.center_lat = center_lat
+        self.center_lon = center_lon
+        self.radius_km = radius_km
+        self.hotspot_share = hotspot_share
+        self.vehicle_mix = vehicle_mix or DEFAULT_VEHICLE_MIX
+        self.random = random.Random(seed)
+        self.hotspots = [self._uniform_point(radius_km * 0.6) for _ in range(hotspots)]
+    
+    def _offset(self, north_km, east_km):
+        """Point at a km offset from the city centre"""
+        lat = self.center_lat + north_km / KM_PER_DEGREE_LAT
+        lon = self.center_lon + east_km / (KM_PER_DEGREE_LAT * math.cos(math.radians(self.center_lat)))
+        return lat, lon
+    
+    def _uniform_point(self, radius_km):
+        """Point uniformly distributed over a disc around the centre"""
+        distance = radius_km * math.sqrt(self.random.random())
+        bearing = self.random.uniform(0, 2 * math.pi)
+        return self._offset(distance * math.cos(bearing), distance * math.sin(bearing))
+    
+    def random_point(self):
+        """Point drawn from the hotspot/uniform mixture"""
+        if self.hotspots and self.random.random() < self.hotspot_share:
+            lat, lon = self.random.choice(self.hotspots)
+            north = self.random.gauss(0, 1.0)
+            east = self.random.gauss(0, 1.0)
+            return (lat + north / KM_PER_DEGREE_LAT,
+                    lon + east / (KM_PER_DEGREE_LAT * math.cos(math.radians(lat))))
+        return self._uniform_point(self.radius_km)
+    
+    def random_vehicle_type(self):
+        """Vehicle type drawn from the configured mix"""
+        pick = self.random.random()
+        cumulative = 0.0
+        for vehicle_type, weight in self.vehicle_mix.items():
+            cumulative += weight
+            if pick <= cumulative:
+                return vehicle_type
+        return vehicle_type
+    
+    def drivers(self, count, first_id=1):
+        """Online drivers as driver-availability messages"""
+        fleet = []
+        for driver_id in range(first_id, first_id + count):
+            lat, lon = self.random_point()
+            fleet.append({
+                'driver_id': driver_id,
+                'is_online': True,
+                'driver_name': f"Driver {driver_id}",
+                'rating': round(self.random.uniform(4.0, 5.0), 2),
+                'vehicle_type': self.random_vehicle_type(),
+                'lat': lat,
+                'lon': lon,
+                'timestamp': 0.0
+            })
+        return fleet
+    
+    def ride_requests(self, count, rate_per_second=0, first_id=1):
+        """
+        Ride requests as (arrival_offset_seconds, ride-requests message).
+        Arrivals follow a Poisson process at rate_per_second; a rate of 0
+        makes every request arrive at once.
+        """
+        requests = []
+        arrival = 0.0
+        for ride_id in range(first_id, first_id + count):
+            if rate_per_second > 0:
+                arrival += self.random.expovariate(rate_per_second)
+            pickup_lat, pickup_lon = self.random_point()
+            destination_lat, destination_lon = self.random_point()
+            requests.append((arrival, {
+                'ride_id': ride_id,
+                'rider_id': ride_id,
+                'pickup_lat': pickup_lat,
+                'pickup_lon': pickup_lon,
+                'pickup_address': f"Pickup {ride_id}",
+                'destination_lat': destination_lat,
+                'destination_lon': destination_lon,
+                'destination_address': f"Destination {ride_id}",
+                'vehicle_type': self.random_vehicle_type()
+            }))
+        return requests
@@ -9,20 +9,33 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 import uvicorn
 from datetime import datetime
 import asyncio
+import json
 import threading
+import time
 
 from models.database import SessionLocal, Driver, Rider, Ride, init_db
 from services.ride_service import RideService
 from services.driver_service import DriverService
 from services.websocket_service import manager
+from services.fares import tariffs
+from services.location_coalescer import LocationCoalescer
+from services.location_snapshot import (
+    read_snapshot, write_snapshot, consumer_offsets,
+    GATEWAY_SNAPSHOT_FILE, SNAPSHOT_INTERVAL_SECONDS
+)
+from services.location_store import TTL_TICK_SECONDS
 from config.kafka_config import KafkaConsumerWrapper, TOPICS
 
+# Most location points accepted in one batch request or WebSocket message
+MAX_LOCATION_BATCH = int(os.getenv('GATEWAY_MAX_LOCATION_BATCH', '500'))
+
 # Initialize FastAPI app
 app = FastAPI(title="Uber Clone API", version="1.0.0")
 
@@ -76,6 +89,21 @@ class LocationUpdate(BaseModel):
     lon: float
 
 
+class LocationBatch(BaseModel):
+    updates: List[LocationUpdate] = Field(..., max_length=MAX_LOCATION_BATCH)
+
+
+class FareTrip(BaseModel):
+    pickup_lat: float
+    pickup_lon: float
+    destination_lat: float
+    destination_lon: float
+
+
+class FareQuoteBatch(BaseModel):
+    trips: List[FareTrip]
+
+
 class DriverAvailability(BaseModel):
     driver_id: int
     is_online: bool
@@ -193,6 +221,56 @@ async def update_driver_location(data: LocationUpdate):
     raise HTTPException(status_code=500, detail="Failed to update location")
 
 
+@app.post("/api/drivers/locations")
+async def update_driver_locations(batch: LocationBatch):
+    """Update many driver locations in one request (fleet gateways, simulators)"""
+    # Database and Kafka work would otherwise block the event loop
+    accepted = await run_in_threadpool(
+        driver_service.update_driver_locations,
+        [(update.driver_id, update.lat, update.lon) for update in batch.updates]
+    )
+    return {"accepted": accepted, "rejected": len(batch.updates) - accepted}
+
+
+# Fare endpoints
+@app.get("/api/fares/quote")
+async def quote_fare(pickup_lat: float, pickup_lon: float, destination_lat: float,
+                     destination_lon: float, vehicle_type: Optional[str] = None):
+    """Upfront fare for one trip, for every vehicle type or just one"""
+    if vehicle_type and vehicle_type not in tariffs:
+        raise HTTPException(status_code=400, detail=f"Unknown vehicle type: {vehicle_type}")
+    
+    distance, fares = tariffs.quote(
+        pickup_lat, pickup_lon, destination_lat, destination_lon,
+        [vehicle_type] if vehicle_type else None
+    )
+    return {
+        "distance": distance,
+        "quotes": [{"vehicle_type": v, "fare": fare} for v, fare in fares.items()]
+    }
+
+
+@app.post("/api/fares/quote/batch")
+async def quote_fares(batch: FareQuoteBatch):
+    """Upfront fares for many trips and every vehicle type in one call"""
+    if not batch.trips:
+        return {"vehicle_types": tariffs.vehicle_types, "trips": []}
+    
+    distances, fares = tariffs.quote_batch(
+        [trip.pickup_lat for trip in batch.trips],
+        [trip.pickup_lon for trip in batch.trips],
+        [trip.destination_lat for trip in batch.trips],
+        [trip.destination_lon for trip in batch.trips]
+    )
+    return {
+        "vehicle_types": tariffs.vehicle_types,
+        "trips": [
+            {"distance": distance, "fares": row}
+            for distance, row in zip(distances.tolist(), fares.tolist())
+        ]
+    }
+
+
 # Ride endpoints
 @app.post("/api/rides")
 async def request_ride(ride_request: RideRequest):
@@ -267,6 +345,15 @@ async def accept_ride(action: RideAction):
     raise HTTPException(status_code=500, detail="Failed to accept ride")
 
 
+@app.post("/api/rides/decline")
+async def decline_ride(action: RideAction):
+    """Driver declines a ride offer"""
+    success = driver_service.decline_ride(action.driver_id, action.ride_id)
+    if success:
+        return {"message": "Ride declined successfully"}
+    raise HTTPException(status_code=500, detail="Failed to decline ride")
+
+
 @app.post("/api/rides/start")
 async def start_ride(action: RideAction):
     """Driver starts a ride"""
@@ -314,6 +401,7 @@ async def root():
             "riders": "/api/riders",
             "drivers": "/api/drivers",
             "rides": "/api/rides",
+            "fares": "/api/fares/quote",
             "websocket": {
                 "rider": "/ws/rider/{rider_id}",
                 "driver": "/ws/driver/{driver_id}",
@@ -341,12 +429,44 @@ async def websocket_rider(websocket: WebSocket, rider_id: int):
 
 @app.websocket("/ws/driver/{driver_id}")
 async def websocket_driver(websocket: WebSocket, driver_id: int):
-    """WebSocket connection for driver to receive real-time updates"""
+    """
+    WebSocket connection for driver to receive real-time updates. The driver
+    app can also stream its position up the same connection as
+    {"type": "location", "lat": ..., "lon": ...} (no reply is sent), or a
+    list of points as {"type": "locations", "points": [[lat, lon], ...]}.
+    """
     await manager.connect_driver(driver_id, websocket)
     try:
         while True:
             data = await websocket.receive_text()
-            await websocket.send_json({"type": "heartbeat", "status": "connected"})
+            try:
+                message = json.loads(data)
+                if message.get("type") == "location":
+                    points = [(message["lat"], message["lon"])]
+                elif message.get("type") == "locations":
+                    points = message["points"]
+                    if not isinstance(points, list):
+                        raise TypeError("points must be a list")
+                else:
+                    points = None
+            except (ValueError, KeyError, TypeError, AttributeError):
+                points = None
+            
+            if points is None:
+                await websocket.send_json({"type": "heartbeat", "status": "connected"})
+                continue
+            if len(points) > MAX_LOCATION_BATCH:
+                await websocket.send_json({
+                    "type": "error",
+                    "detail": f"At most {MAX_LOCATION_BATCH} points per message"
+                })
+                continue
+            try:
+                updates = [(driver_id, float(lat), float(lon)) for lat, lon in points]
+            except (ValueError, TypeError):
+                await websocket.send_json({"type": "error", "detail": "Invalid location"})
+                continue
+            await run_in_threadpool(driver_service.update_driver_locations, updates)
     except WebSocketDisconnect:
         manager.disconnect_driver(driver_id, websocket)
 
@@ -419,12 +539,19 @@ def handle_location_update(message: dict):
     }))
 
 
+# Pings are thinned before they update stored locations and fan out to sockets
+location_coalescer = LocationCoalescer(handle_location_update, 'api-gateway')
+
+
 def handle_availability_update(message: dict):
     """Handle driver availability updates from Kafka"""
     driver_id = message.get('driver_id')
     is_online = message.get('is_online')
     
+    # The status may have been changed through another service instance
+    driver_service.invalidate_profile(driver_id)
     if not is_online:
+        location_coalescer.forget(driver_id)
         manager.remove_driver_location(driver_id)
     
     asyncio.run(manager.broadcast_to_driver(driver_id, {
@@ -465,24 +592,75 @@ def handle_ride_update(message: dict):
         db.close()
 
 
+def run_location_expiry():
+    """Hide and evict driver locations that stopped updating"""
+    import logging
+    logger = logging.getLogger(__name__)
+    
+    while True:
+        time.sleep(TTL_TICK_SECONDS)
+        try:
+            _, evicted_ids = manager.expire_driver_locations()
+            for driver_id in evicted_ids:
+                location_coalescer.forget(driver_id)
+        except Exception as e:
+            logger.error(f"Error expiring driver locations: {e}")
+
+
+def restore_location_snapshot():
+    """Load the last location snapshot into the manager; returns the consumer offsets to resume from"""
+    import logging
+    logger = logging.getLogger(__name__)
+    
+    snapshot = read_snapshot(GATEWAY_SNAPSHOT_FILE)
+    if snapshot is None:
+        return {}
+    columns, header = snapshot
+    manager.restore_driver_locations(columns, header['vehicle_types'], header['taken_at'])
+    logger.info(f"Restored {header['count']} driver locations from {GATEWAY_SNAPSHOT_FILE}")
+    return header['offsets']
+
+
+def run_location_snapshots(consumers):
+    """Snapshot the manager's driver locations every SNAPSHOT_INTERVAL_SECONDS"""
+    import logging
+    logger = logging.getLogger(__name__)
+    
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL_SECONDS)
+        try:
+            # Offsets first, then flush, so the table covers at least everything before them
+            offsets = consumer_offsets(consumers)
+            location_coalescer.flush()
+            columns, vehicle_types = manager.snapshot_columns()
+            write_snapshot(GATEWAY_SNAPSHOT_FILE, columns, vehicle_types, offsets)
+        except Exception as e:
+            logger.error(f"Error writing location snapshot: {e}")
+
+
 def start_kafka_consumers():
     """Start Kafka consumers in background threads"""
     import logging
     logger = logging.getLogger(__name__)
     
     try:
+        # Warm restart: load the last snapshot and replay everything after it
+        offsets = restore_location_snapshot() if SNAPSHOT_INTERVAL_SECONDS > 0 else {}
+        
         # Consumer for driver locations
         location_consumer = KafkaConsumerWrapper(
             TOPICS['DRIVER_LOCATIONS'],
             'api-gateway-location-group',
-            handle_location_update
+            location_coalescer.submit,
+            start_offsets=offsets.get(TOPICS['DRIVER_LOCATIONS'])
         )
         
         # Consumer for driver availability
         availability_consumer = KafkaConsumerWrapper(
             TOPICS['DRIVER_AVAILABILITY'],
             'api-gateway-availability-group',
-            handle_availability_update
+            handle_availability_update,
+            start_offsets=offsets.get(TOPICS['DRIVER_AVAILABILITY'])
         )
         
         # Consumer for ride updates
@@ -500,6 +678,14 @@ def start_kafka_consumers():
         location_thread.start()
         availability_thread.start()
         ride_thread.start()
+        location_coalescer.start()
+        threading.Thread(target=run_location_expiry, daemon=True).start()
+        if SNAPSHOT_INTERVAL_SECONDS > 0:
+            threading.Thread(
+                target=run_location_snapshots,
+                args=([location_consumer, availability_consumer],),
+                daemon=True
+            ).start()
         
         logger.info("Kafka consumers started for WebSocket broadcasting")
     except Exception as e:
@@ -0,0 +1,81 @@
+"""
+Assignment - Minimum-cost matching of ride requests to drivers
+Hungarian algorithm (shortest augmenting path) over a sparse candidate graph
+"""
+INF = float('inf')
+
+
+def min_cost_assignment(candidates, unmatched_cost):
+    """
+    Assign each row to at most one column minimising total cost.
+    
+    candidates is a list with one entry per row, each a dict of
+    {column_key: cost}. A row left unassigned costs unmatched_cost, so
+    edges dearer than that are never used. Returns a list holding the
+    assigned column key or None for every row.
+    """
+    n = len(candidates)
+    if n == 0:
+        return []
+    
+    # Real columns first, then one private "unmatched" column per row
+    column_keys = []
+    column_index = {}
+    for row in candidates:
+        for key in row:
+            if key not in column_index:
+                column_index[key] = len(column_keys)
+                column_keys.append(key)
+    real_columns = len(column_keys)
+    m = real_columns + n
+    
+    def cost(i, j):
+        if j >= real_columns:
+            return unmatched_cost if j - real_columns == i else INF
+        return candidates[i].get(column_keys[j], INF)
+    
+    # 1-based potentials and matching as in the classic formulation
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    match_col = [0] * (m + 1)
+    way = [0] * (m + 1)
+    
+    for i in range(1, n + 1):
+        match_col[0] = i
+        j0 = 0
+        min_v = [INF] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = match_col[j0]
+            delta = INF
+            j1 = 0
+            for j in range(1, m + 1):
+                if used[j]:
+                    continue
+                current = cost(i0 - 1, j - 1) - u[i0] - v[j]
+                if current < min_v[j]:
+                    min_v[j] = current
+                    way[j] = j0
+                if min_v[j] < delta:
+                    delta = min_v[j]
+                    j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[match_col[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_v[j] -= delta
+            j0 = j1
+            if match_col[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match_col[j0] = match_col[j1]
+            j0 = j1
+    
+    result = [None] * n
+    for j in range(1, real_columns + 1):
+        if match_col[j]:
+            result[match_col[j] - 1] = column_keys[j - 1]
+    return result
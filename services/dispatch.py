@@ -0,0 +1,114 @@
+"""
+Dispatch - Ride offers to a ranked list of candidate drivers
+Each ride keeps its top-K candidates so a timeout or decline moves straight to the next one
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+DISPATCH_CANDIDATES = int(os.getenv('MATCHING_DISPATCH_CANDIDATES', '5'))
+OFFER_TIMEOUT_SECONDS = float(os.getenv('MATCHING_OFFER_TIMEOUT_SECONDS', '15'))
+
+
+class Offer:
+    """A ride being offered to its candidates one at a time"""
+    
+    __slots__ = ('ride', 'candidates', 'driver', 'expires_at', 'offers_made')
+    
+    def __init__(self, ride, candidates):
+        # The PendingRide, so retries keep its attempt count and excluded drivers
+        self.ride = ride
+        self.candidates = deque(candidates)
+        self.driver = None
+        self.expires_at = None
+        self.offers_made = 0
+    
+    @property
+    def message(self):
+        return self.ride.message
+    
+    @property
+    def first_seen(self):
+        return self.ride.first_seen
+    
+    @property
+    def radius_km(self):
+        return self.ride.radius_km
+    
+    @property
+    def ride_id(self):
+        return self.ride.ride_id
+    
+    @property
+    def driver_id(self):
+        return self.driver['driver_id'] if self.driver else None
+
+
+class OfferTracker:
+    """Outstanding offers with a deadline heap for acceptance timeouts"""
+    
+    def __init__(self):
+        # ride_id -> Offer
+        self.offers = {}
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+    
+    def __len__(self):
+        return len(self.offers)
+    
+    def track(self, offer, driver, timeout_seconds=OFFER_TIMEOUT_SECONDS):
+        """Record that an offer has gone out to a driver"""
+        with self.condition:
+            offer.driver = driver
+            offer.expires_at = time.time() + timeout_seconds
+            offer.offers_made += 1
+            self.offers[offer.ride_id] = offer
+            heapq.heappush(self.heap, (offer.expires_at, next(self.counter), offer.ride_id))
+            self.condition.notify()
+    
+    def get(self, ride_id):
+        """Return the outstanding offer for a ride"""
+        with self.condition:
+            return self.offers.get(ride_id)
+    
+    def resolve(self, ride_id, driver_id):
+        """Remove an offer if it is currently held by driver_id; returns the offer"""
+        with self.condition:
+            offer = self.offers.get(ride_id)
+            if offer is None or offer.driver_id != driver_id:
+                return None
+            del self.offers[ride_id]
+            return offer
+    
+    def take_expired(self, timeout=None):
+        """
+        Wait until at least one offer times out (or timeout passes) and
+        return the expired offers. They stay tracked, so an answer that
+        arrives before the expiry is resolved still finds them.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while True:
+                now = time.time()
+                expired = []
+                while self.heap and self.heap[0][0] <= now:
+                    expires_at, _, ride_id = heapq.heappop(self.heap)
+                    offer = self.offers.get(ride_id)
+                    # Entries for answered or re-offered rides are stale
+                    if offer is None or offer.expires_at != expires_at:
+                        continue
+                    # The offer stays outstanding until its expiry is resolved
+                    expired.append(offer)
+                if expired:
+                    return expired
+                if deadline is not None and now >= deadline:
+                    return []
+                
+                wait = self.heap[0][0] - now if self.heap else None
+                if deadline is not None:
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self.condition.wait(wait)
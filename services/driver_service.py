@@ -12,19 +12,74 @@ import time
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config.kafka_config import KafkaProducerWrapper, KafkaConsumerWrapper, TOPICS
+from config.partitioning import location_key
 from models.database import SessionLocal, Driver
+from services.location_writer import LocationWriteBehind, FLUSH_INTERVAL_MS
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# How long a cached online flag and vehicle type are trusted on the ping path
+PROFILE_TTL_SECONDS = float(os.getenv('DRIVER_PROFILE_TTL_SECONDS', '30'))
+
 
 class DriverService:
     """Service to manage drivers"""
     
-    def __init__(self):
+    def __init__(self, flush_interval_ms=FLUSH_INTERVAL_MS):
         self.producer = KafkaProducerWrapper()
+        # driver_id -> (is_online, vehicle_type, cached_at) so pings skip the SELECT
+        self.profiles = {}
+        # Write-behind buffer for positions; None writes every ping straight through
+        self.location_writer = None
+        if flush_interval_ms > 0:
+            self.location_writer = LocationWriteBehind(flush_interval_ms)
+            self.location_writer.start()
         logger.info("Driver Service initialized")
     
+    def driver_profile(self, driver_id):
+        """Online flag and vehicle type of a driver, from cache when fresh; None if unknown"""
+        cached = self.profiles.get(driver_id)
+        if cached and time.time() - cached[2] < PROFILE_TTL_SECONDS:
+            return cached
+        
+        db = SessionLocal()
+        try:
+            row = db.query(Driver.is_online, Driver.vehicle_type).filter(Driver.id == driver_id).first()
+            if row is None:
+                return None
+            cached = (row.is_online, row.vehicle_type, time.time())
+            self.profiles[driver_id] = cached
+            return cached
+        finally:
+            db.close()
+    
+    def driver_profiles(self, driver_ids):
+        """driver_profile for many drivers, loading every cache miss with one query"""
+        now = time.time()
+        profiles = {}
+        missing = []
+        for driver_id in driver_ids:
+            cached = self.profiles.get(driver_id)
+            if cached and now - cached[2] < PROFILE_TTL_SECONDS:
+                profiles[driver_id] = cached
+            else:
+                missing.append(driver_id)
+        
+        if missing:
+            db = SessionLocal()
+            try:
+                rows = db.query(Driver.id, Driver.is_online, Driver.vehicle_type).filter(Driver.id.in_(missing)).all()
+                for row in rows:
+                    profiles[row.id] = self.profiles[row.id] = (row.is_online, row.vehicle_type, now)
+            finally:
+                db.close()
+        return profiles
+    
+    def invalidate_profile(self, driver_id):
+        """Drop a cached profile after another process changed the driver's status"""
+        self.profiles.pop(driver_id, None)
+    
     def update_driver_availability(self, driver_id, is_online):
         """Update driver online/offline status"""
         db = SessionLocal()
@@ -34,11 +89,23 @@ class DriverService:
             if driver:
                 driver.is_online = is_online
                 db.commit()
+                self.profiles[driver_id] = (is_online, driver.vehicle_type, time.time())
+                
+                # The newest position may still be waiting in the write-behind buffer
+                lat, lon = driver.current_lat, driver.current_lon
+                if self.location_writer:
+                    lat, lon = self.location_writer.latest(driver_id) or (lat, lon)
                 
-                # Publish to Kafka
+                # Publish to Kafka with the profile and last position so
+                # consumers can track supply without querying the database
                 message = {
                     'driver_id': driver_id,
                     'is_online': is_online,
+                    'driver_name': driver.name,
+                    'rating': driver.rating,
+                    'vehicle_type': driver.vehicle_type,
+                    'lat': lat,
+                    'lon': lon,
                     'timestamp': time.time()
                 }
                 
@@ -59,6 +126,83 @@ class DriverService:
     
     def update_driver_location(self, driver_id, lat, lon):
         """Update driver location"""
+        if self.location_writer is None:
+            return self.write_driver_location(driver_id, lat, lon)
+        
+        try:
+            profile = self.driver_profile(driver_id)
+            if profile is None:
+                return None
+            is_online, vehicle_type, _ = profile
+            
+            # Persisted by the next flush; the driver-locations topic carries it meanwhile
+            self.location_writer.put(driver_id, lat, lon)
+            
+            if is_online:
+                message = {
+                    'driver_id': driver_id,
+                    'lat': lat,
+                    'lon': lon,
+                    'vehicle_type': vehicle_type,
+                    'timestamp': time.time()
+                }
+                
+                # Pings are not worth a broker round trip each; failures are counted by the producer
+                self.producer.send_message_async(
+                    TOPICS['DRIVER_LOCATIONS'],
+                    message,
+                    key=location_key(driver_id, lat, lon)
+                )
+                
+                logger.debug(f"Driver {driver_id} location updated: ({lat}, {lon})")
+            return True
+        except Exception as e:
+            logger.error(f"Error updating driver location: {e}")
+            return False
+    
+    def update_driver_locations(self, updates):
+        """
+        Apply many (driver_id, lat, lon) pings at once; returns how many were
+        accepted. Profiles come from one query and the messages go out
+        through the producer's batching, so per-ping cost stays small.
+        """
+        if self.location_writer is None:
+            return sum(1 for driver_id, lat, lon in updates if self.write_driver_location(driver_id, lat, lon))
+        
+        try:
+            profiles = self.driver_profiles({driver_id for driver_id, _, _ in updates})
+        except Exception as e:
+            logger.error(f"Error loading driver profiles: {e}")
+            return 0
+        
+        accepted = 0
+        now = time.time()
+        for driver_id, lat, lon in updates:
+            profile = profiles.get(driver_id)
+            if profile is None:
+                continue
+            is_online, vehicle_type, _ = profile
+            self.location_writer.put(driver_id, lat, lon)
+            accepted += 1
+            
+            if is_online:
+                self.producer.send_message_async(
+                    TOPICS['DRIVER_LOCATIONS'],
+                    {
+                        'driver_id': driver_id,
+                        'lat': lat,
+                        'lon': lon,
+                        'vehicle_type': vehicle_type,
+                        'timestamp': now
+                    },
+                    key=location_key(driver_id, lat, lon)
+                )
+        
+        logger.debug(f"Accepted {accepted}/{len(updates)} driver locations")
+        return accepted
+    
+    def write_driver_location(self, driver_id, lat, lon):
+        """Update driver location with its own transaction (no write-behind)"""
         db = SessionLocal()
         
         try:
@@ -78,10 +222,10 @@ class DriverService:
                         'timestamp': time.time()
                     }
                     
-                    self.producer.send_message(
+                    self.producer.send_message_async(
                         TOPICS['DRIVER_LOCATIONS'],
                         message,
-                        key=str(driver_id)
+                        key=location_key(driver_id, lat, lon)
                     )
                     
                     logger.info(f"Driver {driver_id} location updated: ({lat}, {lon})")
@@ -115,6 +259,28 @@ class DriverService:
             logger.error(f"Error accepting ride: {e}")
             return False
     
+    def decline_ride(self, driver_id, ride_id):
+        """Driver declines a ride offer"""
+        try:
+            message = {
+                'ride_id': ride_id,
+                'driver_id': driver_id,
+                'status': 'declined',
+                'timestamp': time.time()
+            }
+            
+            self.producer.send_message(
+                TOPICS['RIDE_UPDATES'],
+                message,
+                key=str(ride_id)
+            )
+            
+            logger.info(f"Driver {driver_id} declined ride {ride_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error declining ride: {e}")
+            return False
+    
     def start_ride(self, driver_id, ride_id):
         """Driver starts the ride"""
         try:
@@ -175,6 +341,9 @@ class DriverService:
                 time.sleep(1)
         except KeyboardInterrupt:
             logger.info("Shutting down Driver Service...")
+            if self.location_writer:
+                self.location_writer.stop()
+                self.location_writer.flush()
             self.producer.close()
 
 
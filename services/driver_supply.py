@@ -0,0 +1,184 @@
+"""
+Driver Supply - Local, always-current table of online drivers
+Fed by the driver-locations and driver-availability topics
+"""
+import sys
+import os
+import threading
+import logging
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.database import SessionLocal, Driver
+from services.location_store import STALE_SECONDS, TTL_TICK_SECONDS
+from services.spatial_index import GridIndex
+from services.timing_wheel import TimingWheel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEX_CELL_SIZE_DEG = float(os.getenv('MATCHING_INDEX_CELL_SIZE_DEG', '0.01'))
+
+
+class DriverSupply:
+    """Online drivers with their last known position, indexed by location"""
+    
+    def __init__(self, cell_size_deg=INDEX_CELL_SIZE_DEG, stale_seconds=STALE_SECONDS):
+        self.index = GridIndex(cell_size_deg)
+        # Drivers whose position has not been refreshed in stale_seconds leave the index
+        self.stale_seconds = stale_seconds
+        self.stale_wheel = TimingWheel(TTL_TICK_SECONDS)
+        # driver_id -> {'driver_name', 'rating', 'vehicle_type'}
+        self.profiles = {}
+        # driver_id -> is_online
+        self.online = {}
+        self.lock = threading.RLock()
+        self.loaded = False
+        # Called as listener(driver_id, vehicle_type, lat, lon) when a driver becomes matchable
+        self.listeners = []
+    
+    def __len__(self):
+        return len(self.index)
+    
+    def load_from_database(self):
+        """Seed the table from the drivers table once at startup"""
+        db = SessionLocal()
+        
+        try:
+            drivers = db.query(Driver).filter(Driver.is_online == True).all()
+            
+            with self.lock:
+                for driver in drivers:
+                    self.profiles[driver.id] = {
+                        'driver_name': driver.name,
+                        'rating': driver.rating,
+                        'vehicle_type': driver.vehicle_type
+                    }
+                    self.online[driver.id] = True
+                    if driver.current_lat is not None and driver.current_lon is not None:
+                        self._place(driver.id, driver.current_lat, driver.current_lon)
+                self.loaded = True
+            
+            logger.info(f"Driver supply loaded with {len(self.index)} online drivers")
+        except Exception as e:
+            logger.error(f"Error loading driver supply: {e}")
+        finally:
+            db.close()
+    
+    def _fetch_profile(self, driver_id):
+        """Load the profile of a driver first seen on the stream"""
+        db = SessionLocal()
+        
+        try:
+            driver = db.query(Driver).filter(Driver.id == driver_id).first()
+            if driver:
+                return {
+                    'driver_name': driver.name,
+                    'rating': driver.rating,
+                    'vehicle_type': driver.vehicle_type
+                }
+        except Exception as e:
+            logger.error(f"Error loading profile for driver {driver_id}: {e}")
+        finally:
+            db.close()
+        return None
+    
+    def _place(self, driver_id, lat, lon):
+        """Put a driver with a known profile into the spatial index"""
+        profile = self.profiles[driver_id]
+        self.index.upsert(
+            driver_id, lat, lon, profile['vehicle_type'],
+            driver_name=profile['driver_name'],
+            rating=profile['rating']
+        )
+        self.stale_wheel.schedule(driver_id, time.time() + self.stale_seconds)
+    
+    def _notify(self, driver_id, lat, lon):
+        """Tell listeners that a driver has just become matchable"""
+        vehicle_type = self.profiles[driver_id]['vehicle_type']
+        for listener in self.listeners:
+            try:
+                listener(driver_id, vehicle_type, lat, lon)
+            except Exception as e:
+                logger.error(f"Error notifying supply listener: {e}")
+    
+    def handle_location_update(self, message):
+        """Handle driver location updates"""
+        try:
+            driver_id = message['driver_id']
+            lat = message['lat']
+            lon = message['lon']
+            
+            with self.lock:
+                # Publishers cache the online flag, so pings can trail an offline
+                # event; the driver stays out until an online event arrives
+                if self.online.get(driver_id) is False:
+                    return
+                profile = self.profiles.get(driver_id)
+            if profile is None:
+                profile = self._fetch_profile(driver_id)
+                if profile is None:
+                    return
+            
+            with self.lock:
+                profile['vehicle_type'] = message.get('vehicle_type', profile['vehicle_type'])
+                if self.online.get(driver_id) is False:
+                    return
+                self.profiles[driver_id] = profile
+                # Location pings are only published for online drivers
+                self.online[driver_id] = True
+                appeared = driver_id not in self.index
+                self._place(driver_id, lat, lon)
+            
+            if appeared:
+                self._notify(driver_id, lat, lon)
+        
+        except Exception as e:
+            logger.error(f"Error handling location update: {e}")
+    
+    def handle_availability_update(self, message):
+        """Handle driver availability updates"""
+        try:
+            driver_id = message['driver_id']
+            is_online = message['is_online']
+            
+            with self.lock:
+                self.online[driver_id] = is_online
+                if not is_online:
+                    self.index.remove(driver_id)
+                    self.stale_wheel.cancel(driver_id)
+                    return
+                
+                if 'driver_name' in message:
+                    self.profiles[driver_id] = {
+                        'driver_name': message['driver_name'],
+                        'rating': message.get('rating'),
+                        'vehicle_type': message['vehicle_type']
+                    }
+                
+                lat = message.get('lat')
+                lon = message.get('lon')
+                placed = driver_id in self.profiles and lat is not None and lon is not None
+                if placed:
+                    self._place(driver_id, lat, lon)
+            
+            if placed:
+                self._notify(driver_id, lat, lon)
+            logger.info(f"Driver {driver_id} is now {'online' if is_online else 'offline'}")
+        
+        except Exception as e:
+            logger.error(f"Error handling availability update: {e}")
+    
+    def expire(self, now=None):
+        """Remove drivers whose last position is older than the stale TTL; returns their ids"""
+        with self.lock:
+            stale_ids = self.stale_wheel.advance(now)
+            for driver_id in stale_ids:
+                self.index.remove(driver_id)
+        return stale_ids
+    
+    def nearest(self, lat, lon, vehicle_type, k=1, max_radius_km=None, exclude=None):
+        """Return up to k online drivers closest to a point, nearest first"""
+        return self.index.nearest(lat, lon, vehicle_type, k=k, max_radius_km=max_radius_km, exclude=exclude)
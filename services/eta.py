@@ -0,0 +1,228 @@
+"""
+ETA - Road-network travel times for ranking pickup candidates
+Shortest paths use A* with landmark (ALT) lower bounds and an LRU cache of node-to-node results
+
+The graph is a JSON file converted offline (e.g. from an OSM extract):
+    
+    {"nodes": [[node_id, lat, lon], ...],
+     "edges": [[from_node_id, to_node_id, travel_seconds], ...]}
+
+Edges are directed; two-way roads need an edge in each direction.
+"""
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+
+from services.spatial_index import GridIndex
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ETA ranking is off unless a graph file is configured
+GRAPH_FILE = os.getenv('MATCHING_ETA_GRAPH_FILE')
+# Straight-line candidates re-ranked by travel time
+ETA_CANDIDATES = int(os.getenv('MATCHING_ETA_CANDIDATES', '10'))
+LANDMARKS = int(os.getenv('MATCHING_ETA_LANDMARKS', '8'))
+CACHE_SIZE = int(os.getenv('MATCHING_ETA_CACHE_SIZE', '100000'))
+# Speed used to reach the road network from a point off it
+ACCESS_SPEED_KMH = float(os.getenv('MATCHING_ETA_ACCESS_SPEED_KMH', '20'))
+
+ROAD_NODE = 'road'
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache"""
+    
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+    
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+class RoadNetwork:
+    """Directed road graph with precomputed landmark distances"""
+    
+    def __init__(self, nodes, edges, landmarks=LANDMARKS, cache_size=CACHE_SIZE):
+        # Dense indices keep adjacency and landmark tables as plain lists
+        self.node_ids = []
+        self.positions = {}
+        self.snap_index = GridIndex(cell_size_deg=0.005)
+        for node_id, lat, lon in nodes:
+            self.positions[node_id] = len(self.node_ids)
+            self.snap_index.upsert(len(self.node_ids), lat, lon, ROAD_NODE)
+            self.node_ids.append(node_id)
+        
+        self.forward = [[] for _ in self.node_ids]
+        self.backward = [[] for _ in self.node_ids]
+        for source, target, seconds in edges:
+            u, v = self.positions[source], self.positions[target]
+            self.forward[u].append((v, float(seconds)))
+            self.backward[v].append((u, float(seconds)))
+        
+        # landmark -> travel seconds from it / to it, per node
+        self.from_landmark = []
+        self.to_landmark = []
+        self.select_landmarks(landmarks)
+        self.cache = LRUCache(cache_size)
+    
+    @classmethod
+    def load(cls, path=GRAPH_FILE):
+        """Load a graph file; returns None when none is configured or it cannot be read"""
+        if not path:
+            return None
+        try:
+            with open(path) as f:
+                graph = json.load(f)
+            network = cls(graph['nodes'], graph['edges'])
+            logger.info(f"Road network loaded with {len(network)} nodes and {len(network.from_landmark)} landmarks")
+            return network
+        except Exception as e:
+            logger.error(f"Error loading road network {path}: {e}")
+            return None
+    
+    def __len__(self):
+        return len(self.node_ids)
+    
+    @staticmethod
+    def _dijkstra(adjacency, source):
+        """Travel seconds from source to every node (inf where unreachable)"""
+        dist = [math.inf] * len(adjacency)
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for v, w in adjacency[u]:
+                nd = d + w
+                if nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+    
+    def select_landmarks(self, count):
+        """Pick landmarks by farthest-first selection and store their distance tables"""
+        if not self.node_ids:
+            return
+        # Start from the node farthest from an arbitrary one so landmarks sit on the edge of the map
+        landmark = self._farthest(self._dijkstra(self.forward, 0))
+        nearest = [math.inf] * len(self.node_ids)
+        for _ in range(min(count, len(self.node_ids))):
+            from_landmark = self._dijkstra(self.forward, landmark)
+            self.from_landmark.append(from_landmark)
+            self.to_landmark.append(self._dijkstra(self.backward, landmark))
+            nearest = [min(a, b) for a, b in zip(nearest, from_landmark)]
+            landmark = self._farthest(nearest)
+            if nearest[landmark] == 0:
+                break
+    
+    @staticmethod
+    def _farthest(dist):
+        """Index of the farthest reachable node"""
+        best, best_dist = 0, -1.0
+        for i, d in enumerate(dist):
+            if d != math.inf and d > best_dist:
+                best, best_dist = i, d
+        return best
+    
+    def _lower_bound(self, u, target):
+        """Admissible estimate of travel seconds from u to target"""
+        bound = 0.0
+        for from_l, to_l in zip(self.from_landmark, self.to_landmark):
+            # d(u, t) >= d(L, t) - d(L, u) and d(u, t) >= d(u, L) - d(t, L)
+            a, b = from_l[target], from_l[u]
+            if b != math.inf and a - b > bound:
+                bound = a - b
+            a, b = to_l[u], to_l[target]
+            if b != math.inf and a - b > bound:
+                bound = a - b
+        return bound
+    
+    def travel_time(self, source, target):
+        """Shortest travel seconds between two node indices (inf when unreachable)"""
+        if source == target:
+            return 0.0
+        if self._lower_bound(source, target) == math.inf:
+            return math.inf
+        key = (source, target)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        
+        dist = {source: 0.0}
+        heap = [(self._lower_bound(source, target), 0.0, source)]
+        result = math.inf
+        while heap:
+            _, d, u = heapq.heappop(heap)
+            if u == target:
+                result = d
+                break
+            if d > dist[u]:
+                continue
+            for v, w in self.forward[u]:
+                nd = d + w
+                if nd < dist.get(v, math.inf):
+                    bound = self._lower_bound(v, target)
+                    if bound == math.inf:
+                        continue
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd + bound, nd, v))
+        
+        self.cache.put(key, result)
+        return result
+    
+    def snap(self, lat, lon):
+        """Nearest road node to a point and the seconds needed to reach it"""
+        nearest = self.snap_index.nearest(lat, lon, ROAD_NODE, k=1)
+        if not nearest:
+            return None, math.inf
+        node = nearest[0]
+        return node['driver_id'], node['distance'] / ACCESS_SPEED_KMH * 3600
+    
+    def eta_seconds(self, from_lat, from_lon, to_lat, to_lon):
+        """Door-to-door travel seconds between two points"""
+        source, access = self.snap(from_lat, from_lon)
+        target, egress = self.snap(to_lat, to_lon)
+        if source is None or target is None:
+            return math.inf
+        return access + self.travel_time(source, target) + egress
+    
+    def rank(self, pickup_lat, pickup_lon, candidates):
+        """
+        Annotate candidates (dicts with lat/lon) with eta_seconds and return
+        them fastest first; unreachable ones keep their straight-line order
+        at the end.
+        """
+        target, egress = self.snap(pickup_lat, pickup_lon)
+        for candidate in candidates:
+            source, access = self.snap(candidate['lat'], candidate['lon'])
+            if source is None or target is None:
+                candidate['eta_seconds'] = math.inf
+            else:
+                candidate['eta_seconds'] = access + self.travel_time(source, target) + egress
+        return sorted(candidates, key=lambda candidate: candidate['eta_seconds'])
@@ -0,0 +1,88 @@
+"""
+Fares - Tariff table and fare quote engine
+Tariffs are loaded once into arrays so a whole set of trips and vehicle types is priced in one call
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+from services.geo import haversine_km, pairwise_distances_km
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Optional JSON file: {"sedan": {"base": 3.5, "per_km": 1.0}, ...}
+TARIFF_FILE = os.getenv('FARE_TARIFF_FILE')
+
+DEFAULT_TARIFFS = {
+    'bike': {'base': 2.0, 'per_km': 0.5},
+    'sedan': {'base': 3.5, 'per_km': 1.0},
+    'suv': {'base': 5.0, 'per_km': 1.5}
+}
+# Applied to vehicle types missing from the table
+FALLBACK_TARIFF = {'base': 3.5, 'per_km': 1.0}
+
+
+class TariffTable:
+    """Per-vehicle-type base fare and per-km rate held as parallel arrays"""
+    
+    def __init__(self, tariffs=None, fallback=FALLBACK_TARIFF):
+        tariffs = tariffs or DEFAULT_TARIFFS
+        self.vehicle_types = list(tariffs)
+        self.positions = {vehicle_type: i for i, vehicle_type in enumerate(self.vehicle_types)}
+        self.base = np.array([tariffs[v]['base'] for v in self.vehicle_types], dtype=np.float64)
+        self.per_km = np.array([tariffs[v]['per_km'] for v in self.vehicle_types], dtype=np.float64)
+        # Plain tuples for the scalar path, which is cheaper than indexing arrays
+        self.rates = {v: (tariffs[v]['base'], tariffs[v]['per_km']) for v in self.vehicle_types}
+        self.fallback = (fallback['base'], fallback['per_km'])
+    
+    @classmethod
+    def load(cls, path=TARIFF_FILE):
+        """Load tariffs from a JSON file, falling back to the built-in table"""
+        if not path:
+            return cls()
+        try:
+            with open(path) as f:
+                return cls(json.load(f))
+        except Exception as e:
+            logger.error(f"Error loading tariff file {path}: {e}")
+            return cls()
+    
+    def __contains__(self, vehicle_type):
+        return vehicle_type in self.rates
+    
+    def fare(self, distance_km, vehicle_type):
+        """Fare for a trip of a given length; unknown vehicle types get the fallback tariff"""
+        base, per_km = self.rates.get(vehicle_type, self.fallback)
+        return round(base + distance_km * per_km, 2)
+    
+    def quote(self, pickup_lat, pickup_lon, dest_lat, dest_lon, vehicle_types=None):
+        """
+        Distance and fare of one trip for each vehicle type (all of them by
+        default). Raises ValueError for a vehicle type missing from the table.
+        """
+        vehicle_types = vehicle_types or self.vehicle_types
+        unknown = [vehicle_type for vehicle_type in vehicle_types if vehicle_type not in self.rates]
+        if unknown:
+            raise ValueError(f"Unknown vehicle type: {', '.join(unknown)}")
+        distance = haversine_km(pickup_lat, pickup_lon, dest_lat, dest_lon)
+        return round(distance, 2), {
+            vehicle_type: self.fare(distance, vehicle_type)
+            for vehicle_type in vehicle_types
+        }
+    
+    def quote_batch(self, pickup_lats, pickup_lons, dest_lats, dest_lons):
+        """
+        Price N trips for every vehicle type at once. Returns the N trip
+        distances and an N x V fare matrix whose columns follow
+        self.vehicle_types.
+        """
+        distances = pairwise_distances_km(pickup_lats, pickup_lons, dest_lats, dest_lons)
+        fares = self.base[None, :] + distances[:, None] * self.per_km[None, :]
+        return np.round(distances, 2), np.round(fares, 2)
+
+
+# Shared table loaded once per process
+tariffs = TariffTable.load()
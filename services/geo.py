@@ -0,0 +1,90 @@
+"""
+Geo - Haversine distance kernels shared by the matching, location and websocket services
+Array functions take NumPy arrays (or sequences) of coordinates in degrees
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE_LAT = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Calculate distance between two points using Haversine formula"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lon = math.radians(lon2 - lon1)
+    
+    a = math.sin(delta_lat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return EARTH_RADIUS_KM * c
+
+
+def distances_km(lat, lon, lats, lons):
+    """Distance from one point to each of N points"""
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    lat_rad = math.radians(lat)
+    
+    a = (np.sin((lats - lat_rad) / 2) ** 2
+         + math.cos(lat_rad) * np.cos(lats) * np.sin((lons - math.radians(lon)) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def pairwise_distances_km(lats1, lons1, lats2, lons2):
+    """Distance from point i of the first set to point i of the second"""
+    lats1 = np.radians(np.asarray(lats1, dtype=np.float64))
+    lons1 = np.radians(np.asarray(lons1, dtype=np.float64))
+    lats2 = np.radians(np.asarray(lats2, dtype=np.float64))
+    lons2 = np.radians(np.asarray(lons2, dtype=np.float64))
+    
+    a = (np.sin((lats2 - lats1) / 2) ** 2
+         + np.cos(lats1) * np.cos(lats2) * np.sin((lons2 - lons1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def distance_matrix_km(lats1, lons1, lats2, lons2):
+    """M x N distances from each of M points to each of N points"""
+    lats1 = np.radians(np.asarray(lats1, dtype=np.float64))[:, None]
+    lons1 = np.radians(np.asarray(lons1, dtype=np.float64))[:, None]
+    lats2 = np.radians(np.asarray(lats2, dtype=np.float64))[None, :]
+    lons2 = np.radians(np.asarray(lons2, dtype=np.float64))[None, :]
+    
+    a = (np.sin((lats2 - lats1) / 2) ** 2
+         + np.cos(lats1) * np.cos(lats2) * np.sin((lons2 - lons1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def within_radius(lat, lon, lats, lons, radius_km):
+    """
+    Indices and distances of the points within radius_km of one point,
+    nearest first. A latitude band check discards far points before any
+    trigonometry is done.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    
+    band = np.flatnonzero(np.abs(lats - lat) <= radius_km / KM_PER_DEGREE_LAT)
+    distances = distances_km(lat, lon, lats[band], lons[band])
+    inside = distances <= radius_km
+    
+    indices = band[inside]
+    distances = distances[inside]
+    order = np.argsort(distances, kind='stable')
+    return indices[order], distances[order]
+
+
+def within_radius_many(lats1, lons1, lats2, lons2, radius_km):
+    """
+    For each of M points, the indices and distances of the N points within
+    radius_km, nearest first. Returns a list of (indices, distances) pairs.
+    """
+    distances = distance_matrix_km(lats1, lons1, lats2, lons2)
+    results = []
+    for row in distances:
+        indices = np.flatnonzero(row <= radius_km)
+        order = np.argsort(row[indices], kind='stable')
+        results.append((indices[order], row[indices][order]))
+    return results
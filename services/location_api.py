@@ -0,0 +1,70 @@
+"""
+Location API - HTTP queries against the Location Service's in-memory driver store
+Lets other services read live supply without going through Postgres
+"""
+import os
+import threading
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Query
+
+LOCATION_API_PORT = int(os.getenv('LOCATION_API_PORT', '8007'))
+
+
+def create_app(service):
+    """FastAPI app answering queries from a running LocationService"""
+    app = FastAPI(title="Location Service API", version="1.0.0")
+    
+    @app.get("/health")
+    async def health_check():
+        return {"status": "healthy", "drivers": len(service.driver_locations)}
+    
+    @app.get("/drivers/nearby")
+    def nearby_drivers(lat: float, lon: float, radius_km: float = Query(5, gt=0),
+                       vehicle_type: Optional[str] = None):
+        """Drivers within radius_km of a point, nearest first"""
+        drivers = service.get_nearby_drivers(lat, lon, radius_km, vehicle_type)
+        return {"drivers": drivers, "count": len(drivers)}
+    
+    @app.get("/drivers/nearest")
+    def nearest_drivers(lat: float, lon: float, k: int = Query(5, ge=1, le=1000),
+                        vehicle_type: Optional[str] = None, max_radius_km: Optional[float] = None):
+        """The k drivers closest to a point, nearest first"""
+        drivers = service.get_nearest_drivers(lat, lon, k, vehicle_type, max_radius_km)
+        return {"drivers": drivers, "count": len(drivers)}
+    
+    @app.get("/drivers/bbox")
+    def drivers_in_bounds(min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                          vehicle_type: Optional[str] = None):
+        """Drivers inside a bounding box"""
+        drivers = service.get_drivers_in_bounds(min_lat, min_lon, max_lat, max_lon, vehicle_type)
+        return {"drivers": drivers, "count": len(drivers)}
+    
+    @app.get("/drivers/{driver_id}")
+    def driver_location(driver_id: int):
+        """Last known location of one driver"""
+        location = service.driver_locations.get(driver_id)
+        if location is None:
+            raise HTTPException(status_code=404, detail="Driver location not found")
+        return {"driver_id": driver_id, "location": location}
+    
+    @app.get("/drivers/{driver_id}/track")
+    def driver_track(driver_id: int, seconds: Optional[float] = None,
+                     tolerance_meters: Optional[float] = None):
+        """Recent track of one driver, optionally simplified"""
+        track = service.get_driver_track(driver_id, seconds, tolerance_meters)
+        if track is None:
+            raise HTTPException(status_code=404, detail="Driver track not found")
+        return {"driver_id": driver_id, "points": track}
+    
+    return app
+
+
+def start_api(service, port=LOCATION_API_PORT):
+    """Serve the query API from a background thread"""
+    config = uvicorn.Config(create_app(service), host="0.0.0.0", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    return server
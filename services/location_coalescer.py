@@ -0,0 +1,156 @@
+"""
+Location Coalescer - Thins driver location pings before they are applied
+Keeps only the latest ping per driver within a short window and drops pings that barely moved
+"""
+import logging
+import os
+import threading
+import time
+
+from prometheus_client import Counter
+
+from services.geo import haversine_km
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pings are buffered this long and only the newest per driver is applied (0 applies immediately)
+COALESCE_WINDOW_MS = int(os.getenv('LOCATION_COALESCE_WINDOW_MS', '200'))
+# Pings that moved less than this since the last applied one are dropped...
+MIN_MOVE_METERS = float(os.getenv('LOCATION_MIN_MOVE_METERS', '10'))
+# ...unless this long has passed, so a parked driver still refreshes its timestamp
+HEARTBEAT_SECONDS = float(os.getenv('LOCATION_HEARTBEAT_SECONDS', '30'))
+
+UPDATES_RECEIVED = Counter(
+    'location_updates_received_total',
+    'Driver location pings received by a coalescer',
+    ['consumer']
+)
+UPDATES_COALESCED = Counter(
+    'location_updates_coalesced_total',
+    'Location pings replaced by a newer ping from the same driver within the window',
+    ['consumer']
+)
+UPDATES_DOWNSAMPLED = Counter(
+    'location_updates_downsampled_total',
+    'Location pings dropped for moving less than the distance threshold',
+    ['consumer']
+)
+UPDATES_APPLIED = Counter(
+    'location_updates_applied_total',
+    'Location pings passed on to the location handler',
+    ['consumer']
+)
+
+
+class LocationCoalescer:
+    """Sits between a driver-locations consumer and its handler"""
+    
+    def __init__(self, handler, consumer, window_ms=COALESCE_WINDOW_MS,
+                 min_move_meters=MIN_MOVE_METERS, heartbeat_seconds=HEARTBEAT_SECONDS):
+        self.handler = handler
+        self.consumer = consumer
+        self.window_seconds = window_ms / 1000
+        self.min_move_km = min_move_meters / 1000
+        self.heartbeat_seconds = heartbeat_seconds
+        # driver_id -> newest ping not yet applied
+        self.pending = {}
+        # driver_id -> (lat, lon, applied_at, timestamp) of the last applied ping
+        self.applied = {}
+        # driver_id -> times forgotten, so pings taken for a flush before that are dropped
+        self.generations = {}
+        # driver_id -> pings being passed to the handler right now
+        self.applying = {}
+        self.lock = threading.Lock()
+        self.applied_condition = threading.Condition(self.lock)
+        self.stopped = threading.Event()
+    
+    def submit(self, message):
+        """Accept a ping from the consumer"""
+        UPDATES_RECEIVED.labels(self.consumer).inc()
+        if self.window_seconds <= 0:
+            self.apply(message)
+            return
+        
+        with self.lock:
+            pending = self.pending.get(message['driver_id'])
+            if pending is not None:
+                UPDATES_COALESCED.labels(self.consumer).inc()
+                if pending.get('timestamp', 0) > message.get('timestamp', 0):
+                    return
+            self.pending[message['driver_id']] = message
+    
+    def forget(self, driver_id):
+        """
+        Drop buffered and last-applied state for a driver that went offline.
+        Returns once no earlier ping of theirs can still reach the handler,
+        so the caller can remove the driver without it coming back.
+        """
+        with self.lock:
+            self.pending.pop(driver_id, None)
+            self.applied.pop(driver_id, None)
+            self.generations[driver_id] = self.generations.get(driver_id, 0) + 1
+            self.applied_condition.wait_for(lambda: driver_id not in self.applying)
+    
+    def should_apply(self, message, now):
+        """True unless the ping is older than the last one applied, or moved less than the threshold with no heartbeat due"""
+        last = self.applied.get(message['driver_id'])
+        if last is None:
+            return True
+        lat, lon, applied_at, timestamp = last
+        # Geo-keyed partitions can deliver a driver's pings out of order near region borders
+        if message.get('timestamp', 0) < timestamp:
+            return False
+        if now - applied_at >= self.heartbeat_seconds:
+            return True
+        return haversine_km(lat, lon, message['lat'], message['lon']) >= self.min_move_km
+    
+    def apply(self, message, generation=None):
+        """Hand a ping to the handler if it carries new information and the driver was not forgotten since generation"""
+        driver_id = message['driver_id']
+        now = time.time()
+        with self.lock:
+            if generation is not None and self.generations.get(driver_id, 0) != generation:
+                return
+            if not self.should_apply(message, now):
+                UPDATES_DOWNSAMPLED.labels(self.consumer).inc()
+                return
+            self.applied[driver_id] = (message['lat'], message['lon'], now, message.get('timestamp', 0))
+            self.applying[driver_id] = self.applying.get(driver_id, 0) + 1
+        
+        UPDATES_APPLIED.labels(self.consumer).inc()
+        try:
+            self.handler(message)
+        except Exception as e:
+            logger.error(f"Error applying location update: {e}")
+        finally:
+            with self.lock:
+                self.applying[driver_id] -= 1
+                if not self.applying[driver_id]:
+                    del self.applying[driver_id]
+                    self.applied_condition.notify_all()
+    
+    def flush(self):
+        """Apply the newest buffered ping of every driver"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            batch = [(message, self.generations.get(driver_id, 0)) for driver_id, message in pending.items()]
+        for message, generation in batch:
+            self.apply(message, generation)
+    
+    def run(self):
+        """Flush once per window until stopped"""
+        while not self.stopped.wait(self.window_seconds):
+            self.flush()
+        self.flush()
+    
+    def start(self):
+        """Start the flush thread (not needed when the window is 0)"""
+        if self.window_seconds <= 0:
+            return None
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+    
+    def stop(self):
+        self.stopped.set()
@@ -6,12 +6,20 @@ import sys
 import os
 import threading
 import logging
+import time
 from collections import defaultdict
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config.kafka_config import KafkaConsumerWrapper, TOPICS
+from services.location_coalescer import LocationCoalescer
+from services.location_snapshot import (
+    read_snapshot, write_snapshot, consumer_offsets,
+    LOCATION_SNAPSHOT_FILE, SNAPSHOT_INTERVAL_SECONDS
+)
+from services.location_store import LocationStore, TTL_TICK_SECONDS
+from services.trajectory import TrajectoryStore
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,9 +29,14 @@ class LocationService:
     """Service to track driver locations"""
     
     def __init__(self):
-        # Store driver locations in memory
-        self.driver_locations = {}
+        # Store driver locations in memory, one array slot per online driver
+        self.driver_locations = LocationStore()
         self.driver_status = {}
+        # Recent points of every online driver
+        self.trajectories = TrajectoryStore()
+        # Consumer pings pass through here before handle_location_update
+        self.coalescer = LocationCoalescer(self.handle_location_update, 'location-service')
+        self.running = False
         logger.info("Location Service initialized")
     
     def handle_location_update(self, message):
@@ -36,14 +49,10 @@ class LocationService:
             timestamp = message['timestamp']
             
             # Store location
-            self.driver_locations[driver_id] = {
-                'lat': lat,
-                'lon': lon,
-                'vehicle_type': vehicle_type,
-                'timestamp': timestamp
-            }
+            self.driver_locations.upsert(driver_id, lat, lon, vehicle_type, timestamp)
+            self.trajectories.append(driver_id, lat, lon, timestamp)
             
-            logger.info(f"Updated location for driver {driver_id}: ({lat}, {lon})")
+            logger.debug(f"Updated location for driver {driver_id}: ({lat}, {lon})")
             
         except Exception as e:
             logger.error(f"Error handling location update: {e}")
@@ -56,42 +65,114 @@ class LocationService:
             
             self.driver_status[driver_id] = is_online
             
-            if not is_online and driver_id in self.driver_locations:
+            if not is_online:
                 # Remove location when driver goes offline
-                del self.driver_locations[driver_id]
+                self.coalescer.forget(driver_id)
+                self.driver_locations.remove(driver_id)
+                self.trajectories.remove(driver_id)
             
             logger.info(f"Driver {driver_id} is now {'online' if is_online else 'offline'}")
             
         except Exception as e:
             logger.error(f"Error handling availability update: {e}")
     
-    def get_nearby_drivers(self, lat, lon, radius_km=5):
+    def get_nearby_drivers(self, lat, lon, radius_km=5, vehicle_type=None):
         """Get all drivers within a certain radius"""
-        import math
-        
-        nearby_drivers = []
+        return [
+            {
+                'driver_id': driver_id,
+                'location': location,
+                'distance': round(distance, 2)
+            }
+            for driver_id, location, distance in self.driver_locations.within_radius(lat, lon, radius_km, vehicle_type)
+        ]
+    
+    def get_nearest_drivers(self, lat, lon, k=5, vehicle_type=None, max_radius_km=None):
+        """Get the k drivers closest to a point, nearest first"""
+        return [
+            {
+                'driver_id': driver_id,
+                'location': location,
+                'distance': round(distance, 2)
+            }
+            for driver_id, location, distance in self.driver_locations.nearest(
+                lat, lon, k, vehicle_type=vehicle_type, max_radius_km=max_radius_km
+            )
+        ]
+    
+    def get_drivers_in_bounds(self, min_lat, min_lon, max_lat, max_lon, vehicle_type=None):
+        """Get all drivers inside a bounding box"""
+        return [
+            {
+                'driver_id': driver_id,
+                'location': location
+            }
+            for driver_id, location in self.driver_locations.in_bounds(
+                min_lat, min_lon, max_lat, max_lon, vehicle_type=vehicle_type
+            )
+        ]
+    
+    def get_driver_track(self, driver_id, seconds=None, tolerance_meters=None):
+        """
+        Recent points of a driver, oldest first. With tolerance_meters the
+        track is simplified (Douglas-Peucker) before it is returned.
+        """
+        if tolerance_meters is None:
+            track = self.trajectories.track(driver_id, seconds)
+        else:
+            track = self.trajectories.compressed_track(driver_id, seconds, tolerance_meters)
+        if track is None:
+            return None
         
-        for driver_id, location in self.driver_locations.items():
-            # Simple distance calculation
-            R = 6371  # Earth's radius in km
-            
-            lat1_rad = math.radians(lat)
-            lat2_rad = math.radians(location['lat'])
-            delta_lat = math.radians(location['lat'] - lat)
-            delta_lon = math.radians(location['lon'] - lon)
-            
-            a = math.sin(delta_lat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon / 2) ** 2
-            c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-            distance = R * c
-            
-            if distance <= radius_km:
-                nearby_drivers.append({
-                    'driver_id': driver_id,
-                    'location': location,
-                    'distance': round(distance, 2)
-                })
+        return [
+            {'lat': lat, 'lon': lon, 'timestamp': timestamp}
+            for lat, lon, timestamp in zip(*(column.tolist() for column in track))
+        ]
+    
+    def restore_snapshot(self, path=LOCATION_SNAPSHOT_FILE):
+        """Map the last snapshot back in; returns the consumer offsets to resume from"""
+        started = time.time()
+        snapshot = read_snapshot(path)
+        if snapshot is None:
+            return {}
         
-        return nearby_drivers
+        columns, header = snapshot
+        self.driver_locations.restore(columns, header['vehicle_types'], header['taken_at'])
+        logger.info(f"Restored {header['count']} driver locations from {path} "
+                    f"in {(time.time() - started) * 1000:.0f} ms")
+        return header['offsets']
+    
+    def save_snapshot(self, consumers, path=LOCATION_SNAPSHOT_FILE):
+        """Write the location table together with the consumer offsets it reflects"""
+        # Taken first: every ping before these offsets is now applied or buffered, and the flush applies the rest
+        offsets = consumer_offsets(consumers)
+        self.coalescer.flush()
+        columns, vehicle_types = self.driver_locations.snapshot_columns()
+        write_snapshot(path, columns, vehicle_types, offsets)
+    
+    def run_snapshots(self, consumers):
+        """Snapshot the location table every SNAPSHOT_INTERVAL_SECONDS"""
+        while self.running:
+            time.sleep(SNAPSHOT_INTERVAL_SECONDS)
+            try:
+                self.save_snapshot(consumers)
+            except Exception as e:
+                logger.error(f"Error writing location snapshot: {e}")
+    
+    def run_expiry(self):
+        """Hide locations past the stale TTL and evict those past the eviction TTL"""
+        while self.running:
+            time.sleep(TTL_TICK_SECONDS)
+            try:
+                stale_ids, evicted_ids = self.driver_locations.expire()
+                for driver_id in evicted_ids:
+                    self.coalescer.forget(driver_id)
+                    self.driver_status.pop(driver_id, None)
+                    self.trajectories.remove(driver_id)
+                if stale_ids or evicted_ids:
+                    logger.info(f"Location TTL: {len(stale_ids)} stale, {len(evicted_ids)} evicted")
+            except Exception as e:
+                logger.error(f"Error expiring driver locations: {e}")
     
     def start(self):
         """Start consuming location and availability updates"""
@@ -99,19 +180,24 @@ class LocationService:
         from prometheus_client import start_http_server
         start_http_server(8005)
         logger.info("Prometheus metrics server started on port 8005")
+        
+        # Warm restart: load the last snapshot and replay everything after it
+        offsets = self.restore_snapshot() if SNAPSHOT_INTERVAL_SECONDS > 0 else {}
 
         # Consumer for location updates
         location_consumer = KafkaConsumerWrapper(
             TOPICS['DRIVER_LOCATIONS'],
             'location-service-group',
-            self.handle_location_update
+            self.coalescer.submit,
+            start_offsets=offsets.get(TOPICS['DRIVER_LOCATIONS'])
         )
         
         # Consumer for availability updates
         availability_consumer = KafkaConsumerWrapper(
             TOPICS['DRIVER_AVAILABILITY'],
             'location-service-group',
-            self.handle_availability_update
+            self.handle_availability_update,
+            start_offsets=offsets.get(TOPICS['DRIVER_AVAILABILITY'])
         )
         
         # Start consumers in separate threads
@@ -120,6 +206,20 @@ class LocationService:
         
         location_thread.start()
         availability_thread.start()
+        self.coalescer.start()
+        self.running = True
+        threading.Thread(target=self.run_expiry, daemon=True).start()
+        if SNAPSHOT_INTERVAL_SECONDS > 0:
+            threading.Thread(
+                target=self.run_snapshots,
+                args=([location_consumer, availability_consumer],),
+                daemon=True
+            ).start()
+        
+        # Query API over the in-memory store
+        from services.location_api import start_api, LOCATION_API_PORT
+        start_api(self, LOCATION_API_PORT)
+        logger.info(f"Location query API started on port {LOCATION_API_PORT}")
         
         logger.info("Location Service started and consuming from Kafka")
         
@@ -130,6 +230,8 @@ class LocationService:
             logger.info("Shutting down Location Service...")
             location_consumer.stop_consuming()
             availability_consumer.stop_consuming()
+            self.coalescer.stop()
+            self.running = False
 
 
 if __name__ == '__main__':
@@ -0,0 +1,157 @@
+"""
+Location Snapshot - Binary snapshots of in-memory driver locations for warm restarts
+Columns are written raw and page-aligned so a restart maps them back without parsing
+
+Layout: MAGIC, uint32 header length, JSON header, then one array per column.
+The header records the row count, vehicle-type names, column offsets and the
+consumer offsets the snapshot is consistent with.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAGIC = b'LOCSNAP1'
+# Seconds between snapshots (0 disables them)
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv('LOCATION_SNAPSHOT_INTERVAL_SECONDS', '5'))
+LOCATION_SNAPSHOT_FILE = os.getenv(
+    'LOCATION_SNAPSHOT_FILE',
+    os.path.join(tempfile.gettempdir(), 'location-service.snapshot')
+)
+GATEWAY_SNAPSHOT_FILE = os.getenv(
+    'GATEWAY_LOCATION_SNAPSHOT_FILE',
+    os.path.join(tempfile.gettempdir(), 'api-gateway-locations.snapshot')
+)
+
+COLUMNS = (
+    ('driver_ids', np.int64),
+    ('lats', np.float64),
+    ('lons', np.float64),
+    ('vehicle_codes', np.int8),
+    ('timestamps', np.float64),
+)
+
+
+def _aligned(position, alignment=mmap.ALLOCATIONGRANULARITY):
+    return (position + alignment - 1) // alignment * alignment
+
+
+def write_snapshot(path, columns, vehicle_types, offsets):
+    """
+    Write columns (name -> array, all the same length) and the consumer
+    offsets ({topic: {partition: offset}}) they reflect. The file is
+    replaced atomically, so a crash mid-write keeps the previous snapshot.
+    """
+    count = len(columns['driver_ids'])
+    layout = {}
+    position = 0
+    for name, dtype in COLUMNS:
+        position = _aligned(position)
+        layout[name] = position
+        position += count * np.dtype(dtype).itemsize
+    
+    header = json.dumps({
+        'count': count,
+        'taken_at': time.time(),
+        'vehicle_types': vehicle_types,
+        'columns': layout,
+        'offsets': offsets
+    }).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 4 + len(header))
+    
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for name, dtype in COLUMNS:
+            f.seek(data_start + layout[name])
+            f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path):
+    """
+    Map a snapshot back in. Returns (columns, header) where the columns are
+    copy-on-write memory maps of the file, or None when there is no usable
+    snapshot.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                logger.warning(f"Ignoring {path}: not a location snapshot")
+                return None
+            (header_length,) = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        data_start = _aligned(len(MAGIC) + 4 + header_length)
+        
+        count = header['count']
+        columns = {}
+        for name, dtype in COLUMNS:
+            if count == 0:
+                columns[name] = np.zeros(0, dtype=dtype)
+            else:
+                # mode 'c' writes to private pages, so the store can update rows in place
+                columns[name] = np.memmap(path, dtype=dtype, mode='c',
+                                          offset=data_start + header['columns'][name], shape=(count,))
+        # JSON object keys are strings
+        header['offsets'] = {
+            topic: {int(partition): offset for partition, offset in partitions.items()}
+            for topic, partitions in header['offsets'].items()
+        }
+        return columns, header
+    except Exception as e:
+        logger.error(f"Error reading location snapshot {path}: {e}")
+        return None
+
+
+def columns_from_locations(items):
+    """Columns and vehicle-type names for (driver_id, location dict) pairs with known coordinates"""
+    vehicle_types = []
+    codes = {}
+    rows = []
+    for driver_id, location in items:
+        if location.get('lat') is None or location.get('lon') is None:
+            continue
+        vehicle_type = location.get('vehicle_type')
+        if vehicle_type not in codes:
+            codes[vehicle_type] = len(vehicle_types)
+            vehicle_types.append(vehicle_type)
+        rows.append((driver_id, location['lat'], location['lon'], codes[vehicle_type],
+                     location.get('timestamp') or 0.0))
+    
+    columns = {}
+    for index, (name, dtype) in enumerate(COLUMNS):
+        columns[name] = np.array([row[index] for row in rows], dtype=dtype)
+    return columns, vehicle_types
+
+
+def locations_from_columns(columns, vehicle_types):
+    """(driver_id, location dict) pairs back from snapshot columns"""
+    return zip(
+        columns['driver_ids'].tolist(),
+        (
+            {'lat': lat, 'lon': lon, 'vehicle_type': vehicle_types[code], 'timestamp': timestamp}
+            for lat, lon, code, timestamp in zip(
+                columns['lats'].tolist(), columns['lons'].tolist(),
+                columns['vehicle_codes'].tolist(), columns['timestamps'].tolist()
+            )
+        )
+    )
+
+
+def consumer_offsets(consumers):
+    """{topic: {partition: next offset}} that a set of consumers has handed to their callbacks"""
+    return {consumer.topic: dict(consumer.positions) for consumer in consumers}
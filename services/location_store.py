@@ -0,0 +1,265 @@
+"""
+Location Store - Columnar in-memory table of driver positions
+One preallocated array per field; a driver owns a slot and updates overwrite it in place
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from services.geo import distances_km, within_radius
+from services.timing_wheel import TimingWheel
+
+INITIAL_CAPACITY = 1024
+# A driver not heard from for this long drops out of spatial queries...
+STALE_SECONDS = float(os.getenv('LOCATION_STALE_SECONDS', '60'))
+# ...and is removed from the store after this long
+EVICT_SECONDS = float(os.getenv('LOCATION_EVICT_SECONDS', '300'))
+TTL_TICK_SECONDS = float(os.getenv('LOCATION_TTL_TICK_SECONDS', '1'))
+# Slot of a driver that is not in the store
+NO_SLOT = -1
+
+
+class LocationStore:
+    """
+    Driver positions held as parallel arrays indexed by slot. Freed slots
+    keep NaN coordinates, so radius queries over the used prefix skip
+    them without a separate mask.
+    """
+    
+    def __init__(self, capacity=INITIAL_CAPACITY, stale_seconds=STALE_SECONDS, evict_seconds=EVICT_SECONDS):
+        self.lats = np.full(capacity, np.nan, dtype=np.float64)
+        self.lons = np.full(capacity, np.nan, dtype=np.float64)
+        self.vehicle_codes = np.zeros(capacity, dtype=np.int8)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.stale = np.zeros(capacity, dtype=np.bool_)
+        self.driver_ids = np.full(capacity, NO_SLOT, dtype=np.int64)
+        # driver_id -> slot
+        self.slots = {}
+        # Slots released by removed drivers, reused before the used prefix grows
+        self.free = []
+        # Number of slots ever handed out; queries only look at this prefix
+        self.size = 0
+        # vehicle_type <-> int8 code
+        self.vehicle_types = []
+        self.vehicle_type_codes = {}
+        self.stale_seconds = stale_seconds
+        self.evict_seconds = evict_seconds
+        # Deadlines are taken from arrival time, not the driver's clock
+        self.stale_wheel = TimingWheel(TTL_TICK_SECONDS)
+        self.evict_wheel = TimingWheel(TTL_TICK_SECONDS)
+        self.lock = threading.RLock()
+    
+    def __len__(self):
+        return len(self.slots)
+    
+    def __contains__(self, driver_id):
+        return driver_id in self.slots
+    
+    @property
+    def capacity(self):
+        return len(self.lats)
+    
+    def _grow(self):
+        """Double every column"""
+        capacity = max(self.capacity * 2, INITIAL_CAPACITY)
+        self.lats = self._resized(self.lats, capacity, np.nan)
+        self.lons = self._resized(self.lons, capacity, np.nan)
+        self.vehicle_codes = self._resized(self.vehicle_codes, capacity, 0)
+        self.timestamps = self._resized(self.timestamps, capacity, 0)
+        self.stale = self._resized(self.stale, capacity, False)
+        self.driver_ids = self._resized(self.driver_ids, capacity, NO_SLOT)
+    
+    @staticmethod
+    def _resized(column, capacity, fill):
+        resized = np.full(capacity, fill, dtype=column.dtype)
+        resized[:len(column)] = column
+        return resized
+    
+    def vehicle_code(self, vehicle_type):
+        """Code of a vehicle type, assigning the next one on first sight"""
+        code = self.vehicle_type_codes.get(vehicle_type)
+        if code is None:
+            if len(self.vehicle_types) > np.iinfo(np.int8).max:
+                raise ValueError(f"Too many vehicle types to encode: {vehicle_type}")
+            code = len(self.vehicle_types)
+            self.vehicle_types.append(vehicle_type)
+            self.vehicle_type_codes[vehicle_type] = code
+        return code
+    
+    def upsert(self, driver_id, lat, lon, vehicle_type, timestamp):
+        """Write a driver's position into its slot, allocating one if needed; returns the slot"""
+        now = time.time()
+        with self.lock:
+            slot = self.slots.get(driver_id)
+            if slot is None:
+                if self.free:
+                    slot = self.free.pop()
+                else:
+                    if self.size == self.capacity:
+                        self._grow()
+                    slot = self.size
+                    self.size += 1
+                self.slots[driver_id] = slot
+                self.driver_ids[slot] = driver_id
+            
+            self.lats[slot] = lat
+            self.lons[slot] = lon
+            self.vehicle_codes[slot] = self.vehicle_code(vehicle_type)
+            self.timestamps[slot] = timestamp
+            self.stale[slot] = False
+            self.stale_wheel.schedule(driver_id, now + self.stale_seconds)
+            self.evict_wheel.schedule(driver_id, now + self.evict_seconds)
+            return slot
+    
+    def remove(self, driver_id):
+        """Release a driver's slot; returns False if the driver was not stored"""
+        with self.lock:
+            slot = self.slots.pop(driver_id, None)
+            if slot is None:
+                return False
+            self.lats[slot] = np.nan
+            self.lons[slot] = np.nan
+            self.driver_ids[slot] = NO_SLOT
+            self.free.append(slot)
+            self.stale_wheel.cancel(driver_id)
+            self.evict_wheel.cancel(driver_id)
+            return True
+    
+    def expire(self, now=None):
+        """
+        Advance the TTL wheels: mark drivers past the stale TTL and remove
+        drivers past the eviction TTL. Returns (stale_ids, evicted_ids).
+        """
+        with self.lock:
+            stale_ids = self.stale_wheel.advance(now)
+            evicted_ids = self.evict_wheel.advance(now)
+            for driver_id in stale_ids:
+                slot = self.slots.get(driver_id)
+                if slot is not None:
+                    self.stale[slot] = True
+            evicted_ids = [driver_id for driver_id in evicted_ids if self.remove(driver_id)]
+        return stale_ids, evicted_ids
+    
+    def snapshot_columns(self):
+        """Copies of the fresh rows as snapshot columns, plus the vehicle-type names"""
+        with self.lock:
+            slots = np.fromiter(self.slots.values(), dtype=np.int64, count=len(self.slots))
+            slots = slots[~self.stale[slots]]
+            columns = {
+                'driver_ids': self.driver_ids[slots],
+                'lats': self.lats[slots],
+                'lons': self.lons[slots],
+                'vehicle_codes': self.vehicle_codes[slots],
+                'timestamps': self.timestamps[slots]
+            }
+            return columns, list(self.vehicle_types)
+    
+    def restore(self, columns, vehicle_types, taken_at):
+        """
+        Replace the contents with snapshot columns. The arrays are adopted
+        as they are (memory maps stay memory maps) and TTLs count from
+        taken_at.
+        """
+        with self.lock:
+            count = len(columns['driver_ids'])
+            self.lats = columns['lats']
+            self.lons = columns['lons']
+            self.vehicle_codes = columns['vehicle_codes']
+            self.timestamps = columns['timestamps']
+            self.driver_ids = columns['driver_ids']
+            self.stale = np.zeros(count, dtype=np.bool_)
+            driver_ids = self.driver_ids.tolist()
+            self.slots = dict(zip(driver_ids, range(count)))
+            self.free = []
+            self.size = count
+            self.vehicle_types = list(vehicle_types)
+            self.vehicle_type_codes = {vehicle_type: code for code, vehicle_type in enumerate(self.vehicle_types)}
+            self.stale_wheel.schedule_many(driver_ids, taken_at + self.stale_seconds)
+            self.evict_wheel.schedule_many(driver_ids, taken_at + self.evict_seconds)
+    
+    def location_at(self, slot):
+        """Location dict for a slot"""
+        return {
+            'lat': float(self.lats[slot]),
+            'lon': float(self.lons[slot]),
+            'vehicle_type': self.vehicle_types[self.vehicle_codes[slot]],
+            'timestamp': float(self.timestamps[slot]),
+            'stale': bool(self.stale[slot])
+        }
+    
+    def get(self, driver_id):
+        """Location dict for a driver, or None"""
+        with self.lock:
+            slot = self.slots.get(driver_id)
+            return None if slot is None else self.location_at(slot)
+    
+    def items(self):
+        """(driver_id, location) for every stored driver"""
+        with self.lock:
+            return [(driver_id, self.location_at(slot)) for driver_id, slot in self.slots.items()]
+    
+    def _live(self, size, vehicle_type):
+        """Mask over the used prefix of fresh, occupied slots of a vehicle type; None if the type is unknown"""
+        live = ~np.isnan(self.lats[:size]) & ~self.stale[:size]
+        if vehicle_type is not None:
+            code = self.vehicle_type_codes.get(vehicle_type)
+            if code is None:
+                return None
+            live &= self.vehicle_codes[:size] == code
+        return live
+    
+    def nearest(self, lat, lon, k, vehicle_type=None, max_radius_km=None):
+        """(driver_id, location, distance_km) of the k drivers closest to a point, nearest first"""
+        with self.lock:
+            size = self.size
+            live = self._live(size, vehicle_type)
+            if live is None or k <= 0:
+                return []
+            distances = distances_km(lat, lon, self.lats[:size], self.lons[:size])
+            if max_radius_km is not None:
+                live &= distances <= max_radius_km
+            
+            slots = np.flatnonzero(live)
+            if len(slots) > k:
+                slots = slots[np.argpartition(distances[slots], k - 1)[:k]]
+            slots = slots[np.argsort(distances[slots], kind='stable')]
+            return [
+                (int(self.driver_ids[slot]), self.location_at(slot), float(distances[slot]))
+                for slot in slots
+            ]
+    
+    def in_bounds(self, min_lat, min_lon, max_lat, max_lon, vehicle_type=None):
+        """(driver_id, location) of the drivers inside a lat/lon bounding box"""
+        with self.lock:
+            size = self.size
+            live = self._live(size, vehicle_type)
+            if live is None:
+                return []
+            lats = self.lats[:size]
+            lons = self.lons[:size]
+            live &= (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+            return [
+                (int(self.driver_ids[slot]), self.location_at(slot))
+                for slot in np.flatnonzero(live)
+            ]
+    
+    def within_radius(self, lat, lon, radius_km, vehicle_type=None):
+        """(driver_id, location, distance_km) within radius_km of a point, nearest first"""
+        with self.lock:
+            size = self.size
+            indices, distances = within_radius(lat, lon, self.lats[:size], self.lons[:size], radius_km)
+            fresh = ~self.stale[indices]
+            indices, distances = indices[fresh], distances[fresh]
+            if vehicle_type is not None:
+                code = self.vehicle_type_codes.get(vehicle_type)
+                if code is None:
+                    return []
+                keep = self.vehicle_codes[indices] == code
+                indices, distances = indices[keep], distances[keep]
+            
+            return [
+                (int(self.driver_ids[slot]), self.location_at(slot), float(distance))
+                for slot, distance in zip(indices, distances)
+            ]
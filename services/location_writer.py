@@ -0,0 +1,123 @@
+"""
+Location Writer - Write-behind persistence of driver positions
+Pings only update an in-memory map; a background thread writes the latest positions in bulk
+"""
+import logging
+import os
+import threading
+
+from sqlalchemy import text, bindparam
+
+from models.database import SessionLocal, Driver
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Interval between bulk writes (0 keeps one UPDATE per ping)
+FLUSH_INTERVAL_MS = int(os.getenv('DRIVER_LOCATION_FLUSH_INTERVAL_MS', '1000'))
+# Rows per UPDATE statement
+FLUSH_BATCH_SIZE = int(os.getenv('DRIVER_LOCATION_FLUSH_BATCH_SIZE', '500'))
+
+
+def bulk_update_statement(count):
+    """UPDATE ... FROM (VALUES ...) setting the position of `count` drivers"""
+    rows = ', '.join(
+        f"(CAST(:id{i} AS INTEGER), CAST(:lat{i} AS DOUBLE PRECISION), CAST(:lon{i} AS DOUBLE PRECISION))"
+        for i in range(count)
+    )
+    return text(
+        "UPDATE drivers SET current_lat = v.lat, current_lon = v.lon "
+        f"FROM (VALUES {rows}) AS v(id, lat, lon) "
+        "WHERE drivers.id = v.id"
+    )
+
+
+class LocationWriteBehind:
+    """Latest unsaved position per driver, flushed to the drivers table periodically"""
+    
+    def __init__(self, interval_ms=FLUSH_INTERVAL_MS, batch_size=FLUSH_BATCH_SIZE):
+        self.interval_seconds = interval_ms / 1000
+        self.batch_size = batch_size
+        # driver_id -> (lat, lon) not yet written
+        self.pending = {}
+        # Positions taken by the flush in progress, still visible to latest()
+        self.flushing = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+    
+    def __len__(self):
+        return len(self.pending)
+    
+    def put(self, driver_id, lat, lon):
+        """Record a driver's newest position; earlier unsaved ones are superseded"""
+        with self.lock:
+            self.pending[driver_id] = (lat, lon)
+    
+    def latest(self, driver_id):
+        """Newest position not yet written to the database, or None"""
+        with self.lock:
+            return self.pending.get(driver_id) or self.flushing.get(driver_id)
+    
+    def write_batch(self, db, rows):
+        """Write one batch of (driver_id, lat, lon) rows"""
+        if db.bind.dialect.name == 'postgresql':
+            params = {}
+            for i, (driver_id, lat, lon) in enumerate(rows):
+                params[f"id{i}"] = driver_id
+                params[f"lat{i}"] = lat
+                params[f"lon{i}"] = lon
+            db.execute(bulk_update_statement(len(rows)), params)
+        else:
+            # Other databases (SQLite in benchmarks) get an executemany
+            db.execute(
+                Driver.__table__.update()
+                .where(Driver.id == bindparam('driver_id'))
+                .values(current_lat=bindparam('lat'), current_lon=bindparam('lon')),
+                [{'driver_id': driver_id, 'lat': lat, 'lon': lon} for driver_id, lat, lon in rows]
+            )
+    
+    def flush(self):
+        """Write every pending position; returns how many were written"""
+        with self.lock:
+            if not self.pending:
+                return 0
+            self.flushing, self.pending = self.pending, {}
+            rows = [(driver_id, lat, lon) for driver_id, (lat, lon) in self.flushing.items()]
+        
+        written = 0
+        db = SessionLocal()
+        try:
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                try:
+                    self.write_batch(db, batch)
+                    db.commit()
+                    written += len(batch)
+                except Exception as e:
+                    logger.error(f"Error writing {len(batch)} driver locations: {e}")
+                    db.rollback()
+                    # Retry next time unless a newer position has arrived meanwhile
+                    with self.lock:
+                        for driver_id, lat, lon in batch:
+                            self.pending.setdefault(driver_id, (lat, lon))
+        finally:
+            db.close()
+            with self.lock:
+                self.flushing = {}
+        
+        logger.debug(f"Wrote {written} driver locations")
+        return written
+    
+    def run(self):
+        """Flush once per interval until stopped"""
+        while not self.stopped.wait(self.interval_seconds):
+            self.flush()
+        self.flush()
+    
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+    
+    def stop(self):
+        self.stopped.set()
@@ -4,183 +4,561 @@ Consumes ride requests and finds the nearest available driver
 """
 import sys
 import os
+import math
+import multiprocessing
+import socket
 import threading
 import logging
-import math
+import time
+from collections import deque
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from prometheus_client import Counter, Gauge, Histogram
 from config.kafka_config import KafkaProducerWrapper, KafkaConsumerWrapper, TOPICS
-from models.database import SessionLocal, Driver, Ride
+from models.database import SessionLocal, Ride
+from services.assignment import min_cost_assignment
+from services.dispatch import Offer, OfferTracker, DISPATCH_CANDIDATES, OFFER_TIMEOUT_SECONDS
+from services.driver_supply import DriverSupply
+from services.eta import RoadNetwork, ETA_CANDIDATES
+from services.fares import tariffs
+from services.location_store import TTL_TICK_SECONDS
+from services.reservations import LocalReservations, DatabaseReservations
+from services.retry_queue import PendingRide, UnmatchedRideQueue, MAX_SEARCH_RADIUS_KM
+from services.geo import haversine_km
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Number of matching worker processes; more than one shares reservations through Postgres
+WORKERS = int(os.getenv('MATCHING_WORKERS', '1'))
+METRICS_PORT = 8004
+# Workers after the first export metrics on this port plus their index, clear of the other services' ports
+WORKER_METRICS_PORT = int(os.getenv('MATCHING_WORKER_METRICS_PORT', '9400'))
+# Stable name of this instance (the pod name in k8s), so a restart rejoins its own consumer groups
+INSTANCE_ID = os.getenv('MATCHING_INSTANCE_ID') or socket.gethostname()
+
+# Batch assignment configuration (a window of 0 keeps one-at-a-time matching)
+BATCH_WINDOW_MS = int(os.getenv('MATCHING_BATCH_WINDOW_MS', '0'))
+BATCH_CANDIDATES = int(os.getenv('MATCHING_BATCH_CANDIDATES', '5'))
+BATCH_REGION_DEG = float(os.getenv('MATCHING_BATCH_REGION_DEG', '0.1'))
+# Cost of leaving a ride unmatched; larger than any pickup distance so the
+# solver always matches as many rides as it can
+UNMATCHED_COST_KM = 1e6
+
+# Prometheus metrics
+BATCH_SIZE = Histogram(
+    'matching_batch_size',
+    'Ride requests solved per matching batch',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+)
+BATCH_LATENCY = Histogram(
+    'matching_batch_latency_seconds',
+    'Time to solve and publish one matching batch'
+)
+BATCH_WAIT = Histogram(
+    'matching_batch_wait_seconds',
+    'Time a ride request waited in the batch window'
+)
+BATCH_UNMATCHED = Counter(
+    'matching_batch_unmatched_total',
+    'Ride requests left without a driver by batch assignment'
+)
+RETRY_QUEUE_DEPTH = Gauge(
+    'matching_retry_queue_depth',
+    'Unmatched ride requests waiting for another attempt'
+)
+RETRY_ATTEMPTS = Counter(
+    'matching_retry_attempts_total',
+    'Deferred matching attempts for previously unmatched rides'
+)
+RETRY_GIVEN_UP = Counter(
+    'matching_retry_given_up_total',
+    'Ride requests cancelled after running out of matching attempts'
+)
+TIME_TO_MATCH = Histogram(
+    'matching_time_to_match_seconds',
+    'Time from receiving a ride request to publishing its first offer',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+)
+TIME_TO_ACCEPT = Histogram(
+    'matching_time_to_accept_seconds',
+    'Time from receiving a ride request to a driver accepting it',
+    buckets=(1, 2, 5, 10, 15, 30, 60, 120, 300, 600)
+)
+OFFERS_SENT = Counter(
+    'matching_offers_total',
+    'Ride offers sent to drivers'
+)
+OFFER_TIMEOUTS = Counter(
+    'matching_offer_timeouts_total',
+    'Ride offers that expired without an answer'
+)
+OFFER_DECLINES = Counter(
+    'matching_offer_declines_total',
+    'Ride offers declined by drivers'
+)
+
 
 class MatchingService:
     """Service to match riders with drivers"""
     
-    def __init__(self):
-        self.producer = KafkaProducerWrapper()
+    def __init__(self, batch_window_ms=BATCH_WINDOW_MS, reservations=None, producer=None, road_network=None):
+        self.producer = producer or KafkaProducerWrapper()
+        self.supply = DriverSupply()
+        # Optional road graph; without one candidates are ranked by straight-line distance
+        self.road_network = road_network or RoadNetwork.load()
+        self.reservations = reservations or LocalReservations()
+        self.batch_window_ms = batch_window_ms
+        self.pending_requests = []
+        self.batch_lock = threading.Lock()
+        self.batching = False
+        self.retry_queue = UnmatchedRideQueue()
+        self.retrying = False
+        self.offers = OfferTracker()
+        self.supply.listeners.append(self.on_driver_available)
+        RETRY_QUEUE_DEPTH.set_function(lambda: len(self.retry_queue))
         logger.info("Matching Service initialized")
     
     @staticmethod
     def calculate_distance(lat1, lon1, lat2, lon2):
         """Calculate distance between two points using Haversine formula"""
-        R = 6371  # Earth's radius in kilometers
-        
-        lat1_rad = math.radians(lat1)
-        lat2_rad = math.radians(lat2)
-        delta_lat = math.radians(lat2 - lat1)
-        delta_lon = math.radians(lon2 - lon1)
-        
-        a = math.sin(delta_lat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon / 2) ** 2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        return haversine_km(lat1, lon1, lat2, lon2)
+    
+    @staticmethod
+    def driver_match(candidate):
+        """Shape a supply index entry as a driver match"""
+        match = {
+            'driver_id': candidate['driver_id'],
+            'driver_name': candidate['driver_name'],
+            'distance': round(candidate['distance'], 2),
+            'vehicle_type': candidate['vehicle_type'],
+            'rating': candidate['rating']
+        }
+        eta_seconds = candidate.get('eta_seconds')
+        if eta_seconds is not None and math.isfinite(eta_seconds):
+            match['eta_seconds'] = round(eta_seconds)
+        return match
+    
+    def nearest_candidates(self, pickup_lat, pickup_lon, vehicle_type, k, max_radius_km=None, exclude=None):
+        """
+        Up to k candidates closest to a pickup. With a road network the
+        straight-line shortlist is widened to ETA_CANDIDATES and re-ranked
+        by travel time.
+        """
+        if self.road_network is None:
+            return self.supply.nearest(pickup_lat, pickup_lon, vehicle_type, k=k, max_radius_km=max_radius_km, exclude=exclude)
         
-        distance = R * c
-        return distance
+        candidates = self.supply.nearest(
+            pickup_lat, pickup_lon, vehicle_type,
+            k=max(k, ETA_CANDIDATES), max_radius_km=max_radius_km, exclude=exclude
+        )
+        return self.road_network.rank(pickup_lat, pickup_lon, candidates)[:k]
     
     def find_nearest_driver(self, pickup_lat, pickup_lon, vehicle_type):
         """Find the nearest available driver"""
-        db = SessionLocal()
-        
         try:
-            # Get all online drivers with matching vehicle type
-            drivers = db.query(Driver).filter(
-                Driver.is_online == True,
-                Driver.vehicle_type == vehicle_type,
-                Driver.current_lat.isnot(None),
-                Driver.current_lon.isnot(None)
-            ).all()
+            if not self.supply.loaded:
+                self.supply.load_from_database()
             
-            if not drivers:
+            # Bounded like a ride's widest retry, so an empty area does not scan the whole grid
+            candidates = self.nearest_candidates(
+                pickup_lat, pickup_lon, vehicle_type, k=1, max_radius_km=MAX_SEARCH_RADIUS_KM
+            )
+            if not candidates:
                 logger.warning(f"No available drivers found for vehicle type: {vehicle_type}")
                 return None
             
-            # Find nearest driver
-            nearest_driver = None
-            min_distance = float('inf')
-            
-            for driver in drivers:
-                distance = self.calculate_distance(
-                    pickup_lat, pickup_lon,
-                    driver.current_lat, driver.current_lon
-                )
-                
-                if distance < min_distance:
-                    min_distance = distance
-                    nearest_driver = driver
-            
-            if nearest_driver:
-                logger.info(f"Found nearest driver {nearest_driver.id} at {min_distance:.2f} km away")
-                return {
-                    'driver_id': nearest_driver.id,
-                    'driver_name': nearest_driver.name,
-                    'distance': round(min_distance, 2),
-                    'vehicle_type': nearest_driver.vehicle_type,
-                    'rating': nearest_driver.rating
-                }
-            
-            return None
+            nearest_driver = candidates[0]
+            logger.info(f"Found nearest driver {nearest_driver['driver_id']} at {nearest_driver['distance']:.2f} km away")
+            return self.driver_match(nearest_driver)
             
         except Exception as e:
             logger.error(f"Error finding nearest driver: {e}")
             return None
-        finally:
-            db.close()
     
     def calculate_fare(self, pickup_lat, pickup_lon, dest_lat, dest_lon, vehicle_type):
         """Calculate ride fare based on distance and vehicle type"""
         distance = self.calculate_distance(pickup_lat, pickup_lon, dest_lat, dest_lon)
+        return tariffs.fare(distance, vehicle_type), round(distance, 2)
+    
+    def build_match(self, message, driver_match):
+        """Price a matched ride and build its ride-matches message"""
+        fare, distance = self.calculate_fare(
+            message['pickup_lat'], message['pickup_lon'],
+            message['destination_lat'], message['destination_lon'],
+            message['vehicle_type']
+        )
         
-        # Base fare structure
-        base_fares = {
-            'bike': 2.0,
-            'sedan': 3.5,
-            'suv': 5.0
+        return {
+            'ride_id': message['ride_id'],
+            'driver_id': driver_match['driver_id'],
+            'driver_name': driver_match['driver_name'],
+            'distance_to_pickup': driver_match['distance'],
+            'estimated_fare': fare,
+            'ride_distance': distance,
+            'vehicle_type': message['vehicle_type']
         }
+    
+    def save_fares(self, matches):
+        """Store estimated fare and distance for matched rides in one transaction"""
+        db = SessionLocal()
+        try:
+            by_ride = {match['ride_id']: match for match in matches}
+            rides = db.query(Ride).filter(Ride.id.in_(list(by_ride))).all()
+            for ride in rides:
+                ride.fare = by_ride[ride.id]['estimated_fare']
+                ride.distance = by_ride[ride.id]['ride_distance']
+            db.commit()
+        except Exception as e:
+            logger.error(f"Error updating ride fare: {e}")
+            db.rollback()
+        finally:
+            db.close()
+    
+    def match_ride(self, ride):
+        """Rank the best candidates within the ride's search radius once and offer it to the first free one"""
+        if not self.supply.loaded:
+            self.supply.load_from_database()
         
-        per_km_rates = {
-            'bike': 0.5,
-            'sedan': 1.0,
-            'suv': 1.5
-        }
+        message = ride.message
+        candidates = self.nearest_candidates(
+            message['pickup_lat'], message['pickup_lon'], message['vehicle_type'],
+            k=DISPATCH_CANDIDATES, max_radius_km=ride.radius_km, exclude=ride.excluded
+        )
         
-        base_fare = base_fares.get(vehicle_type, 3.5)
-        per_km = per_km_rates.get(vehicle_type, 1.0)
+        if self.offer_next(Offer(ride, candidates)):
+            return True
         
-        total_fare = base_fare + (distance * per_km)
-        return round(total_fare, 2), round(distance, 2)
+        logger.warning(f"No driver found for ride {ride.ride_id} within {ride.radius_km:.1f} km")
+        return False
+    
+    def make_offer(self, offer, candidate):
+        """Track an offer to a reserved candidate and build its ride-matches message"""
+        match_message = self.build_match(offer.message, self.driver_match(candidate))
+        self.offers.track(offer, candidate)
+        match_message['offer_expires_at'] = offer.expires_at
+        OFFERS_SENT.inc()
+        return match_message
+    
+    def offer_next(self, offer):
+        """Offer the ride to its next free candidate; returns False once none is left"""
+        while offer.candidates:
+            candidate = offer.candidates.popleft()
+            if candidate['driver_id'] in offer.ride.excluded:
+                continue
+            if not self.reservations.reserve(candidate['driver_id'], offer.ride_id, ttl_seconds=OFFER_TIMEOUT_SECONDS):
+                continue
+            
+            first_offer = offer.offers_made == 0
+            match_message = self.make_offer(offer, candidate)
+            if first_offer:
+                self.save_fares([match_message])
+            
+            # Publish match to Kafka
+            self.producer.send_message(
+                TOPICS['RIDE_MATCHES'],
+                match_message,
+                key=str(offer.ride_id)
+            )
+            
+            if first_offer:
+                TIME_TO_MATCH.observe(time.time() - offer.first_seen)
+            logger.info(f"Ride {offer.ride_id} offered to driver {candidate['driver_id']} (offer {offer.offers_made})")
+            return True
+        return False
+    
+    def advance(self, offer):
+        """Move an unanswered offer on to the next candidate, or back to the retry queue"""
+        if not self.offer_next(offer):
+            self.defer(offer.ride)
+    
+    def run_offer_timeouts(self):
+        """
+        Announce offers that were not answered in time. The expiry takes effect
+        when it comes back on ride-updates, so matching and the ride service
+        both see it in the same order as the driver's answer and agree on
+        which one came first.
+        """
+        while self.retrying:
+            for offer in self.offers.take_expired(timeout=1.0):
+                try:
+                    sent = self.producer.send_message(
+                        TOPICS['RIDE_UPDATES'],
+                        {
+                            'ride_id': offer.ride_id,
+                            'driver_id': offer.driver_id,
+                            'status': 'expired',
+                            'timestamp': time.time()
+                        },
+                        key=str(offer.ride_id)
+                    )
+                    if not sent:
+                        # Nobody else will hear of it, so expire it here
+                        self.expire(offer.ride_id, offer.driver_id)
+                except Exception as e:
+                    logger.error(f"Error handling expired offer for ride {offer.ride_id}: {e}")
+    
+    def expire(self, ride_id, driver_id):
+        """Withdraw an unanswered offer, unless the driver accepted first, and move the ride on"""
+        offer = self.offers.resolve(ride_id, driver_id)
+        if offer is None:
+            return
+        OFFER_TIMEOUTS.inc()
+        offer.ride.excluded.add(driver_id)
+        self.reservations.withdraw(driver_id, ride_id)
+        logger.info(f"Offer of ride {ride_id} to driver {driver_id} expired")
+        self.advance(offer)
     
     def handle_ride_request(self, message):
         """Handle incoming ride request"""
+        if self.batch_window_ms > 0:
+            with self.batch_lock:
+                self.pending_requests.append((time.time(), message))
+            return
+        
         try:
-            ride_id = message['ride_id']
-            pickup_lat = message['pickup_lat']
-            pickup_lon = message['pickup_lon']
-            destination_lat = message['destination_lat']
-            destination_lon = message['destination_lon']
-            vehicle_type = message['vehicle_type']
-            
-            logger.info(f"Processing ride request {ride_id}")
+            ride = PendingRide(message, time.time())
+            logger.info(f"Processing ride request {message['ride_id']}")
             
-            # Find nearest driver
-            driver_match = self.find_nearest_driver(pickup_lat, pickup_lon, vehicle_type)
-            
-            if driver_match:
-                # Calculate fare
-                fare, distance = self.calculate_fare(
-                    pickup_lat, pickup_lon,
-                    destination_lat, destination_lon,
-                    vehicle_type
-                )
+            if not self.match_ride(ride):
+                self.defer(ride)
                 
-                # Update ride in database
-                db = SessionLocal()
+        except Exception as e:
+            logger.error(f"Error handling ride request: {e}")
+    
+    def defer(self, ride):
+        """Queue an unmatched ride for a later attempt with a wider radius"""
+        if self.retry_queue.requeue(ride):
+            logger.info(f"Ride {ride.ride_id} queued for another matching attempt (attempt {ride.attempts})")
+        else:
+            self.give_up(ride.message)
+    
+    def give_up(self, message):
+        """Cancel a ride that ran out of matching attempts"""
+        RETRY_GIVEN_UP.inc()
+        self.producer.send_message(
+            TOPICS['RIDE_UPDATES'],
+            {
+                'ride_id': message['ride_id'],
+                'status': 'cancelled',
+                'reason': 'no_drivers_available',
+                'timestamp': time.time()
+            },
+            key=str(message['ride_id'])
+        )
+        logger.warning(f"Ride {message['ride_id']} cancelled: no drivers available")
+    
+    def on_driver_available(self, driver_id, vehicle_type, lat, lon):
+        """Retry waiting rides straight away when a suitable driver shows up nearby"""
+        woken = self.retry_queue.wake(vehicle_type, lat, lon)
+        if woken:
+            logger.info(f"Driver {driver_id} woke {woken} waiting ride requests")
+    
+    def run_retries(self):
+        """Re-attempt unmatched rides as they fall due"""
+        while self.retrying:
+            for ride in self.retry_queue.take_due(timeout=1.0):
+                RETRY_ATTEMPTS.inc()
                 try:
-                    ride = db.query(Ride).filter(Ride.id == ride_id).first()
-                    if ride:
-                        ride.fare = fare
-                        ride.distance = distance
-                        db.commit()
+                    if not self.match_ride(ride):
+                        self.defer(ride)
                 except Exception as e:
-                    logger.error(f"Error updating ride fare: {e}")
-                    db.rollback()
-                finally:
-                    db.close()
-                
-                # Publish match to Kafka
-                match_message = {
-                    'ride_id': ride_id,
-                    'driver_id': driver_match['driver_id'],
-                    'driver_name': driver_match['driver_name'],
-                    'distance_to_pickup': driver_match['distance'],
-                    'estimated_fare': fare,
-                    'ride_distance': distance,
-                    'vehicle_type': vehicle_type
-                }
-                
-                self.producer.send_message(
-                    TOPICS['RIDE_MATCHES'],
-                    match_message,
-                    key=str(ride_id)
+                    logger.error(f"Error retrying ride {ride.ride_id}: {e}")
+    
+    def run_supply_expiry(self):
+        """Drop drivers whose position has gone stale from the supply index"""
+        while self.retrying:
+            time.sleep(TTL_TICK_SECONDS)
+            try:
+                stale_ids = self.supply.expire()
+                if stale_ids:
+                    logger.info(f"Removed {len(stale_ids)} drivers with stale locations from supply")
+            except Exception as e:
+                logger.error(f"Error expiring driver supply: {e}")
+    
+    def match_batch(self, batch):
+        """Solve one assignment problem per vehicle type and region for a batch of requests"""
+        started = time.time()
+        BATCH_SIZE.observe(len(batch))
+        
+        groups = {}
+        first_seen = {}
+        for enqueued_at, message in batch:
+            BATCH_WAIT.observe(started - enqueued_at)
+            try:
+                first_seen[message['ride_id']] = enqueued_at
+                ride = PendingRide(message, enqueued_at)
+                region = (
+                    message['vehicle_type'],
+                    math.floor(message['pickup_lat'] / BATCH_REGION_DEG),
+                    math.floor(message['pickup_lon'] / BATCH_REGION_DEG)
                 )
-                
-                logger.info(f"Ride {ride_id} matched with driver {driver_match['driver_id']}")
-            else:
-                logger.warning(f"No driver found for ride {ride_id}")
-                
+                groups.setdefault(region, []).append(ride)
+            except Exception as e:
+                logger.error(f"Error handling ride request: {e}")
+        
+        if not self.supply.loaded:
+            self.supply.load_from_database()
+        
+        # Drivers assigned in an earlier region stay out of later ones
+        taken = set()
+        matches = []
+        for (vehicle_type, _, _), rides in groups.items():
+            nearby = [
+                self.supply.nearest(
+                    ride.message['pickup_lat'], ride.message['pickup_lon'], vehicle_type,
+                    k=BATCH_CANDIDATES, exclude=taken | ride.excluded, max_radius_km=ride.radius_km
+                )
+                for ride in rides
+            ]
+            costs = [
+                {candidate['driver_id']: candidate['distance'] for candidate in candidates}
+                for candidates in nearby
+            ]
+            
+            assignment = min_cost_assignment(costs, UNMATCHED_COST_KM)
+            
+            for ride, candidates, driver_id in zip(rides, nearby, assignment):
+                if driver_id is None:
+                    BATCH_UNMATCHED.inc()
+                    self.defer(ride)
+                    continue
+                try:
+                    # The assigned driver goes first; the rest stay as fallbacks
+                    ranked = sorted(candidates, key=lambda candidate: candidate['driver_id'] != driver_id)
+                    offer = Offer(ride, ranked)
+                    if self.reservations.reserve(driver_id, ride.ride_id, ttl_seconds=OFFER_TIMEOUT_SECONDS):
+                        taken.add(driver_id)
+                        matches.append(self.make_offer(offer, offer.candidates.popleft()))
+                        continue
+                    
+                    # Another worker got there first; offer to the next free candidate
+                    taken.add(driver_id)
+                    offer.candidates.popleft()
+                    offer.candidates = deque(c for c in offer.candidates if c['driver_id'] not in taken)
+                    if self.offer_next(offer):
+                        taken.add(offer.driver_id)
+                    else:
+                        BATCH_UNMATCHED.inc()
+                        self.defer(ride)
+                except Exception as e:
+                    logger.error(f"Error handling ride request: {e}")
+        
+        if matches:
+            self.save_fares(matches)
+            self.producer.send_messages(
+                TOPICS['RIDE_MATCHES'],
+                [(match, str(match['ride_id'])) for match in matches]
+            )
+            published = time.time()
+            for match in matches:
+                TIME_TO_MATCH.observe(published - first_seen[match['ride_id']])
+        
+        BATCH_LATENCY.observe(time.time() - started)
+        logger.info(f"Batch of {len(batch)} ride requests matched {len(matches)} in {time.time() - started:.3f}s")
+    
+    def run_batches(self):
+        """Collect ride requests for one window at a time and match them together"""
+        self.batching = True
+        while self.batching:
+            time.sleep(self.batch_window_ms / 1000)
+            with self.batch_lock:
+                batch, self.pending_requests = self.pending_requests, []
+            if batch:
+                try:
+                    self.match_batch(batch)
+                except Exception as e:
+                    logger.error(f"Error matching batch: {e}")
+    
+    def handle_ride_update(self, message):
+        """Keep driver reservations and the retry queue in step with ride status changes"""
+        try:
+            ride_id = message['ride_id']
+            driver_id = message.get('driver_id')
+            status = message['status']
+            
+            if status == 'cancelled':
+                self.retry_queue.remove(ride_id)
+                offer = self.offers.get(ride_id)
+                if offer:
+                    self.offers.resolve(ride_id, offer.driver_id)
+                    self.reservations.release(offer.driver_id, ride_id)
+            if driver_id is None:
+                return
+            
+            if status == 'accepted':
+                # Only the worker that made the offer holds it, and not once it expired
+                offer = self.offers.resolve(ride_id, driver_id)
+                if offer is None:
+                    logger.info(f"Ignoring acceptance of ride {ride_id} by driver {driver_id}: no open offer")
+                    return
+                self.reservations.confirm(driver_id, ride_id)
+                TIME_TO_ACCEPT.observe(time.time() - offer.first_seen)
+            elif status == 'declined':
+                offer = self.offers.resolve(ride_id, driver_id)
+                if offer:
+                    OFFER_DECLINES.inc()
+                    offer.ride.excluded.add(driver_id)
+                    self.reservations.withdraw(driver_id, ride_id)
+                    self.advance(offer)
+            elif status == 'expired':
+                self.expire(ride_id, driver_id)
+            elif status in ('completed', 'cancelled'):
+                self.reservations.release(driver_id, ride_id)
+                # The freed driver may be able to serve a waiting ride
+                driver = self.supply.index.get(driver_id)
+                if driver:
+                    self.on_driver_available(driver_id, driver['vehicle_type'], driver['lat'], driver['lon'])
+        
         except Exception as e:
-            logger.error(f"Error handling ride request: {e}")
+            logger.error(f"Error handling ride update: {e}")
     
-    def start(self):
+    def start(self, metrics_port=METRICS_PORT, worker_index=0):
         """Start consuming ride requests"""
         # Start Prometheus metrics server
         from prometheus_client import start_http_server
-        start_http_server(8004)
-        logger.info("Prometheus metrics server started on port 8004")
+        start_http_server(metrics_port)
+        logger.info(f"Prometheus metrics server started on port {metrics_port}")
 
+        # Every instance needs the full supply stream, so each gets its own group
+        self.supply.load_from_database()
+        supply_group = f"matching-service-supply-{INSTANCE_ID}-{worker_index}"
+        
+        location_consumer = KafkaConsumerWrapper(
+            TOPICS['DRIVER_LOCATIONS'],
+            supply_group,
+            self.supply.handle_location_update
+        )
+        
+        availability_consumer = KafkaConsumerWrapper(
+            TOPICS['DRIVER_AVAILABILITY'],
+            supply_group,
+            self.supply.handle_availability_update
+        )
+        
+        # Answers go to whichever worker made the offer, so every worker reads
+        # all ride updates and ignores offers it does not hold
+        update_consumer = KafkaConsumerWrapper(
+            TOPICS['RIDE_UPDATES'],
+            supply_group,
+            self.handle_ride_update
+        )
+        
+        threading.Thread(target=location_consumer.start_consuming, daemon=True).start()
+        threading.Thread(target=availability_consumer.start_consuming, daemon=True).start()
+        threading.Thread(target=update_consumer.start_consuming, daemon=True).start()
+        
+        self.retrying = True
+        threading.Thread(target=self.run_retries, daemon=True).start()
+        threading.Thread(target=self.run_offer_timeouts, daemon=True).start()
+        threading.Thread(target=self.run_supply_expiry, daemon=True).start()
+        
+        if self.batch_window_ms > 0:
+            threading.Thread(target=self.run_batches, daemon=True).start()
+            logger.info(f"Batch matching enabled with a {self.batch_window_ms} ms window")
+        
         consumer = KafkaConsumerWrapper(
             TOPICS['RIDE_REQUESTS'],
             'matching-service-group',
@@ -194,9 +572,51 @@ class MatchingService:
         except KeyboardInterrupt:
             logger.info("Shutting down Matching Service...")
             consumer.stop_consuming()
+            self.batching = False
+            self.retrying = False
+            location_consumer.stop_consuming()
+            availability_consumer.stop_consuming()
+            update_consumer.stop_consuming()
             self.producer.close()
 
 
+def run_worker(worker_index):
+    """Entry point of one matching worker process"""
+    service = MatchingService(reservations=DatabaseReservations())
+    # Worker 0 keeps the usual port (probes, scrape config); the rest get their own
+    service.start(
+        metrics_port=METRICS_PORT if worker_index == 0 else WORKER_METRICS_PORT + worker_index,
+        worker_index=worker_index
+    )
+
+
+def start_workers(count):
+    """
+    Run several matching workers in one consumer group. Kafka spreads the
+    ride-requests partitions across them, so more workers than partitions
+    leaves the extras idle until a rebalance.
+    """
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(index,), name=f"matching-worker-{index}")
+        for index in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    
+    logger.info(f"Started {count} matching workers")
+    
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        logger.info("Shutting down matching workers...")
+        for worker in workers:
+            worker.terminate()
+
+
 if __name__ == '__main__':
-    service = MatchingService()
-    service.start()
+    if WORKERS > 1:
+        start_workers(WORKERS)
+    else:
+        service = MatchingService()
+        service.start()
@@ -0,0 +1,170 @@
+"""
+Driver Reservations - Atomic, expiring holds on drivers while a ride is offered
+A driver can be held for one ride at a time; unaccepted holds lapse after a TTL
+"""
+import sys
+import os
+import threading
+import logging
+import time
+from datetime import datetime, timedelta
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert
+from models.database import SessionLocal, DriverReservation
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RESERVATION_TTL_SECONDS = float(os.getenv('MATCHING_RESERVATION_TTL_SECONDS', '30'))
+
+
+class LocalReservations:
+    """In-process reservations for a single matching worker"""
+    
+    def __init__(self, ttl_seconds=RESERVATION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        # driver_id -> (ride_id, expires_at or None once accepted)
+        self.holds = {}
+        self.lock = threading.Lock()
+    
+    def reserve(self, driver_id, ride_id, ttl_seconds=None):
+        """Hold a driver for a ride unless someone else holds them"""
+        now = time.time()
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self.lock:
+            hold = self.holds.get(driver_id)
+            if hold and hold[0] != ride_id and (hold[1] is None or hold[1] > now):
+                return False
+            self.holds[driver_id] = (ride_id, now + ttl)
+            return True
+    
+    def confirm(self, driver_id, ride_id):
+        """Keep the hold without expiry once the driver accepts"""
+        with self.lock:
+            hold = self.holds.get(driver_id)
+            if hold and hold[0] == ride_id:
+                self.holds[driver_id] = (ride_id, None)
+                return True
+            return False
+    
+    def withdraw(self, driver_id, ride_id):
+        """Drop a hold that has not been accepted; a confirmed hold is kept"""
+        with self.lock:
+            hold = self.holds.get(driver_id)
+            if hold and hold[0] == ride_id and hold[1] is not None:
+                del self.holds[driver_id]
+                return True
+            return False
+    
+    def release(self, driver_id, ride_id):
+        """Drop the hold a ride has on a driver"""
+        with self.lock:
+            hold = self.holds.get(driver_id)
+            if hold and hold[0] == ride_id:
+                del self.holds[driver_id]
+                return True
+            return False
+
+
+class DatabaseReservations:
+    """Reservations shared by every matching worker through the driver_reservations table"""
+    
+    def __init__(self, ttl_seconds=RESERVATION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+    
+    def reserve(self, driver_id, ride_id, ttl_seconds=None):
+        """Hold a driver for a ride unless someone else holds them"""
+        now = datetime.utcnow()
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        db = SessionLocal()
+        
+        try:
+            # A single INSERT ... ON CONFLICT DO UPDATE WHERE is atomic, so two
+            # workers can never both take the same driver
+            statement = insert(DriverReservation).values(
+                driver_id=driver_id,
+                ride_id=ride_id,
+                expires_at=now + timedelta(seconds=ttl),
+                reserved_at=now
+            )
+            statement = statement.on_conflict_do_update(
+                index_elements=[DriverReservation.driver_id],
+                set_={
+                    'ride_id': statement.excluded.ride_id,
+                    'expires_at': statement.excluded.expires_at,
+                    'reserved_at': statement.excluded.reserved_at
+                },
+                where=or_(
+                    DriverReservation.ride_id == ride_id,
+                    DriverReservation.expires_at < now
+                )
+            ).returning(DriverReservation.ride_id)
+            
+            reserved = db.execute(statement).first() is not None
+            db.commit()
+            return reserved
+        except Exception as e:
+            logger.error(f"Error reserving driver {driver_id}: {e}")
+            db.rollback()
+            return False
+        finally:
+            db.close()
+    
+    def confirm(self, driver_id, ride_id):
+        """Keep the hold without expiry once the driver accepts"""
+        db = SessionLocal()
+        
+        try:
+            updated = db.query(DriverReservation).filter(
+                DriverReservation.driver_id == driver_id,
+                DriverReservation.ride_id == ride_id
+            ).update({'expires_at': None})
+            db.commit()
+            return updated > 0
+        except Exception as e:
+            logger.error(f"Error confirming reservation of driver {driver_id}: {e}")
+            db.rollback()
+            return False
+        finally:
+            db.close()
+    
+    def withdraw(self, driver_id, ride_id):
+        """Drop a hold that has not been accepted; a confirmed hold is kept"""
+        db = SessionLocal()
+        
+        try:
+            deleted = db.query(DriverReservation).filter(
+                DriverReservation.driver_id == driver_id,
+                DriverReservation.ride_id == ride_id,
+                DriverReservation.expires_at.isnot(None)
+            ).delete()
+            db.commit()
+            return deleted > 0
+        except Exception as e:
+            logger.error(f"Error withdrawing reservation of driver {driver_id}: {e}")
+            db.rollback()
+            return False
+        finally:
+            db.close()
+    
+    def release(self, driver_id, ride_id):
+        """Drop the hold a ride has on a driver"""
+        db = SessionLocal()
+        
+        try:
+            deleted = db.query(DriverReservation).filter(
+                DriverReservation.driver_id == driver_id,
+                DriverReservation.ride_id == ride_id
+            ).delete()
+            db.commit()
+            return deleted > 0
+        except Exception as e:
+            logger.error(f"Error releasing reservation of driver {driver_id}: {e}")
+            db.rollback()
+            return False
+        finally:
+            db.close()
@@ -0,0 +1,147 @@
+"""
+Retry Queue - Deferred re-matching of ride requests that found no driver
+A heap orders rides by their next attempt; each retry backs off and widens the search radius
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from services.geo import haversine_km
+
+SEARCH_RADIUS_KM = float(os.getenv('MATCHING_SEARCH_RADIUS_KM', '5'))
+MAX_SEARCH_RADIUS_KM = float(os.getenv('MATCHING_MAX_SEARCH_RADIUS_KM', '25'))
+RADIUS_GROWTH = float(os.getenv('MATCHING_RADIUS_GROWTH', '1.5'))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv('MATCHING_RETRY_BASE_DELAY_SECONDS', '2'))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv('MATCHING_RETRY_MAX_DELAY_SECONDS', '30'))
+RETRY_MAX_ATTEMPTS = int(os.getenv('MATCHING_RETRY_MAX_ATTEMPTS', '10'))
+
+
+def search_radius(attempt):
+    """Search radius in km for the given attempt, starting at 0"""
+    return min(SEARCH_RADIUS_KM * RADIUS_GROWTH ** attempt, MAX_SEARCH_RADIUS_KM)
+
+
+def retry_delay(attempt):
+    """Seconds to wait before the given retry attempt, starting at 1"""
+    return min(RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1), RETRY_MAX_DELAY_SECONDS)
+
+
+class PendingRide:
+    """A ride request being matched, kept across offers and retries"""
+    
+    __slots__ = ('message', 'first_seen', 'attempts', 'due', 'excluded')
+    
+    def __init__(self, message, first_seen):
+        self.message = message
+        self.first_seen = first_seen
+        self.attempts = 0
+        self.due = first_seen
+        # Drivers who declined or let an offer of this ride expire
+        self.excluded = set()
+    
+    @property
+    def ride_id(self):
+        return self.message['ride_id']
+    
+    @property
+    def radius_km(self):
+        return search_radius(self.attempts)
+
+
+class UnmatchedRideQueue:
+    """Heap of unmatched rides keyed by next attempt time, waking early when drivers appear"""
+    
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self.heap = []
+        self.counter = itertools.count()
+        # ride_id -> PendingRide
+        self.pending = {}
+        # vehicle_type -> set of ride_ids
+        self.by_vehicle = {}
+        self.condition = threading.Condition()
+    
+    def __len__(self):
+        return len(self.pending)
+    
+    def _push(self, ride):
+        heapq.heappush(self.heap, (ride.due, next(self.counter), ride.ride_id))
+    
+    def requeue(self, ride):
+        """Schedule the next attempt; returns False once the ride has run out of attempts"""
+        with self.condition:
+            ride.attempts += 1
+            if ride.attempts > self.max_attempts:
+                self._forget(ride)
+                return False
+            
+            ride.due = time.time() + retry_delay(ride.attempts)
+            self.pending[ride.ride_id] = ride
+            self.by_vehicle.setdefault(ride.message['vehicle_type'], set()).add(ride.ride_id)
+            self._push(ride)
+            self.condition.notify()
+            return True
+    
+    def _forget(self, ride):
+        self.pending.pop(ride.ride_id, None)
+        waiting = self.by_vehicle.get(ride.message['vehicle_type'])
+        if waiting:
+            waiting.discard(ride.ride_id)
+            if not waiting:
+                del self.by_vehicle[ride.message['vehicle_type']]
+    
+    def remove(self, ride_id):
+        """Stop retrying a ride; its heap entry is skipped when it surfaces"""
+        with self.condition:
+            ride = self.pending.get(ride_id)
+            if ride:
+                self._forget(ride)
+            return ride
+    
+    def wake(self, vehicle_type, lat, lon):
+        """Make rides that a newly available driver could serve due immediately"""
+        now = time.time()
+        woken = 0
+        with self.condition:
+            for ride_id in self.by_vehicle.get(vehicle_type, ()):
+                ride = self.pending[ride_id]
+                if ride.due <= now:
+                    continue
+                distance = haversine_km(lat, lon, ride.message['pickup_lat'], ride.message['pickup_lon'])
+                if distance <= ride.radius_km:
+                    ride.due = now
+                    self._push(ride)
+                    woken += 1
+            if woken:
+                self.condition.notify()
+        return woken
+    
+    def take_due(self, timeout=None):
+        """
+        Wait until at least one ride is due (or timeout passes) and return
+        the due rides, removing them from the queue.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while True:
+                now = time.time()
+                due = []
+                while self.heap and self.heap[0][0] <= now:
+                    entry_due, _, ride_id = heapq.heappop(self.heap)
+                    ride = self.pending.get(ride_id)
+                    # Entries superseded by a wake-up or removal are stale
+                    if ride is None or ride.due != entry_due:
+                        continue
+                    self._forget(ride)
+                    due.append(ride)
+                if due:
+                    return due
+                if deadline is not None and now >= deadline:
+                    return []
+                
+                wait = self.heap[0][0] - now if self.heap else None
+                if deadline is not None:
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self.condition.wait(wait)
@@ -11,7 +11,8 @@ from datetime import datetime
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config.kafka_config import KafkaProducerWrapper, KafkaConsumerWrapper, TOPICS
+from config.kafka_config import KafkaProducerWrapper, KafkaConsumerWrapper, TOPICS, CONSUMER_BATCH_SIZE, CONSUMER_WORKERS
+from config.partitioning import ride_request_key
 from models.database import SessionLocal, Ride, Rider
 
 logging.basicConfig(level=logging.INFO)
@@ -64,7 +65,7 @@ class RideService:
             self.producer.send_message(
                 TOPICS['RIDE_REQUESTS'],
                 message,
-                key=str(ride.id)
+                key=ride_request_key(ride.id, ride.pickup_lat, ride.pickup_lon)
             )
             
             logger.info(f"Ride request created: {ride.id}")
@@ -77,22 +78,61 @@ class RideService:
         finally:
             db.close()
     
+    def apply_ride_match(self, db, message):
+        """Record a match on the ride; the caller commits"""
+        ride_id = message['ride_id']
+        driver_id = message['driver_id']
+        
+        ride = db.query(Ride).filter(Ride.id == ride_id).first()
+        if ride:
+            ride.driver_id = driver_id
+            ride.status = 'matched'
+            ride.matched_at = datetime.utcnow()
+            logger.info(f"Ride {ride_id} matched with driver {driver_id}")
+    
+    def apply_ride_update(self, db, message):
+        """Apply a status change to the ride; the caller commits"""
+        ride_id = message['ride_id']
+        status = message['status']
+        
+        ride = db.query(Ride).filter(Ride.id == ride_id).first()
+        if ride:
+            # Answers to an offer only count while it is open and from the driver
+            # holding it; the first of accepted/declined/expired wins
+            driver_id = message.get('driver_id')
+            if status in ('accepted', 'declined', 'expired') and (
+                    ride.status != 'matched' or (driver_id is not None and ride.driver_id != driver_id)):
+                logger.info(f"Ignoring {status} for ride {ride_id} from driver {driver_id} (ride is {ride.status})")
+                return
+            
+            if status in ('declined', 'expired'):
+                # Back to waiting while matching offers the ride to the next driver
+                ride.status = 'requested'
+                ride.driver_id = None
+                ride.matched_at = None
+                logger.info(f"Ride {ride_id} offer {status} by driver {driver_id}")
+                return
+            
+            ride.status = status
+            
+            if status == 'accepted':
+                ride.accepted_at = datetime.utcnow()
+            elif status == 'started':
+                ride.started_at = datetime.utcnow()
+            elif status == 'completed':
+                ride.completed_at = datetime.utcnow()
+                if 'fare' in message:
+                    ride.fare = message['fare']
+            
+            logger.info(f"Ride {ride_id} status updated to {status}")
+    
     def handle_ride_match(self, message):
         """Handle ride match from matching service"""
         db = SessionLocal()
         
         try:
-            ride_id = message['ride_id']
-            driver_id = message['driver_id']
-            
-            ride = db.query(Ride).filter(Ride.id == ride_id).first()
-            if ride:
-                ride.driver_id = driver_id
-                ride.status = 'matched'
-                ride.matched_at = datetime.utcnow()
-                db.commit()
-                
-                logger.info(f"Ride {ride_id} matched with driver {driver_id}")
+            self.apply_ride_match(db, message)
+            db.commit()
         except Exception as e:
             logger.error(f"Error handling ride match: {e}")
             db.rollback()
@@ -104,30 +144,44 @@ class RideService:
         db = SessionLocal()
         
         try:
-            ride_id = message['ride_id']
-            status = message['status']
-            
-            ride = db.query(Ride).filter(Ride.id == ride_id).first()
-            if ride:
-                ride.status = status
-                
-                if status == 'accepted':
-                    ride.accepted_at = datetime.utcnow()
-                elif status == 'started':
-                    ride.started_at = datetime.utcnow()
-                elif status == 'completed':
-                    ride.completed_at = datetime.utcnow()
-                    if 'fare' in message:
-                        ride.fare = message['fare']
-                
-                db.commit()
-                logger.info(f"Ride {ride_id} status updated to {status}")
+            self.apply_ride_update(db, message)
+            db.commit()
         except Exception as e:
             logger.error(f"Error handling ride update: {e}")
             db.rollback()
         finally:
             db.close()
     
+    def apply_batch(self, messages, apply, kind):
+        """
+        Apply a batch of messages in one transaction. Each message gets a
+        savepoint, so a bad one is skipped without losing the rest; a failed
+        commit raises and the consumer delivers the batch again.
+        """
+        db = SessionLocal()
+        
+        try:
+            for message in messages:
+                try:
+                    with db.begin_nested():
+                        apply(db, message)
+                except Exception as e:
+                    logger.error(f"Error handling {kind}: {e}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    
+    def handle_ride_matches(self, messages):
+        """Handle a batch of ride matches"""
+        self.apply_batch(messages, self.apply_ride_match, 'ride match')
+    
+    def handle_ride_updates(self, messages):
+        """Handle a batch of ride status updates"""
+        self.apply_batch(messages, self.apply_ride_update, 'ride update')
+    
     def start(self):
         """Start consuming from Kafka topics"""
         # Start Prometheus metrics server
@@ -135,19 +189,36 @@ class RideService:
         start_http_server(8002)
         logger.info("Prometheus metrics server started on port 8002")
 
-        # Consume ride matches
-        match_consumer = KafkaConsumerWrapper(
-            TOPICS['RIDE_MATCHES'],
-            'ride-service-group',
-            self.handle_ride_match
-        )
-        
-        # Consume ride updates
-        update_consumer = KafkaConsumerWrapper(
-            TOPICS['RIDE_UPDATES'],
-            'ride-service-group',
-            self.handle_ride_update
-        )
+        if CONSUMER_WORKERS:
+            # Messages for different rides run in parallel, each ride's in order
+            match_consumer = KafkaConsumerWrapper(
+                TOPICS['RIDE_MATCHES'],
+                'ride-service-group',
+                self.handle_ride_match,
+                workers=CONSUMER_WORKERS
+            )
+            update_consumer = KafkaConsumerWrapper(
+                TOPICS['RIDE_UPDATES'],
+                'ride-service-group',
+                self.handle_ride_update,
+                workers=CONSUMER_WORKERS
+            )
+        else:
+            # Consume ride matches, a batch per transaction
+            match_consumer = KafkaConsumerWrapper(
+                TOPICS['RIDE_MATCHES'],
+                'ride-service-group',
+                self.handle_ride_matches,
+                batch_size=CONSUMER_BATCH_SIZE
+            )
+            
+            # Consume ride updates, a batch per transaction
+            update_consumer = KafkaConsumerWrapper(
+                TOPICS['RIDE_UPDATES'],
+                'ride-service-group',
+                self.handle_ride_updates,
+                batch_size=CONSUMER_BATCH_SIZE
+            )
         
         # Start consumers in separate threads
         match_thread = threading.Thread(target=match_consumer.start_consuming)
@@ -0,0 +1,166 @@
+"""
+Spatial Index - Uniform grid of driver positions bucketed by vehicle type
+Nearest-driver lookups expand ring by ring from the pickup cell
+"""
+import math
+import threading
+
+from services.geo import haversine_km, KM_PER_DEGREE_LAT
+
+class GridIndex:
+    """Uniform lat/lon grid holding one bucket set per vehicle type"""
+    
+    def __init__(self, cell_size_deg=0.01):
+        self.cell_size_deg = cell_size_deg
+        # vehicle_type -> {(row, col) -> {driver_id -> entry}}
+        self.cells = {}
+        # driver_id -> (vehicle_type, cell)
+        self.positions = {}
+        # vehicle_type -> [min_row, max_row, min_col, max_col] of occupied cells
+        self.bounds = {}
+        self.lock = threading.RLock()
+    
+    def cell_of(self, lat, lon):
+        """Return the grid cell containing a point"""
+        return (int(math.floor(lat / self.cell_size_deg)),
+                int(math.floor(lon / self.cell_size_deg)))
+    
+    def __len__(self):
+        return len(self.positions)
+    
+    def __contains__(self, driver_id):
+        return driver_id in self.positions
+    
+    def upsert(self, driver_id, lat, lon, vehicle_type, **attrs):
+        """Insert or move a driver; extra attributes are kept on the entry"""
+        cell = self.cell_of(lat, lon)
+        with self.lock:
+            previous = self.positions.get(driver_id)
+            entry = None
+            if previous:
+                old_type, old_cell = previous
+                bucket = self.cells[old_type][old_cell]
+                entry = bucket.pop(driver_id)
+                if not bucket:
+                    self._drop_cell(old_type, old_cell)
+            
+            if entry is None:
+                entry = {'driver_id': driver_id}
+            entry.update(attrs)
+            entry['vehicle_type'] = vehicle_type
+            entry['lat'] = lat
+            entry['lon'] = lon
+            
+            self.cells.setdefault(vehicle_type, {}).setdefault(cell, {})[driver_id] = entry
+            self.positions[driver_id] = (vehicle_type, cell)
+            self._grow_bounds(vehicle_type, cell)
+    
+    def _grow_bounds(self, vehicle_type, cell):
+        """Extend the occupied bounding box of a vehicle type"""
+        row, col = cell
+        bounds = self.bounds.get(vehicle_type)
+        if bounds is None:
+            self.bounds[vehicle_type] = [row, row, col, col]
+            return
+        bounds[0] = min(bounds[0], row)
+        bounds[1] = max(bounds[1], row)
+        bounds[2] = min(bounds[2], col)
+        bounds[3] = max(bounds[3], col)
+    
+    def _drop_cell(self, vehicle_type, cell):
+        """Delete an emptied cell, shrinking the bounding box if the cell was on its edge"""
+        buckets = self.cells[vehicle_type]
+        del buckets[cell]
+        row, col = cell
+        min_row, max_row, min_col, max_col = self.bounds[vehicle_type]
+        if row not in (min_row, max_row) and col not in (min_col, max_col):
+            return
+        if not buckets:
+            del self.bounds[vehicle_type]
+            return
+        rows = [r for r, _ in buckets]
+        cols = [c for _, c in buckets]
+        self.bounds[vehicle_type] = [min(rows), max(rows), min(cols), max(cols)]
+    
+    def remove(self, driver_id):
+        """Remove a driver from the index"""
+        with self.lock:
+            previous = self.positions.pop(driver_id, None)
+            if not previous:
+                return None
+            vehicle_type, cell = previous
+            bucket = self.cells[vehicle_type][cell]
+            entry = bucket.pop(driver_id)
+            if not bucket:
+                self._drop_cell(vehicle_type, cell)
+            return entry
+    
+    def get(self, driver_id):
+        """Return the stored entry for a driver"""
+        with self.lock:
+            previous = self.positions.get(driver_id)
+            if not previous:
+                return None
+            vehicle_type, cell = previous
+            return self.cells[vehicle_type][cell][driver_id]
+    
+    def _ring(self, center, radius):
+        """Yield the cells on the square ring at a given Chebyshev radius"""
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        for c in range(col - radius, col + radius + 1):
+            yield (row - radius, c)
+            yield (row + radius, c)
+        for r in range(row - radius + 1, row + radius):
+            yield (r, col - radius)
+            yield (r, col + radius)
+    
+    def _max_ring(self, center, vehicle_type):
+        """Ring radius after which no occupied cell can remain"""
+        row, col = center
+        min_row, max_row, min_col, max_col = self.bounds[vehicle_type]
+        return max(abs(min_row - row), abs(max_row - row), abs(min_col - col), abs(max_col - col))
+    
+    def nearest(self, lat, lon, vehicle_type, k=1, max_radius_km=None, exclude=None):
+        """
+        Return up to k entries closest to a point, nearest first.
+        Each result is a copy of the entry with a 'distance' in km.
+        """
+        with self.lock:
+            buckets = self.cells.get(vehicle_type)
+            if not buckets:
+                return []
+            
+            center = self.cell_of(lat, lon)
+            # Smallest on-ground extent of one cell around this latitude
+            cell_km = self.cell_size_deg * KM_PER_DEGREE_LAT * min(
+                1.0, max(math.cos(math.radians(abs(lat) + self.cell_size_deg)), 1e-6)
+            )
+            max_ring = self._max_ring(center, vehicle_type)
+            if max_radius_km is not None:
+                max_ring = min(max_ring, int(math.ceil(max_radius_km / cell_km)) + 1)
+            
+            found = []
+            for radius in range(max_ring + 1):
+                for cell in self._ring(center, radius):
+                    bucket = buckets.get(cell)
+                    if not bucket:
+                        continue
+                    for driver_id, entry in bucket.items():
+                        if exclude and driver_id in exclude:
+                            continue
+                        distance = haversine_km(lat, lon, entry['lat'], entry['lon'])
+                        if max_radius_km is not None and distance > max_radius_km:
+                            continue
+                        found.append((distance, driver_id, entry))
+                
+                # Anything beyond this ring is at least radius * cell_km away
+                if len(found) >= k:
+                    found.sort(key=lambda item: item[0])
+                    if found[k - 1][0] <= radius * cell_km:
+                        break
+            
+            found.sort(key=lambda item: item[0])
+            return [dict(entry, distance=distance) for distance, _, entry in found[:k]]
@@ -0,0 +1,82 @@
+"""
+Timing Wheel - Deadline tracking for keys that are rescheduled far more often than they expire
+Scheduling, rescheduling and cancelling are O(1); a tick only visits the slots it passes over
+"""
+import math
+import threading
+import time
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel. Each key sits in the slot of its deadline tick;
+    deadlines more than one revolution away stay in their slot until a
+    later pass finds them due.
+    """
+    
+    def __init__(self, tick_seconds=1.0, slots=512, now=None):
+        self.tick_seconds = tick_seconds
+        # slot -> {key -> deadline}
+        self.buckets = [{} for _ in range(slots)]
+        # key -> slot
+        self.slot_of = {}
+        self.current_tick = self._tick(time.time() if now is None else now)
+        self.lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.slot_of)
+    
+    def __contains__(self, key):
+        return key in self.slot_of
+    
+    def _tick(self, timestamp):
+        return int(math.floor(timestamp / self.tick_seconds))
+    
+    def schedule(self, key, deadline):
+        """Set (or move) the deadline of a key"""
+        slot = max(self._tick(deadline), self.current_tick) % len(self.buckets)
+        with self.lock:
+            previous = self.slot_of.get(key)
+            if previous is not None and previous != slot:
+                del self.buckets[previous][key]
+            self.buckets[slot][key] = deadline
+            self.slot_of[key] = slot
+    
+    def schedule_many(self, keys, deadline):
+        """Give many keys the same deadline under one lock acquisition"""
+        slot = max(self._tick(deadline), self.current_tick) % len(self.buckets)
+        with self.lock:
+            bucket = self.buckets[slot]
+            for key in keys:
+                previous = self.slot_of.get(key)
+                if previous is not None and previous != slot:
+                    del self.buckets[previous][key]
+                bucket[key] = deadline
+                self.slot_of[key] = slot
+    
+    def cancel(self, key):
+        """Forget a key; returns False if it was not scheduled"""
+        with self.lock:
+            slot = self.slot_of.pop(key, None)
+            if slot is None:
+                return False
+            del self.buckets[slot][key]
+            return True
+    
+    def advance(self, now=None):
+        """Move the wheel up to now and return the keys whose deadline has passed"""
+        now = time.time() if now is None else now
+        target = self._tick(now)
+        expired = []
+        with self.lock:
+            # The current slot is visited again because keys may have been added to it since the last pass
+            ticks = min(target - self.current_tick + 1, len(self.buckets))
+            for tick in range(target - ticks + 1, target + 1):
+                bucket = self.buckets[tick % len(self.buckets)]
+                due = [key for key, deadline in bucket.items() if deadline <= now]
+                for key in due:
+                    del bucket[key]
+                    del self.slot_of[key]
+                expired.extend(due)
+            self.current_tick = max(self.current_tick, target)
+        return expired
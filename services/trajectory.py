@@ -0,0 +1,158 @@
+"""
+Trajectory - Recent track of every driver held in fixed-size ring buffers
+All drivers share preallocated (drivers x points) arrays, so memory is capacity x points x 24 bytes
+"""
+import math
+import os
+import threading
+
+import numpy as np
+
+from services.geo import KM_PER_DEGREE_LAT
+
+# Points kept per driver; the oldest is overwritten once the ring is full
+TRAJECTORY_POINTS = int(os.getenv('TRAJECTORY_POINTS', '120'))
+# Tracks only return points from this far back
+TRAJECTORY_WINDOW_SECONDS = float(os.getenv('TRAJECTORY_WINDOW_SECONDS', '600'))
+# Default Douglas-Peucker tolerance for compressed tracks
+TRAJECTORY_SIMPLIFY_METERS = float(os.getenv('TRAJECTORY_SIMPLIFY_METERS', '10'))
+INITIAL_DRIVERS = 1024
+
+
+def simplify(lats, lons, tolerance_meters):
+    """
+    Douglas-Peucker simplification of a polyline. Returns the indices of
+    the points kept; the first and last are always kept.
+    """
+    count = len(lats)
+    if count < 3:
+        return np.arange(count)
+    
+    # Local equirectangular projection in metres is accurate enough at track scale
+    y = (np.asarray(lats) - lats[0]) * KM_PER_DEGREE_LAT * 1000
+    x = (np.asarray(lons) - lons[0]) * KM_PER_DEGREE_LAT * 1000 * math.cos(math.radians(lats[0]))
+    
+    keep = np.zeros(count, dtype=np.bool_)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(px * dy - py * dx) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_meters:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+class TrajectoryStore:
+    """Ring buffer of the last TRAJECTORY_POINTS positions per driver"""
+    
+    def __init__(self, points=TRAJECTORY_POINTS, window_seconds=TRAJECTORY_WINDOW_SECONDS,
+                 capacity=INITIAL_DRIVERS):
+        self.points = points
+        self.window_seconds = window_seconds
+        self.lats = np.zeros((capacity, points), dtype=np.float64)
+        self.lons = np.zeros((capacity, points), dtype=np.float64)
+        self.timestamps = np.zeros((capacity, points), dtype=np.float64)
+        # Next write position and number of points held, per slot
+        self.heads = np.zeros(capacity, dtype=np.int32)
+        self.counts = np.zeros(capacity, dtype=np.int32)
+        # driver_id -> slot
+        self.slots = {}
+        self.free = []
+        self.size = 0
+        self.lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.slots)
+    
+    def __contains__(self, driver_id):
+        return driver_id in self.slots
+    
+    def _grow(self):
+        """Double the number of driver rows"""
+        capacity = len(self.heads) * 2
+        for name in ('lats', 'lons', 'timestamps'):
+            column = getattr(self, name)
+            resized = np.zeros((capacity, self.points), dtype=column.dtype)
+            resized[:len(column)] = column
+            setattr(self, name, resized)
+        for name in ('heads', 'counts'):
+            column = getattr(self, name)
+            resized = np.zeros(capacity, dtype=column.dtype)
+            resized[:len(column)] = column
+            setattr(self, name, resized)
+    
+    def append(self, driver_id, lat, lon, timestamp):
+        """Record a position, overwriting the driver's oldest point once the ring is full"""
+        with self.lock:
+            slot = self.slots.get(driver_id)
+            if slot is None:
+                if self.free:
+                    slot = self.free.pop()
+                else:
+                    if self.size == len(self.heads):
+                        self._grow()
+                    slot = self.size
+                    self.size += 1
+                self.slots[driver_id] = slot
+                self.heads[slot] = 0
+                self.counts[slot] = 0
+            
+            head = self.heads[slot]
+            self.lats[slot, head] = lat
+            self.lons[slot, head] = lon
+            self.timestamps[slot, head] = timestamp
+            self.heads[slot] = (head + 1) % self.points
+            self.counts[slot] = min(self.counts[slot] + 1, self.points)
+    
+    def remove(self, driver_id):
+        """Drop a driver's track; returns False if none was held"""
+        with self.lock:
+            slot = self.slots.pop(driver_id, None)
+            if slot is None:
+                return False
+            self.free.append(slot)
+            return True
+    
+    def track(self, driver_id, seconds=None):
+        """
+        Oldest-first (lats, lons, timestamps) arrays of a driver's points
+        from the last `seconds` (default: the store's window) before their
+        newest point. Returns None for an unknown driver.
+        """
+        with self.lock:
+            slot = self.slots.get(driver_id)
+            if slot is None:
+                return None
+            count = self.counts[slot]
+            order = (self.heads[slot] - count + np.arange(count)) % self.points
+            lats = self.lats[slot, order]
+            lons = self.lons[slot, order]
+            timestamps = self.timestamps[slot, order]
+        
+        seconds = self.window_seconds if seconds is None else seconds
+        if count:
+            recent = timestamps >= timestamps[-1] - seconds
+            lats, lons, timestamps = lats[recent], lons[recent], timestamps[recent]
+        return lats, lons, timestamps
+    
+    def compressed_track(self, driver_id, seconds=None, tolerance_meters=TRAJECTORY_SIMPLIFY_METERS):
+        """Like track, reduced with Douglas-Peucker to within tolerance_meters of the original"""
+        track = self.track(driver_id, seconds)
+        if track is None:
+            return None
+        lats, lons, timestamps = track
+        kept = simplify(lats, lons, tolerance_meters)
+        return lats[kept], lons[kept], timestamps[kept]
@@ -7,6 +7,7 @@ import os
 import asyncio
 import json
 import logging
+import math
 from typing import Dict, Set
 from datetime import datetime
 
@@ -15,6 +16,10 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from fastapi import WebSocket, WebSocketDisconnect
 from config.kafka_config import KafkaConsumerWrapper, TOPICS
+from services.geo import within_radius
+from services.location_snapshot import columns_from_locations, locations_from_columns
+from services.location_store import STALE_SECONDS, EVICT_SECONDS, TTL_TICK_SECONDS
+from services.timing_wheel import TimingWheel
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -31,6 +36,10 @@ class ConnectionManager:
         self.ride_connections: Dict[int, Set[WebSocket]] = {}
         # Store driver locations in memory
         self.driver_locations: Dict[int, dict] = {}
+        # Locations past the stale TTL are hidden; past the eviction TTL they are dropped
+        self.stale_drivers: Set[int] = set()
+        self.stale_wheel = TimingWheel(TTL_TICK_SECONDS)
+        self.evict_wheel = TimingWheel(TTL_TICK_SECONDS)
         
     async def connect_rider(self, rider_id: int, websocket: WebSocket):
         """Connect a rider's WebSocket"""
@@ -134,7 +143,8 @@ class ConnectionManager:
                     "driver_id": driver_id,
                     **location
                 }
-                for driver_id, location in self.driver_locations.items()
+                for driver_id, location in list(self.driver_locations.items())
+                if driver_id not in self.stale_drivers
             ],
             "timestamp": datetime.now().isoformat()
         }
@@ -151,39 +161,83 @@ class ConnectionManager:
             "vehicle_type": location_data.get("vehicle_type"),
             "timestamp": location_data.get("timestamp", datetime.now().timestamp())
         }
+        now = datetime.now().timestamp()
+        self.stale_drivers.discard(driver_id)
+        self.stale_wheel.schedule(driver_id, now + STALE_SECONDS)
+        self.evict_wheel.schedule(driver_id, now + EVICT_SECONDS)
         
     def remove_driver_location(self, driver_id: int):
         """Remove driver location when they go offline"""
         if driver_id in self.driver_locations:
             del self.driver_locations[driver_id]
+        self.stale_drivers.discard(driver_id)
+        self.stale_wheel.cancel(driver_id)
+        self.evict_wheel.cancel(driver_id)
+    
+    def snapshot_columns(self):
+        """Fresh driver locations as snapshot columns, plus the vehicle-type names"""
+        return columns_from_locations([
+            (driver_id, location)
+            for driver_id, location in list(self.driver_locations.items())
+            if driver_id not in self.stale_drivers
+        ])
+    
+    def restore_driver_locations(self, columns, vehicle_types, taken_at):
+        """Load driver locations from snapshot columns; TTLs count from taken_at"""
+        self.driver_locations.update(locations_from_columns(columns, vehicle_types))
+        driver_ids = columns['driver_ids'].tolist()
+        self.stale_wheel.schedule_many(driver_ids, taken_at + STALE_SECONDS)
+        self.evict_wheel.schedule_many(driver_ids, taken_at + EVICT_SECONDS)
+    
+    def expire_driver_locations(self, now=None):
+        """
+        Advance the TTL wheels: hide drivers past the stale TTL and drop
+        drivers past the eviction TTL. Returns (stale_ids, evicted_ids).
+        """
+        stale_ids = [
+            driver_id for driver_id in self.stale_wheel.advance(now)
+            # A ping may have rescheduled the driver since the wheel let go of it
+            if driver_id in self.driver_locations and driver_id not in self.stale_wheel
+        ]
+        self.stale_drivers.update(stale_ids)
+        
+        evicted_ids = [
+            driver_id for driver_id in self.evict_wheel.advance(now)
+            if driver_id not in self.evict_wheel
+        ]
+        for driver_id in evicted_ids:
+            self.remove_driver_location(driver_id)
+        return stale_ids, evicted_ids
             
     def get_nearby_drivers(self, lat: float, lon: float, radius_km: float = 5) -> list:
-        """Get drivers within a certain radius"""
-        import math
+        """Get drivers within a certain radius, nearest first"""
+        # The consumer and expiry threads remove drivers while this runs, so
+        # entries that vanished between the two steps are skipped
+        driver_ids = []
+        locations = []
+        for driver_id in list(self.driver_locations):
+            location = self.driver_locations.get(driver_id)
+            if location is None or driver_id in self.stale_drivers:
+                continue
+            driver_ids.append(driver_id)
+            locations.append(location)
         
-        nearby_drivers = []
-        
-        for driver_id, location in self.driver_locations.items():
-            # Haversine distance calculation
-            R = 6371  # Earth's radius in km
-            
-            lat1_rad = math.radians(lat)
-            lat2_rad = math.radians(location['lat'])
-            delta_lat = math.radians(location['lat'] - lat)
-            delta_lon = math.radians(location['lon'] - lon)
-            
-            a = math.sin(delta_lat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon / 2) ** 2
-            c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-            distance = R * c
-            
-            if distance <= radius_km:
-                nearby_drivers.append({
-                    'driver_id': driver_id,
-                    'location': location,
-                    'distance': round(distance, 2)
-                })
+        # Drivers without a position yet become NaN and never match
+        indices, distances = within_radius(
+            lat, lon,
+            [location['lat'] if location['lat'] is not None else math.nan for location in locations],
+            [location['lon'] if location['lon'] is not None else math.nan for location in locations],
+            radius_km
+        )
         
-        return sorted(nearby_drivers, key=lambda x: x['distance'])
+        return [
+            {
+                'driver_id': driver_ids[index],
+                'location': locations[index],
+                'distance': round(float(distance), 2)
+            }
+            for index, distance in zip(indices, distances)
+        ]
 
 
 # Global connection manager instance
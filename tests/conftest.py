@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Tests import the services the same way the services import each other
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Services build their engine at import; tests that touch the database use their own
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
@@ -0,0 +1,59 @@
+"""
+An idle consumer that has read everything must report zero lag, on the
+plain loop as well as in batch mode
+"""
+import threading
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+
+from config import kafka_config
+from config.kafka_config import KafkaConsumerWrapper
+from config.memory_broker import MemoryProducer
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def lag(topic, group, partition):
+    return REGISTRY.get_sample_value(
+        'kafka_consumer_lag', {'topic': topic, 'group': group, 'partition': str(partition)}
+    )
+
+
+@pytest.mark.parametrize('batch_size', [None, 50])
+def test_lag_drops_to_zero_once_drained(monkeypatch, batch_size):
+    monkeypatch.setattr(kafka_config, 'KAFKA_TRANSPORT', 'memory')
+    # Throttled like production, so the last refresh during the burst still shows lag
+    monkeypatch.setattr(kafka_config, 'CONSUMER_LAG_INTERVAL_SECONDS', 0.2)
+    monkeypatch.setattr(kafka_config, 'CONSUMER_POLL_TIMEOUT_MS', 50)
+    topic = f"lag-test-{batch_size}"
+    group = f"lag-test-group-{batch_size}"
+    
+    received = []
+    callback = received.extend if batch_size else received.append
+    consumer = KafkaConsumerWrapper(topic, group, callback, batch_size=batch_size, batch_timeout_ms=50)
+    thread = threading.Thread(target=consumer.start_consuming, daemon=True)
+    thread.start()
+    # Messages sent before the first assignment would be skipped by auto_offset_reset=latest
+    assert wait_for(lambda: consumer.consumer is not None and consumer.consumer.assignment())
+    partitions = [topic_partition.partition for topic_partition in consumer.consumer.assignment()]
+    
+    producer = MemoryProducer(value_serializer=kafka_config.MessageSerializer({}, mode='json'),
+                              key_serializer=lambda key: key.encode('utf-8'))
+    for index in range(300):
+        producer.send(topic, {'index': index}, key=str(index))
+    
+    assert wait_for(lambda: len(received) == 300)
+    try:
+        assert wait_for(lambda: all(lag(topic, group, partition) == 0 for partition in partitions))
+    finally:
+        consumer.stop_consuming()
+        thread.join(5)
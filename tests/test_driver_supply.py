@@ -0,0 +1,29 @@
+"""
+Pings that trail a driver's offline event must not put them back in the supply index
+"""
+from services.driver_supply import DriverSupply
+
+
+def availability(driver_id, is_online):
+    return {
+        'driver_id': driver_id, 'is_online': is_online,
+        'driver_name': 'Driver', 'rating': 5.0, 'vehicle_type': 'sedan',
+        'lat': 40.758, 'lon': -73.9855
+    }
+
+
+def ping(driver_id):
+    return {'driver_id': driver_id, 'lat': 40.7585, 'lon': -73.9850, 'vehicle_type': 'sedan'}
+
+
+def test_ping_after_offline_is_ignored_until_online_again():
+    supply = DriverSupply()
+    supply.handle_availability_update(availability(1, True))
+    supply.handle_availability_update(availability(1, False))
+    
+    supply.handle_location_update(ping(1))
+    assert 1 not in supply.index
+    
+    supply.handle_availability_update(availability(1, True))
+    supply.handle_location_update(ping(1))
+    assert 1 in supply.index
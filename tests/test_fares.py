@@ -0,0 +1,18 @@
+"""
+Quotes only price vehicle types in the tariff table; internal pricing keeps the fallback
+"""
+import pytest
+
+from services.fares import FALLBACK_TARIFF, TariffTable
+
+
+def test_quote_rejects_unknown_vehicle_type():
+    table = TariffTable()
+    with pytest.raises(ValueError):
+        table.quote(40.758, -73.9855, 40.7484, -73.9857, ['boat'])
+
+
+def test_fare_falls_back_for_unknown_vehicle_type():
+    table = TariffTable()
+    assert 'boat' not in table
+    assert table.fare(2.0, 'boat') == FALLBACK_TARIFF['base'] + 2.0 * FALLBACK_TARIFF['per_km']
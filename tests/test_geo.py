@@ -0,0 +1,73 @@
+"""
+Radius and nearest-neighbour queries must agree with brute-force haversine,
+including for points right at the edge of the radius
+"""
+import math
+import random
+
+from services.geo import EARTH_RADIUS_KM, KM_PER_DEGREE_LAT, haversine_km, within_radius
+from services.spatial_index import GridIndex
+
+
+def test_degree_length_matches_earth_radius():
+    assert math.isclose(haversine_km(0, 0, 1, 0), KM_PER_DEGREE_LAT, rel_tol=1e-9)
+    assert math.isclose(KM_PER_DEGREE_LAT, math.pi * EARTH_RADIUS_KM / 180)
+
+
+def test_within_radius_keeps_points_on_the_boundary():
+    lat, lon, radius_km = 40.758, -73.9855, 2.0
+    # Due north and south, just inside the radius: the latitude band must not drop them
+    inside = math.degrees(radius_km * 0.9999 / EARTH_RADIUS_KM)
+    lats = [lat + inside, lat - inside, lat + math.degrees(2 * radius_km / EARTH_RADIUS_KM)]
+    lons = [lon, lon, lon]
+    
+    indices, _ = within_radius(lat, lon, lats, lons, radius_km)
+    assert sorted(indices.tolist()) == [0, 1]
+
+
+def test_within_radius_matches_brute_force():
+    rng = random.Random(7)
+    lat, lon, radius_km = 40.758, -73.9855, 3.0
+    lats = [lat + rng.uniform(-0.05, 0.05) for _ in range(5000)]
+    lons = [lon + rng.uniform(-0.05, 0.05) for _ in range(5000)]
+    
+    indices, _ = within_radius(lat, lon, lats, lons, radius_km)
+    expected = [i for i in range(len(lats)) if haversine_km(lat, lon, lats[i], lons[i]) <= radius_km]
+    assert sorted(indices.tolist()) == expected
+
+
+def test_grid_nearest_matches_brute_force():
+    rng = random.Random(11)
+    index = GridIndex(cell_size_deg=0.01)
+    points = {}
+    for driver_id in range(3000):
+        point = (40.758 + rng.uniform(-0.1, 0.1), -73.9855 + rng.uniform(-0.1, 0.1))
+        points[driver_id] = point
+        index.upsert(driver_id, point[0], point[1], 'sedan')
+    
+    for _ in range(50):
+        lat, lon = 40.758 + rng.uniform(-0.1, 0.1), -73.9855 + rng.uniform(-0.1, 0.1)
+        found = [entry['driver_id'] for entry in index.nearest(lat, lon, 'sedan', k=10)]
+        expected = sorted(points, key=lambda driver_id: haversine_km(lat, lon, *points[driver_id]))[:10]
+        assert found == expected
+
+
+def test_grid_bounds_shrink_when_edge_drivers_leave():
+    index = GridIndex(cell_size_deg=0.01)
+    index.upsert(1, 40.75, -73.98, 'sedan')
+    index.upsert(2, 41.75, -72.98, 'sedan')
+    index.upsert(3, 40.76, -73.97, 'sedan')
+    
+    (row1, col1), (row3, col3) = index.cell_of(40.75, -73.98), index.cell_of(40.76, -73.97)
+    
+    index.remove(2)
+    assert index.bounds['sedan'] == [row1, row3, col1, col3]
+    
+    # Moving the last far-out driver back in shrinks the box as well
+    index.upsert(3, 40.75, -73.98, 'sedan')
+    assert index.bounds['sedan'] == [row1, row1, col1, col1]
+    
+    index.remove(1)
+    index.remove(3)
+    assert 'sedan' not in index.bounds
+    assert index.nearest(40.75, -73.98, 'sedan') == []
@@ -0,0 +1,52 @@
+"""
+A driver forgotten while a flush is in progress must not be brought back by
+a ping that flush had already taken
+"""
+import threading
+
+from services.location_coalescer import LocationCoalescer
+
+
+def ping(driver_id, timestamp=1.0):
+    return {'driver_id': driver_id, 'lat': 40.758, 'lon': -73.9855, 'timestamp': timestamp}
+
+
+def test_ping_taken_by_flush_is_dropped_after_forget():
+    applied = []
+    
+    def handler(message):
+        applied.append(message['driver_id'])
+        # Driver 2 goes offline while the flush is still working through its batch
+        if message['driver_id'] == 1:
+            coalescer.forget(2)
+    
+    coalescer = LocationCoalescer(handler, 'test', window_ms=1000)
+    coalescer.submit(ping(1))
+    coalescer.submit(ping(2))
+    coalescer.flush()
+    
+    assert applied == [1]
+    assert 2 not in coalescer.applied
+
+
+def test_forget_waits_for_a_ping_being_applied():
+    entered, release = threading.Event(), threading.Event()
+    
+    def handler(message):
+        entered.set()
+        release.wait(5)
+    
+    coalescer = LocationCoalescer(handler, 'test', window_ms=0)
+    applying = threading.Thread(target=coalescer.submit, args=(ping(1),))
+    applying.start()
+    assert entered.wait(5)
+    
+    forgetting = threading.Thread(target=coalescer.forget, args=(1,))
+    forgetting.start()
+    forgetting.join(0.1)
+    assert forgetting.is_alive()
+    
+    release.set()
+    forgetting.join(5)
+    applying.join(5)
+    assert not forgetting.is_alive()
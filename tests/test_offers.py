@@ -0,0 +1,125 @@
+"""
+An offer is settled by whichever of accepted, declined or expired reaches
+ride-updates first; matching and the ride service must agree on the winner
+"""
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.database import Base, Ride
+from services.dispatch import Offer
+from services.matching_service import MatchingService
+from services.reservations import LocalReservations
+from services.retry_queue import PendingRide
+from services.ride_service import RideService
+
+RIDE_ID = 10
+
+
+class RecordingProducer:
+    def __init__(self):
+        self.sent = []
+    
+    def send_message(self, topic, message, key=None):
+        self.sent.append((topic, message))
+        return True
+
+
+def candidate(driver_id):
+    return {
+        'driver_id': driver_id,
+        'driver_name': f"Driver {driver_id}",
+        'distance': 1.0,
+        'vehicle_type': 'sedan',
+        'rating': 5.0
+    }
+
+
+@pytest.fixture
+def service():
+    service = MatchingService(producer=RecordingProducer(), reservations=LocalReservations())
+    message = {
+        'ride_id': RIDE_ID,
+        'pickup_lat': 40.758, 'pickup_lon': -73.9855,
+        'destination_lat': 40.7484, 'destination_lon': -73.9857,
+        'vehicle_type': 'sedan'
+    }
+    # Driver 1 holds an offer that has already run out; driver 2 is next in line
+    offer = Offer(PendingRide(message, time.time()), [candidate(2)])
+    service.reservations.reserve(1, RIDE_ID)
+    service.offers.track(offer, candidate(1), timeout_seconds=0)
+    assert service.offers.take_expired(timeout=0) == [offer]
+    return service
+
+
+def update(status, driver_id):
+    return {'ride_id': RIDE_ID, 'driver_id': driver_id, 'status': status, 'timestamp': time.time()}
+
+
+def test_acceptance_before_expiry_wins(service):
+    service.handle_ride_update(update('accepted', 1))
+    service.handle_ride_update(update('expired', 1))
+    
+    assert service.reservations.holds[1] == (RIDE_ID, None)
+    assert 2 not in service.reservations.holds
+    assert service.producer.sent == []
+
+
+def test_expiry_before_acceptance_moves_on(service):
+    service.handle_ride_update(update('expired', 1))
+    service.handle_ride_update(update('accepted', 1))
+    
+    assert 1 not in service.reservations.holds
+    assert service.reservations.holds[2][0] == RIDE_ID
+    assert [message['driver_id'] for _, message in service.producer.sent] == [2]
+    assert service.offers.get(RIDE_ID).driver_id == 2
+
+
+def test_declined_ride_is_requeued_with_its_attempts(service):
+    offer = service.offers.get(RIDE_ID)
+    offer.ride.attempts = 2
+    # Driver 1 turns up again among the fallbacks and must be skipped
+    offer.candidates.clear()
+    offer.candidates.append(candidate(1))
+    
+    service.handle_ride_update(update('declined', 1))
+    
+    assert service.retry_queue.pending[RIDE_ID] is offer.ride
+    assert offer.ride.attempts == 3
+    assert offer.ride.excluded == {1}
+    assert service.producer.sent == []
+
+
+def test_expiry_keeps_a_confirmed_hold():
+    reservations = LocalReservations()
+    reservations.reserve(1, RIDE_ID)
+    reservations.confirm(1, RIDE_ID)
+    
+    assert not reservations.withdraw(1, RIDE_ID)
+    assert reservations.holds[1] == (RIDE_ID, None)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Ride(id=RIDE_ID, rider_id=1, driver_id=1, status='matched',
+                     pickup_lat=40.758, pickup_lon=-73.9855, pickup_address='Times Square',
+                     destination_lat=40.7484, destination_lon=-73.9857, destination_address='Empire State Building',
+                     vehicle_type='sedan'))
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_ride_service_drops_expiry_after_acceptance(db):
+    rides = RideService.__new__(RideService)
+    rides.apply_ride_update(db, update('accepted', 1))
+    rides.apply_ride_update(db, update('expired', 1))
+    
+    ride = db.get(Ride, RIDE_ID)
+    assert ride.status == 'accepted'
+    assert ride.driver_id == 1
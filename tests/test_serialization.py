@@ -0,0 +1,20 @@
+"""
+JSON mode must stay readable by consumers that predate the codec byte
+"""
+import json
+
+from config.serialization import JSON_V1, MessageDeserializer, MessageSerializer
+
+MESSAGE = {'ride_id': 7, 'status': 'accepted', 'timestamp': 1.5}
+
+
+def test_json_mode_writes_bare_json():
+    data = MessageSerializer({}, mode='json').serialize('ride-updates', MESSAGE)
+    assert data == json.dumps(MESSAGE).encode('utf-8')
+    assert MessageDeserializer().deserialize('ride-updates', data) == MESSAGE
+
+
+def test_binary_mode_envelopes_json_fallback():
+    data = MessageSerializer({}, mode='binary').serialize('ride-updates', MESSAGE)
+    assert data[0] == JSON_V1
+    assert MessageDeserializer().deserialize('ride-updates', data) == MESSAGE